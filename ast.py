@@ -5,9 +5,7 @@ import bongtypes
 import symbol_tree
 import typing
 from flatlist import FlatList
-import functools # reduce
-import itertools # chain
-import sys
+from line_index import LineIndex
 import collections
 
 # A "location" of tokens/nodes is defined as
@@ -19,6 +17,11 @@ import collections
 Location = typing.Tuple[str, int, int, int, int, bool]
 
 class BaseNode:
+    # The source span of a node is stored as line index of the source file,
+    # start offset and end offset (exclusive). The line_index.LineIndex also
+    # holds the file's path. It is shared by all tokens and nodes of one file,
+    # so it is a compact file id that survives pickling (module cache).
+    __slots__ = ("source", "start", "end", "inner_nodes")
     def __init__(self, tokens : typing.List[token.Token], inner_nodes): # inner_nodes : List[BaseNode]
         if type(self) == BaseNode:
             raise Exception("BaseNode should not be initialized directly")
@@ -26,43 +29,49 @@ class BaseNode:
         assert isinstance(inner_nodes, list)
         if len(inner_nodes):
             assert isinstance(inner_nodes[0], BaseNode)
-        self.tokens = tokens
-        self.inner_nodes = inner_nodes
+        # Stored as tuple which is smaller than a list (and shared for all
+        # nodes without inner nodes)
+        self.inner_nodes : typing.Sequence[BaseNode] = tuple(inner_nodes)
+        # The tokens are only needed to compute the span, they are not
+        # kept so that they can be released after parsing.
+        self.source : typing.Optional[LineIndex] = None
+        self.start = self.end = 0
+        self.extend_span(tokens, inner_nodes)
+
+    # Extend the span to cover the given tokens and nodes. Tokens or nodes
+    # from another file than the first one (which should not happen) are
+    # ignored.
+    def extend_span(self, tokens : typing.Iterable[token.Token], nodes : typing.Iterable[BaseNode] = ()):
+        source, start, end = self.source, self.start, self.end
+        for tok in tokens:
+            if source == None:
+                source, start, end = tok.line_index, tok.offset, tok.offset + tok.length
+            elif tok.line_index is source:
+                if tok.offset < start:
+                    start = tok.offset
+                if tok.offset + tok.length > end:
+                    end = tok.offset + tok.length
+        for node in nodes:
+            if node.source == None:
+                continue
+            if source == None:
+                source, start, end = node.source, node.start, node.end
+            elif node.source is source:
+                if node.start < start:
+                    start = node.start
+                if node.end > end:
+                    end = node.end
+        self.source, self.start, self.end = source, start, end
 
     def get_location(self) -> Location:
-        locations = itertools.chain(map(tok2loc, self.tokens), map(nod2loc, self.inner_nodes))
-        return functools.reduce(location_minmax, locations, ("Unknown Location!", 0, 0, 0, 0, False))
-
-def tok2loc(tok : Token) -> Location:
-    """
-        self.filepath = filepath
-        self.line = line
-        self.col = col
-        self.length = length
-    """
-    return (tok.filepath, tok.line, tok.col, tok.line, tok.col+tok.length-1, True)
-def nod2loc(node : BaseNode) -> Location:
-    return node.get_location()
-def location_minmax(lhs : Location, rhs : Location) ->  Location:
-    if lhs[5] != rhs[5]: # If only one valid location ...
-        return lhs if lhs[5] else rhs # ... return the valid one
-    if lhs[0] != rhs[0]:
-        print("Filenames of tokens / ast-nodes do not match! Using filename of leftmost item.", file=sys.stderr)
-    if lhs[1] < rhs[1]:
-        minline, mincol = lhs[1], lhs[2]
-    elif rhs[1] < lhs[1]:
-        minline, mincol = rhs[1], rhs[2]
-    else:
-        minline, mincol = lhs[1], min(lhs[2], rhs[2])
-    if lhs[3] > rhs[3]:
-        maxline, maxcol = lhs[3], lhs[4]
-    elif rhs[3] > lhs[3]:
-        maxline, maxcol = rhs[3], rhs[4]
-    else:
-        maxline, maxcol = lhs[3], max(lhs[4], rhs[4])
-    return (lhs[0], minline, mincol, maxline, maxcol, True)
+        if self.source == None:
+            return ("Unknown Location!", 0, 0, 0, 0, False)
+        line, col = self.source.position(self.start)
+        endline, endcol = self.source.position(max(self.start, self.end-1))
+        return (self.source.filepath, line, col, endline, endcol, True)
 
 class Program(BaseNode):
+    __slots__ = ("modules", "main_unit")
     def __init__(self,
             modules : typing.Dict[str, TranslationUnit],
             main_unit : TranslationUnit):
@@ -76,6 +85,7 @@ class Program(BaseNode):
         return f"ast.Program:\n{self.main_unit}"
 
 class TranslationUnit(BaseNode):
+    __slots__ = ("statements", "import_statements", "struct_definitions", "function_definitions", "symbols_global", "frame_size")
     def __init__(self,
             import_statements : typing.List[Import],
             struct_definitions : collections.OrderedDict[str, StructDefinition],
@@ -93,6 +103,9 @@ class TranslationUnit(BaseNode):
         self.struct_definitions = struct_definitions
         self.function_definitions = function_definitions
         self.symbols_global = symbols_global
+        # Number of frame slots required by the top-level statements, set by
+        # the typechecker
+        self.frame_size = 0
     def __str__(self):
         """ Alternative string representation that contains the symbol table, too
         program = "Program {\n"
@@ -110,20 +123,27 @@ class TranslationUnit(BaseNode):
         return "{\n" + "\n".join(stmts) + "\n}"
 
 class ExpressionList(FlatList, BaseNode):
+    __slots__ = ("elements",)
     def __init__(self, tokens : typing.List[Token], elements : typing.List[BaseNode]):
         super().__init__(elements)
         # Initializing BaseNode has to be done manually because of the python
         # multiple inheritance approach
-        self.tokens = tokens
         # Use Python's turbo-error:
         # self.inner_nodes = elements causes BaseNode.inner_nodes to be a
         # reference to the same list as FlatList.elements. Like this,
         # ExpressionList.append() adds the element for FlatList and for BaseNode
         self.inner_nodes = elements
+        self.source = None
+        self.start = self.end = 0
+        self.extend_span(tokens, elements)
+    def append(self, element):
+        super().append(element)
+        self.extend_span((), [element])
     def __str__(self):
         return ", ".join(map(str,self.elements))
 
 class Block(BaseNode):
+    __slots__ = ("stmts",)
     def __init__(self, tokens : typing.List[Token], stmts : typing.List[BaseNode]):
         super().__init__(tokens, stmts)
         self.stmts = stmts
@@ -134,6 +154,7 @@ class Block(BaseNode):
         return "{\n" + "\n".join(result) + "\n}"
 
 class Import(BaseNode):
+    __slots__ = ("name", "path")
     def __init__(self, tokens : typing.List[Token], name: str, path: str):
         super().__init__(tokens, [])
         self.name = name
@@ -142,9 +163,14 @@ class Import(BaseNode):
         return "import " + self.path + " as " + self.name;
 
 class Return(BaseNode):
+    __slots__ = ("result", "tail_call")
     def __init__(self, tokens : typing.List[Token], result=None):
         super().__init__(tokens, [result] if result!=None else [])
         self.result = result
+        # The call of a bong function if the whole result is its result, so
+        # that the call can replace the current call (tail call). Set by the
+        # typechecker for return statements in functions.
+        self.tail_call : typing.Optional[FunctionCall] = None
     def __str__(self):
         result = "return"
         if self.result != None:
@@ -153,15 +179,19 @@ class Return(BaseNode):
         return result
 
 class BinOp(BaseNode):
+    __slots__ = ("lhs", "op", "rhs", "operation")
     def __init__(self, tokens : typing.List[Token], lhs : BaseNode, op : str, rhs : BaseNode):
         super().__init__(tokens, [lhs, rhs])
         self.lhs = lhs
         self.op = op
         self.rhs = rhs
+        # Specialised operation, set by the typechecker, see operations.py
+        self.operation = ""
     def __str__(self):
         return "("+str(self.lhs)+self.op+str(self.rhs)+")"
 
 class AssignOp(BaseNode):
+    __slots__ = ("lhs", "rhs")
     def __init__(self, tokens : typing.List[Token], lhs: ExpressionList, rhs: typing.Union[ExpressionList, AssignOp]):
         super().__init__(tokens, [lhs, rhs])
         self.lhs = lhs
@@ -170,14 +200,18 @@ class AssignOp(BaseNode):
         return "("+str(self.lhs)+"="+str(self.rhs)+")"
 
 class UnaryOp(BaseNode):
+    __slots__ = ("op", "rhs", "operation")
     def __init__(self, tokens : typing.List[Token], op, rhs):
         super().__init__(tokens, [rhs])
         self.op = op
         self.rhs = rhs
+        # Specialised operation, set by the typechecker, see operations.py
+        self.operation = ""
     def __str__(self):
         return "("+str(self.op)+str(self.rhs)+")"
 
 class Integer(BaseNode):
+    __slots__ = ("value",)
     def __init__(self, tokens : typing.List[Token], value):
         super().__init__(tokens, [])
         self.value = value
@@ -185,6 +219,7 @@ class Integer(BaseNode):
         return str(self.value)
 
 class Float(BaseNode):
+    __slots__ = ("value",)
     def __init__(self, tokens : typing.List[Token], value):
         super().__init__(tokens, [])
         self.value = value
@@ -192,6 +227,7 @@ class Float(BaseNode):
         return str(self.value)
 
 class String(BaseNode):
+    __slots__ = ("value",)
     def __init__(self, tokens : typing.List[Token], value):
         super().__init__(tokens, [])
         self.value = value
@@ -199,6 +235,7 @@ class String(BaseNode):
         return str(self.value)
 
 class Bool(BaseNode):
+    __slots__ = ("value",)
     def __init__(self, tokens : typing.List[Token], value):
         super().__init__(tokens, [])
         self.value = value
@@ -206,15 +243,34 @@ class Bool(BaseNode):
         return "true" if self.value == True else "false"
 
 class IndexAccess(BaseNode):
+    __slots__ = ("lhs", "rhs", "escapes")
     def __init__(self, tokens : typing.List[Token], lhs : BaseNode, rhs : BaseNode): # lhs : Identifier or DotAccess, rhs : Expression
         super().__init__(tokens, [lhs, rhs])
         self.lhs = lhs
         self.rhs = rhs
+        # The element (or a value contained in it) is kept elsewhere, e.g.
+        # 'let row = m[0]' or 'let row = m["a"]', set by the typechecker
+        # (see bongvalues.escape())
+        self.escapes = False
     def __str__(self):
         return str(self.lhs) + "[" + str(self.rhs) + "]"
 
+# lhs[low:high], both bounds are optional
+class SliceAccess(BaseNode):
+    __slots__ = ("lhs", "low", "high")
+    def __init__(self, tokens : typing.List[Token], lhs : BaseNode, low : typing.Optional[BaseNode], high : typing.Optional[BaseNode]):
+        super().__init__(tokens, [lhs] + [bound for bound in (low, high) if bound != None])
+        self.lhs = lhs
+        self.low = low
+        self.high = high
+    def __str__(self):
+        low = str(self.low) if self.low != None else ""
+        high = str(self.high) if self.high != None else ""
+        return str(self.lhs) + "[" + low + ":" + high + "]"
+
 # TODO Convert to builtin function
 class Print(BaseNode):
+    __slots__ = ("expr",)
     def __init__(self, tokens : typing.List[Token], expr):
         super().__init__(tokens, [expr])
         self.expr = expr
@@ -222,21 +278,28 @@ class Print(BaseNode):
         return "print "+str(self.expr)+";"
 
 class BongtypeIdentifier:
+    __slots__ = ("typename", "num_array_levels", "map_types")
     # For the typename parameter: The first N-1 list items are module names,
     # the last list item is the typename in the sub-sub-sub-module. For a
     # typename in the current module, the list just has length 1.
-    def __init__(self, typename : typing.List[str], num_array_levels : int = 0):
+    # Map types (map[K]V) have the typename ["map"] and the key and value
+    # types as map_types.
+    def __init__(self, typename : typing.List[str], num_array_levels : int = 0, map_types : typing.Optional[typing.Tuple[BongtypeIdentifier, BongtypeIdentifier]] = None):
         self.typename = typename
         self.num_array_levels = num_array_levels
+        self.map_types = map_types
     def __str__(self):
         #s = "BongtypeIdentifier ("
         s = ""
         s += "[]" * self.num_array_levels
         s += ".".join(self.typename)
+        if self.map_types != None:
+            s += f"[{self.map_types[0]}]{self.map_types[1]}"
         # s += ")"
         return s
 
 class Let(BaseNode):
+    __slots__ = ("names", "types", "expr", "symbol_tree_snapshot", "slots")
     def __init__(self, tokens : typing.List[Token], names : typing.List[str], types : typing.List[typing.Optional[BongtypeIdentifier]], expr : typing.Union[ExpressionList, AssignOp], symbol_tree_snapshot : symbol_tree.SymbolTreeNode): # rhs = Expressions or Assignment
         super().__init__(tokens, [expr])
 
@@ -244,6 +307,8 @@ class Let(BaseNode):
         self.types = types
         self.expr = expr
         self.symbol_tree_snapshot = symbol_tree_snapshot
+        # Frame slots of the declared variables, set by the typechecker
+        self.slots : typing.List[int] = []
     def __str__(self):
         names = []
         for name, typ in zip(self.names, self.types):
@@ -255,7 +320,8 @@ class Let(BaseNode):
         return "let " + names + " = " + str(self.expr)
 
 class IfElseStatement(BaseNode):
-    def __init__(self, tokens : typing.List[Token], cond : BaseNode, thn : Block, els : BaseNode = None): # actually, it is: typing.Union[None, Block, IfElseStatement] = None):
+    __slots__ = ("cond", "thn", "els")
+    def __init__(self, tokens : typing.List[Token], cond : BaseNode, thn : Block, els : typing.Optional[BaseNode] = None): # actually, it is: typing.Union[None, Block, IfElseStatement] = None):
         super().__init__(tokens, [cond, thn, els] if isinstance(els, BaseNode) else [cond, thn])
         self.cond = cond
         self.thn = thn
@@ -271,6 +337,7 @@ class IfElseStatement(BaseNode):
         return result
 
 class WhileStatement(BaseNode):
+    __slots__ = ("cond", "t")
     def __init__(self, tokens : typing.List[Token], cond : BaseNode, t : Block):
         super().__init__(tokens, [cond, t])
         self.cond = cond
@@ -279,6 +346,7 @@ class WhileStatement(BaseNode):
         return "while {} {}".format(str(self.cond), str(self.t))
 
 class Pipeline(BaseNode):
+    __slots__ = ("elements", "nonblocking")
     def __init__(self, tokens : typing.List[Token], elements : typing.List[BaseNode], nonblocking):
         super().__init__(tokens, elements)
         self.elements = elements
@@ -290,11 +358,14 @@ class Pipeline(BaseNode):
         return pipeline
 
 class PipelineLet(BaseNode):
+    __slots__ = ("names", "types", "symbol_tree_snapshot", "slots")
     def __init__(self, tokens : typing.List[Token], names : typing.List[str], types : typing.List[typing.Optional[BongtypeIdentifier]], symbol_tree_snapshot : symbol_tree.SymbolTreeNode):
         super().__init__(tokens, [])
         self.names = names
         self.types = types
         self.symbol_tree_snapshot = symbol_tree_snapshot
+        # Frame slots of the declared variables, set by the typechecker
+        self.slots : typing.List[int] = []
     def __str__(self):
         names = []
         for name, typ in zip(self.names, self.types):
@@ -306,6 +377,7 @@ class PipelineLet(BaseNode):
         return "let " + names
 
 class SysCall(BaseNode):
+    __slots__ = ("args",)
     def __init__(self, tokens : typing.List[Token], args : typing.List[str]):
         super().__init__(tokens, [])
         self.args = args
@@ -313,6 +385,7 @@ class SysCall(BaseNode):
         return "(call " + " ".join(self.args) + ")"
 
 class FunctionDefinition(BaseNode):
+    __slots__ = ("name", "parameter_names", "parameter_types", "return_types", "body", "symbol_tree_snapshot", "parameter_slots", "frame_size", "readonly_parameters", "pure", "memoize")
     def __init__(self, tokens : typing.List[Token], name : str, parameter_names : typing.List[str], parameter_types : typing.List[BongtypeIdentifier], return_types : typing.List[BongtypeIdentifier], body : Block, symbol_tree_snapshot : typing.Optional[symbol_tree.SymbolTreeNode]):
         super().__init__(tokens, [body])
         self.name = name
@@ -321,6 +394,19 @@ class FunctionDefinition(BaseNode):
         self.return_types = return_types
         self.body = body
         self.symbol_tree_snapshot = symbol_tree_snapshot
+        # Frame layout, set by the typechecker: The slots of the parameters
+        # and the number of slots required by parameters and all local
+        # variables of the function.
+        self.parameter_slots : typing.List[int] = []
+        self.frame_size = 0
+        # Parameters whose arguments need not be copied, set by the
+        # typechecker, see TypeChecker.parameter_root()
+        self.readonly_parameters : typing.List[bool] = []
+        # Whether the function has no side effects and whether its calls
+        # are memoized, set by the typechecker, see
+        # TypeChecker.infer_purity()
+        self.pure = False
+        self.memoize = False
     def __str__(self):
         parameters = []
         for name, typ in zip(self.parameter_names, self.parameter_types):
@@ -334,6 +420,7 @@ class FunctionDefinition(BaseNode):
         return result
 
 class StructDefinition(BaseNode):
+    __slots__ = ("name", "fields")
     def __init__(self, tokens : typing.List[Token], name : str, fields : typing.Dict[str, BongtypeIdentifier]):
         super().__init__(tokens, [])
         self.name = name
@@ -348,21 +435,30 @@ class StructDefinition(BaseNode):
         return result
 
 class Identifier(BaseNode):
+    __slots__ = ("name", "slot")
     def __init__(self, tokens : typing.List[Token], name : str):
         super().__init__(tokens, [])
         self.name = name
+        # Frame slot if the identifier names a local variable, set by the
+        # typechecker. None for global names (modules, types, functions).
+        self.slot : typing.Optional[int] = None
     def __str__(self):
         return self.name
 
 class DotAccess(BaseNode):
+    __slots__ = ("lhs", "rhs", "field")
     def __init__(self, tokens : typing.List[Token], lhs : BaseNode, rhs : str):
         super().__init__(tokens, [lhs])
         self.lhs = lhs
         self.rhs = rhs
+        # Offset of the field if lhs is a struct value (see
+        # bongvalues.StructValue), set by the typechecker. -1 for modules.
+        self.field = -1
     def __str__(self):
         return str(self.lhs)+"."+self.rhs
 
 class FunctionCall(BaseNode):
+    __slots__ = ("name", "args")
     def __init__(self, tokens : typing.List[Token], name : BaseNode, args):
         super().__init__(tokens, [name, args])
         self.name = name
@@ -377,10 +473,15 @@ class FunctionCall(BaseNode):
         return result
 
 class StructValue(BaseNode):
+    __slots__ = ("name", "fields", "field_names")
     def __init__(self, tokens : typing.List[Token], name : BaseNode, fields : typing.Dict[str, BaseNode]):
         super().__init__(tokens, [name] + list(fields.values()))
         self.name = name
         self.fields = fields
+        # The names of all fields of the struct type, in the order of the
+        # struct value's fields (see bongvalues.StructValue), set by the
+        # typechecker
+        self.field_names : typing.List[str] = []
     def __str__(self):
         result = str(self.name) + " {\n"
         fieldstrings = []
@@ -391,9 +492,13 @@ class StructValue(BaseNode):
         return result
 
 class Array(BaseNode):
+    __slots__ = ("elements", "escapes")
     def __init__(self, tokens : typing.List[Token], elements : ExpressionList):
         super().__init__(tokens, [elements])
         self.elements = elements
+        # An element is referenced elsewhere as well, e.g. '[row]', set by
+        # the typechecker (see bongvalues.escape())
+        self.escapes = False
     def __str__(self):
         elements = []
         for e in self.elements:
@@ -402,3 +507,19 @@ class Array(BaseNode):
         result += ", ".join(elements)
         result += "]"
         return result
+
+# {key : value, ...}
+class Map(BaseNode):
+    __slots__ = ("keys", "values", "escapes")
+    def __init__(self, tokens : typing.List[Token], keys : typing.List[BaseNode], values : typing.List[BaseNode]):
+        super().__init__(tokens, keys + values)
+        self.keys = keys
+        self.values = values
+        # A value is referenced elsewhere as well, set by the typechecker
+        # (see bongvalues.escape())
+        self.escapes = False
+    def __str__(self):
+        entries = []
+        for key, value in zip(self.keys, self.values):
+            entries.append(f"{key} : {value}")
+        return "{" + ", ".join(entries) + "}"
@@ -0,0 +1,481 @@
+#!/usr/bin/python
+
+# Benchmarks for the execution engines. Run with
+# 'python bench_evaluator.py [repetitions]'.
+
+import sys
+import time
+import tracemalloc
+import lexer
+import parser
+import typechecker
+import evaluator
+import closure_eval
+import vm
+import translator
+import memo
+
+ENGINES = [
+        ("tree", evaluator.Eval),
+        ("closure", closure_eval.ClosureEval),
+        ("vm", vm.VM),
+        ("python", translator.CompiledEval),
+        ]
+
+# Loop- and call-heavy programs, examples/program.bon is read from disk
+PROGRAMS = [
+        ("loop", """
+let i = 0
+let sum = 0
+while i < 20000 {
+    if i % 3 == 0 || i % 5 == 0 {
+        sum = sum + i
+    }
+    i = i + 1
+}
+print(sum)
+"""),
+        ("arithmetic", """
+let i = 0
+let n = 0
+let x = 0.5
+while i < 20000 {
+    n = n + i * 3 / 2 - i % 7
+    x = x * 1.0001 - x / 4.0 + 0.5
+    i = i + 1
+}
+print(n)
+print(x)
+"""),
+        ("calls", """
+func fibonacci(n : int) : int {
+    if n <= 1 {
+        return n
+    }
+    return fibonacci(n-1) + fibonacci(n-2)
+}
+print(fibonacci(16))
+"""),
+        ("structs", """
+struct Point { x : int, y : int }
+func step(p : Point, d : int) : Point {
+    return Point { x : p.x + d, y : p.y - d }
+}
+let points = [Point { x : 0, y : 0 }]
+let i = 0
+while i < 300 {
+    points = append(points, step(points[i], i))
+    points[i].x = points[i].y
+    i = i + 1
+}
+print(len(points))
+"""),
+        ]
+
+def compile_program(code, name):
+    p = parser.Parser(lexer.Lexer(code, name))
+    program = typechecker.TypeChecker().checkprogram(p.compile_uncaught())
+    assert(program != None)
+    return program
+
+# Memoization is disabled so that the engines themselves are compared, see
+# bench_memo()
+def bench(programs, repetitions):
+    print(f"Seconds for {repetitions} evaluation(s) of each program (without memoization)")
+    print(f"{'program':>12}" + "".join(f"{name:>10}" for name, engine in ENGINES) + f"{'speedup':>10}")
+    for name, code in programs:
+        program = compile_program(code, name)
+        durations = []
+        for engine_name, engine in ENGINES:
+            outputs = []
+            start = time.perf_counter()
+            for i in range(repetitions):
+                machine = engine(outputs.append)
+                machine.memo.capacity = 0
+                machine.evaluate(program)
+            durations.append(time.perf_counter() - start)
+            # All engines have to print the same
+            if engine_name == ENGINES[0][0]:
+                expected = list(map(str, outputs))
+            assert(list(map(str, outputs)) == expected)
+        speedup = durations[0] / min(durations[1:])
+        print(f"{name:>12}" + "".join(f"{d:>10.4f}" for d in durations) + f"{speedup:>9.1f}x")
+
+# Arrays of growing size are built with append and passed to a function.
+# With copy-on-write arrays, the time per append and per call does not
+# depend on the size of the array.
+SCALING_SIZES = [1000, 4000, 16000]
+SCALING_CALLS = 1000
+BUILD = """
+func first(a : []int) : int {{
+    return a[0]
+}}
+let a = [0]
+let i = 1
+while i < {size} {{
+    a = append(a, i)
+    i = i + 1
+}}
+let sum = 0
+let calls = 0
+while calls < {calls} {{
+    sum = sum + first(a)
+    calls = calls + 1
+}}
+print(len(a))
+"""
+
+def run(program, engine, repetitions, memo_capacity=0):
+    start = time.perf_counter()
+    for i in range(repetitions):
+        machine = engine(lambda values: None)
+        machine.memo.capacity = memo_capacity
+        machine.evaluate(program)
+    return (time.perf_counter() - start) / repetitions
+
+# The duration of the fastest of the given number of evaluations
+def fastest(program, engine, repetitions, memo_capacity=0):
+    return min(run(program, engine, 1, memo_capacity) for i in range(repetitions))
+
+def bench_scaling(repetitions):
+    print(f"Microseconds per append / per call with an array argument")
+    print(f"{'size':>12}" + "".join(f"{name:>18}" for name, engine in ENGINES))
+    for size in SCALING_SIZES:
+        build = compile_program(BUILD.format(size=size, calls=0), "build")
+        calls = compile_program(BUILD.format(size=size, calls=SCALING_CALLS), "calls")
+        columns = []
+        for engine_name, engine in ENGINES:
+            # The calls are timed as the difference of two programs, the
+            # fastest runs are the least noisy. Noise can still make the
+            # difference negative, which is reported as 0.
+            duration = fastest(build, engine, repetitions)
+            per_call = max(0.0, fastest(calls, engine, repetitions) - duration) / SCALING_CALLS
+            columns.append(f"{duration / size * 1e6:.2f} / {per_call * 1e6:.2f}")
+        print(f"{size:>12}" + "".join(f"{column:>18}" for column in columns))
+
+# The recursive fibonacci is pure and memoized, the number of calls drops
+# from exponential to linear
+MEMO_PROGRAM = """
+func fibonacci(n : int) : int {
+    if n <= 1 {
+        return n
+    }
+    return fibonacci(n-1) + fibonacci(n-2)
+}
+print(fibonacci(20))
+"""
+
+def bench_memo(repetitions):
+    print(f"Seconds per evaluation of fibonacci(20) without / with memoization")
+    print(f"{'':>12}" + "".join(f"{name:>18}" for name, engine in ENGINES))
+    program = compile_program(MEMO_PROGRAM, "memo")
+    columns = []
+    for engine_name, engine in ENGINES:
+        plain = run(program, engine, repetitions)
+        memoized = run(program, engine, repetitions, memo.DEFAULT_CAPACITY)
+        columns.append(f"{plain:.4f} / {memoized:.4f}")
+    print(f"{'':>12}" + "".join(f"{column:>18}" for column in columns))
+
+# Memory of an array of struct records, measured after the program ran (the
+# array is kept in the engine's top-level frame), with one struct value per
+# record and with a columnar storage
+RECORDS = 100000
+RECORDS_PROGRAM = """
+struct Record {{ id : int, x : float, y : float }}
+let records = {array}
+let i = 1
+while i < {records} {{
+    records = append(records, Record {{ id : i, x : 0.5, y : 1.5 }})
+    i = i + 1
+}}
+"""
+
+RECORDS_ARRAYS = [
+        ("structs", "[Record {{ id : 0, x : 0.0, y : 0.0 }}]"),
+        ("columnar", "columnar([Record {{ id : 0, x : 0.0, y : 0.0 }}])"),
+        ]
+
+def bench_struct_memory():
+    for name, array in RECORDS_ARRAYS:
+        code = RECORDS_PROGRAM.format(records=RECORDS, array=array.format())
+        program = compile_program(code, "records")
+        machine = vm.VM(lambda values: None)
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        machine.evaluate(program)
+        after = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print(f"Bytes per struct record in an array of {RECORDS} ({name}): {(after - before) / RECORDS:.0f}")
+
+# Summing an array of ints with a bong loop and with the sum builtin, which
+# iterates over the typed storage in C
+NUMBERS = 100000
+LOOP_SUM = """
+let a = range({numbers})
+let total = 0
+let i = 0
+while i < len(a) {{
+    total = total + a[i]
+    i = i + 1
+}}
+print(total)
+"""
+BUILTIN_SUM = """
+let a = range({numbers})
+print(sum(a))
+"""
+
+def bench_typed_arrays(repetitions):
+    print(f"Seconds per sum of {NUMBERS} ints with a loop / with the sum builtin")
+    print(f"{'':>12}" + "".join(f"{name:>18}" for name, engine in ENGINES))
+    loop = compile_program(LOOP_SUM.format(numbers=NUMBERS), "loop-sum")
+    builtin = compile_program(BUILTIN_SUM.format(numbers=NUMBERS), "builtin-sum")
+    columns = []
+    for engine_name, engine in ENGINES:
+        columns.append(f"{run(loop, engine, repetitions):.4f} / {run(builtin, engine, repetitions):.4f}")
+    print(f"{'':>12}" + "".join(f"{column:>18}" for column in columns))
+    machine = vm.VM(lambda values: None)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    machine.evaluate(builtin)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"Bytes per element of an []int of {NUMBERS}: {(after - before) / NUMBERS:.1f}")
+
+# Collection builtins compared with the equivalent bong loops, for arrays of
+# COLLECTION_SIZE elements
+COLLECTION_SIZE = 20000
+COLLECTION_PROGRAMS = [
+        ("index_of", """
+let a = range({size})
+let found = -1
+let i = 0
+while i < len(a) {{
+    if a[i] == {size} - 1 {{
+        found = i
+        i = len(a)
+    }}
+    i = i + 1
+}}
+print(found)
+""", """
+let a = range({size})
+print(index_of(a, {size} - 1))
+"""),
+        ("max", """
+let a = range({size})
+let m = a[0]
+let i = 1
+while i < len(a) {{
+    if a[i] > m {{
+        m = a[i]
+    }}
+    i = i + 1
+}}
+print(m)
+""", """
+let a = range({size})
+print(max(a))
+"""),
+        ("reverse", """
+let a = range({size})
+let r : []int = []
+let i = len(a) - 1
+while i >= 0 {{
+    r = append(r, a[i])
+    i = i - 1
+}}
+print(len(r))
+""", """
+let a = range({size})
+print(len(reverse(a)))
+"""),
+        ("join", """
+let a = fill({size}, "word")
+let s = a[0]
+let i = 1
+while i < len(a) {{
+    s = s + " " + a[i]
+    i = i + 1
+}}
+print(len(s))
+""", """
+let a = fill({size}, "word")
+print(len(join(a, " ")))
+"""),
+        ]
+
+# Text processing: summing the numbers of some command output character by
+# character (like examples/stdlib.bon) and with the string builtins
+TEXT_LINES = 5000
+TEXT_PROGRAMS = [
+        ("chars", """
+let text = join(fill({lines}, "12 34"), "\\n")
+let total = 0
+let word = ""
+let i = 0
+while i < len(text) {{
+    let c = text[i]
+    if c == " " || c == "\\n" {{
+        total = total + to_int(word)
+        word = ""
+    }} else {{
+        word = word + c
+    }}
+    i = i + 1
+}}
+total = total + to_int(word)
+print(total)
+"""),
+        ("builtins", """
+let text = join(fill({lines}, "12 34"), "\\n")
+let words = fields(text)
+let total = 0
+let i = 0
+while i < len(words) {{
+    total = total + to_int(words[i])
+    i = i + 1
+}}
+print(total)
+"""),
+        ]
+
+def bench_text(repetitions):
+    print(f"Seconds per sum of the numbers in {TEXT_LINES} lines of text")
+    print(f"{'':>12}" + "".join(f"{name:>10}" for name, engine in ENGINES))
+    for name, code in TEXT_PROGRAMS:
+        program = compile_program(code.format(lines=TEXT_LINES), name)
+        print(f"{name:>12}" + "".join(f"{run(program, engine, repetitions):>10.4f}" for engine_name, engine in ENGINES))
+
+def bench_collections(repetitions):
+    print(f"Seconds per bong loop / builtin on {COLLECTION_SIZE} elements")
+    print(f"{'builtin':>12}" + "".join(f"{name:>18}" for name, engine in ENGINES))
+    for name, loop, builtin in COLLECTION_PROGRAMS:
+        loop_program = compile_program(loop.format(size=COLLECTION_SIZE), name + "-loop")
+        builtin_program = compile_program(builtin.format(size=COLLECTION_SIZE), name)
+        columns = []
+        for engine_name, engine in ENGINES:
+            columns.append(f"{run(loop_program, engine, repetitions):.4f} / {run(builtin_program, engine, repetitions):.4f}")
+        print(f"{name:>12}" + "".join(f"{column:>18}" for column in columns))
+
+# A 1 MB string built by appending 16 characters at a time. Long strings
+# built by concatenation are appended to in place, see
+# bongvalues.StringValue.
+STRING_SIZE = 1 << 20
+STRING_PROGRAM = """
+let s = ""
+while len(s) < {size} {{
+    s = s + "0123456789abcdef"
+}}
+print(len(s))
+"""
+
+def bench_strings(repetitions):
+    print(f"Seconds per build of a {STRING_SIZE} character string")
+    print(f"{'':>12}" + "".join(f"{name:>10}" for name, engine in ENGINES))
+    program = compile_program(STRING_PROGRAM.format(size=STRING_SIZE), "strings")
+    print(f"{'':>12}" + "".join(f"{run(program, engine, repetitions):>10.4f}" for name, engine in ENGINES))
+
+# Suffixes of an array and of a string, one per element. Slices are views
+# that share the storage of the sliced value, so taking one is O(1) instead
+# of O(length of the slice), see bongvalues.slice_value().
+SLICE_SIZE = 20000
+SLICE_PROGRAMS = [
+    ("array", """
+let a = range({size})
+let total = 0
+let i = 0
+while i < {size} {{
+    let rest = a[i:]
+    total = total + rest[0]
+    i = i + 1
+}}
+print(total)
+"""),
+    ("string", """
+let s = ""
+while len(s) < {size} {{
+    s = s + "0123456789abcdef"
+}}
+let count = 0
+let i = 0
+while i < {size} {{
+    let rest = s[i:]
+    if rest[0] == "0" {{
+        count = count + 1
+    }}
+    i = i + 1
+}}
+print(count)
+"""),
+]
+
+def bench_slices(repetitions):
+    print(f"Seconds per loop over the {SLICE_SIZE} suffixes of an array / a string")
+    print(f"{'':>12}" + "".join(f"{name:>10}" for name, engine in ENGINES))
+    for name, code in SLICE_PROGRAMS:
+        program = compile_program(code.format(size=SLICE_SIZE), name + "-slices")
+        print(f"{name:>12}" + "".join(f"{run(program, engine, repetitions):>10.4f}" for engine_name, engine in ENGINES))
+
+# Counting the occurrences of 500 distinct words in 20000 words, with
+# a table of two arrays that is searched linearly (index_of) and with a map.
+MAP_WORDS = 20000
+MAP_DISTINCT = 500
+MAP_PROGRAMS = [
+    ("arrays", """
+let names : []str = []
+let counts : []int = []
+let i = 0
+while i < {words} {{
+    let word = "w" + str(i * 7919 % {distinct})
+    let index = index_of(names, word)
+    if index < 0 {{
+        names = append(names, word)
+        counts = append(counts, 1)
+    }} else {{
+        counts[index] = counts[index] + 1
+    }}
+    i = i + 1
+}}
+print(len(names))
+"""),
+    ("map", """
+let counts : map[str]int = {{}}
+let i = 0
+while i < {words} {{
+    let word = "w" + str(i * 7919 % {distinct})
+    if has(counts, word) {{
+        counts[word] = counts[word] + 1
+    }} else {{
+        counts[word] = 1
+    }}
+    i = i + 1
+}}
+print(len(counts))
+"""),
+]
+
+def bench_maps(repetitions):
+    print(f"Seconds per count of {MAP_DISTINCT} distinct words in {MAP_WORDS} words")
+    print(f"{'':>12}" + "".join(f"{name:>10}" for name, engine in ENGINES))
+    for name, code in MAP_PROGRAMS:
+        program = compile_program(code.format(words=MAP_WORDS, distinct=MAP_DISTINCT), name + "-count")
+        print(f"{name:>12}" + "".join(f"{run(program, engine, repetitions):>10.4f}" for engine_name, engine in ENGINES))
+
+def main():
+    repetitions = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    with open("examples/program.bon") as f:
+        programs = [("program.bon", f.read())] + PROGRAMS
+    bench(programs, repetitions)
+    bench_scaling(repetitions)
+    bench_memo(repetitions)
+    bench_struct_memory()
+    bench_typed_arrays(repetitions)
+    bench_strings(repetitions)
+    bench_collections(repetitions)
+    bench_text(repetitions)
+    bench_slices(repetitions)
+    bench_maps(repetitions)
+
+if __name__ == "__main__":
+    main()
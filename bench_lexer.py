@@ -0,0 +1,66 @@
+#!/usr/bin/python
+
+# Benchmarks for the lexer. Run with 'python bench_lexer.py [max_size_in_kb]'.
+
+import sys
+import time
+import lexer
+import token_def as token
+
+# A chunk of bong code that contains (nearly) everything the lexer knows
+CHUNK = """// Returns a substring of a given string
+func str_range(input : str, from : int, to : int) : str {
+	let i = from
+	let res = ""
+	while i < to {
+		res = res + input[i] /* nested /* comments */ */
+		i = i + 1
+	}
+	return res
+}
+let a : []float = [1.5, 2.25, 3.0]
+if a[0] >= 1.0 && !(len(a) != 3) || false { print "\\u{1F600} \\x41\\n" }
+ls -la | grep foo | let out, err
+"""
+
+# Only whole chunks are used so that no string or comment is cut in half,
+# the result is therefore slightly larger than requested.
+def generate_code(size):
+    return CHUNK * (size // len(CHUNK) + 1)
+
+def lex(code, lexer_class=lexer.Lexer):
+    l = lexer_class(code, "bench_lexer.py input")
+    num_tokens = 0
+    while l.get_token().type != token.EOF:
+        num_tokens += 1
+    return num_tokens
+
+def bench_scaling(max_size):
+    print("Lexer scaling (time per KB should stay constant)")
+    print(f"{'size':>10} {'tokens':>10} {'seconds':>10} {'us/KB':>10}")
+    size = 1024
+    while size <= max_size:
+        code = generate_code(size)
+        start = time.perf_counter()
+        num_tokens = lex(code)
+        duration = time.perf_counter() - start
+        print(f"{len(code):>10} {num_tokens:>10} {duration:>10.4f} {duration*1e6/(len(code)/1024):>10.1f}")
+        size *= 10
+
+def bench_throughput(size=1024*1024):
+    print("Lexer throughput")
+    print(f"{'lexer':>10} {'tokens':>10} {'seconds':>10} {'tokens/s':>10}")
+    code = generate_code(size)
+    for lexer_class in [lexer.CharLexer, lexer.Lexer]:
+        start = time.perf_counter()
+        num_tokens = lex(code, lexer_class)
+        duration = time.perf_counter() - start
+        print(f"{lexer_class.__name__:>10} {num_tokens:>10} {duration:>10.4f} {num_tokens/duration:>10.0f}")
+
+def main():
+    max_size = int(sys.argv[1])*1024 if len(sys.argv) > 1 else 10*1024*1024
+    bench_scaling(max_size)
+    bench_throughput(min(max_size, 1024*1024))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/python
+
+# Benchmarks for the parser. Run with 'python bench_parser.py [num_functions]'.
+
+import sys
+import time
+import random
+import lexer
+import parser
+
+OPERATORS = ["+", "-", "*", "/", "%", "==", "!=", "<", "<=", ">", ">=", "&&", "||", "^"]
+
+def generate_expression(rand, depth):
+    r = rand.random()
+    if depth > 3 or r < 0.3:
+        return rand.choice(["a", "b", "1", "42", "x[0]", "f(a, 2)", "t.y"])
+    if r < 0.4:
+        return "(" + rand.choice(["-", "!"]) + generate_expression(rand, depth+1) + ")"
+    if r < 0.5:
+        return "(" + generate_expression(rand, depth+1) + ")"
+    return (generate_expression(rand, depth+1) + " " + rand.choice(OPERATORS)
+            + " " + generate_expression(rand, depth+1))
+
+# Identifiers can not contain digits
+def name(prefix, i):
+    result = ""
+    while True:
+        result = chr(ord("a") + i % 26) + result
+        i //= 26
+        if i == 0:
+            return prefix + "_" + result
+
+# Expression-heavy program, the expressions are not meant to be well-typed
+def generate_program(num_functions, seed=0):
+    rand = random.Random(seed)
+    functions = []
+    for i in range(num_functions):
+        lines = [f"func {name('f', i)}(a : int, b : int, x : []int, t : T) : int {{"]
+        for j in range(20):
+            lines.append(f"\tlet {name('v', j)} = " + generate_expression(rand, 0))
+        lines.append("\treturn " + generate_expression(rand, 0))
+        lines.append("}")
+        functions.append("\n".join(lines))
+    return "struct T { y : int }\nfunc f(a : int, b : int) : int { return a }\n" + "\n".join(functions) + "\n"
+
+def parse(code):
+    p = parser.Parser(lexer.Lexer(code, "bench_parser.py input"))
+    return p.compile_uncaught()
+
+def count_tokens(code):
+    l = lexer.Lexer(code, "bench_parser.py input")
+    num_tokens = 0
+    while l.get_token().type != "EOF":
+        num_tokens += 1
+    return num_tokens
+
+def bench_throughput(num_functions):
+    print("Parser throughput on generated expression-heavy programs")
+    print(f"{'functions':>10} {'lines':>10} {'tokens':>10} {'seconds':>10} {'tokens/s':>10}")
+    n = 10
+    while n <= num_functions:
+        code = generate_program(n)
+        num_tokens = count_tokens(code)
+        start = time.perf_counter()
+        parse(code)
+        duration = time.perf_counter() - start
+        print(f"{n:>10} {code.count(chr(10)):>10} {num_tokens:>10} {duration:>10.4f} {num_tokens/duration:>10.0f}")
+        n *= 10
+
+# Deepest nesting of parentheses that can be parsed with the current
+# recursion limit
+def bench_nesting():
+    depth = 1
+    while True:
+        code = "(" * (depth*2) + "1" + ")" * (depth*2)
+        try:
+            parse(code)
+        except RecursionError:
+            break
+        depth *= 2
+    low, high = depth, depth*2
+    while low + 1 < high:
+        mid = (low + high) // 2
+        try:
+            parse("(" * mid + "1" + ")" * mid)
+            low = mid
+        except RecursionError:
+            high = mid
+    print(f"Maximum nesting depth of parentheses: {low} (recursion limit {sys.getrecursionlimit()})")
+
+def main():
+    num_functions = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    bench_throughput(num_functions)
+    bench_nesting()
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,7 @@
 import bongtypes
-from bongvalues import ValueList
+from bongvalues import ValueList, ArrayValue, MapValue, TYPED_STORAGES, copy_value, slice_value
+import itertools
+import operator
 
 # TODO Currently, the argument checker function raise BongtypeExceptions
 # which are converted to TypecheckerExceptions in typechecker.py. This
@@ -16,18 +18,21 @@ def check_len(argument_types : bongtypes.TypeList) -> bongtypes.TypeList:
     if len(argument_types)!=1:
         raise bongtypes.BongtypeException("Function 'len' expects one single argument.")
     arg = argument_types[0]
-    if not isinstance(arg, bongtypes.Array) and not isinstance(arg, bongtypes.String):
-        raise bongtypes.BongtypeException("Function 'len' expects an Array or a String, '{}' was found instead.".format(arg))
+    if (not isinstance(arg, bongtypes.Array) and not isinstance(arg, bongtypes.String)
+            and not isinstance(arg, bongtypes.Map)):
+        raise bongtypes.BongtypeException("Function 'len' expects an Array, a String or a Map, '{}' was found instead.".format(arg))
     return bongtypes.TypeList([bongtypes.Integer()])
 
 def builtin_func_get_argv(args):
     import sys
-    return ValueList([sys.argv])
+    return ValueList([ArrayValue(sys.argv)])
 def check_get_argv(argument_types : bongtypes.TypeList) -> bongtypes.TypeList:
     if len(argument_types)!=0:
         raise bongtypes.BongtypeException("Function 'get_argv' expects no arguments.")
     return bongtypes.TypeList([bongtypes.Array(bongtypes.String())])
 
+# The array argument is a copy already, appending to it is amortised O(1),
+# see bongvalues.ArrayValue
 def builtin_func_append(args):
     array = args[0]
     element = args[1]
@@ -42,12 +47,402 @@ def check_append(argument_types: bongtypes.TypeList) -> bongtypes.TypeList:
         raise bongtypes.BongtypeException("Appended type does not match array type in function 'append'.")
     return bongtypes.TypeList([argument_types[0]])
 
+# Bulk operations on arrays of numbers. They iterate over the array's typed
+# storage (see bongvalues.TypedStorage) in C instead of in a bong loop.
+def numeric_array(name : str, typ : bongtypes.BaseType) -> bongtypes.ValueType:
+    if (not isinstance(typ, bongtypes.Array)
+            or not (isinstance(typ.contained_type, bongtypes.Integer)
+                or isinstance(typ.contained_type, bongtypes.Float))):
+        raise bongtypes.BongtypeException(f"Function '{name}' expects an array of int or float, '{typ}' was found instead.")
+    return typ.contained_type
+
+# Element type of an array of numbers or strings, which can be ordered
+def ordered_array(name : str, typ : bongtypes.BaseType) -> bongtypes.ValueType:
+    if isinstance(typ, bongtypes.Array) and isinstance(typ.contained_type, bongtypes.String):
+        return typ.contained_type
+    try:
+        return numeric_array(name, typ)
+    except bongtypes.BongtypeException:
+        raise bongtypes.BongtypeException(f"Function '{name}' expects an array of int, float or str, '{typ}' was found instead.")
+
+# The sum of an empty array is 0
+def builtin_func_sum(args):
+    return ValueList([sum(args[0])])
+def check_sum(argument_types : bongtypes.TypeList) -> bongtypes.TypeList:
+    if len(argument_types)!=1:
+        raise bongtypes.BongtypeException("Function 'sum' expects one single argument.")
+    return bongtypes.TypeList([numeric_array("sum", argument_types[0])])
+
+def builtin_func_min(args):
+    if len(args[0]) == 0:
+        raise Exception("Function 'min' expects a non-empty array.")
+    return ValueList([min(args[0])])
+def check_min(argument_types : bongtypes.TypeList) -> bongtypes.TypeList:
+    if len(argument_types)!=1:
+        raise bongtypes.BongtypeException("Function 'min' expects one single argument.")
+    return bongtypes.TypeList([ordered_array("min", argument_types[0])])
+
+def builtin_func_max(args):
+    if len(args[0]) == 0:
+        raise Exception("Function 'max' expects a non-empty array.")
+    return ValueList([max(args[0])])
+def check_max(argument_types : bongtypes.TypeList) -> bongtypes.TypeList:
+    if len(argument_types)!=1:
+        raise bongtypes.BongtypeException("Function 'max' expects one single argument.")
+    return bongtypes.TypeList([ordered_array("max", argument_types[0])])
+
+def builtin_func_dot(args):
+    if len(args[0]) != len(args[1]):
+        raise Exception("Function 'dot' expects two arrays of the same length.")
+    return ValueList([sum(map(operator.mul, args[0], args[1]))])
+def check_dot(argument_types : bongtypes.TypeList) -> bongtypes.TypeList:
+    if len(argument_types)!=2:
+        raise bongtypes.BongtypeException("Function 'dot' expects exactly two arguments.")
+    contained_type = numeric_array("dot", argument_types[0])
+    if not argument_types[0].sametype(argument_types[1]):
+        raise bongtypes.BongtypeException("Function 'dot' expects two arrays of the same type.")
+    return bongtypes.TypeList([contained_type])
+
+# An array of count copies of the value
+def builtin_func_fill(args):
+    count, value = args
+    if type(value) in TYPED_STORAGES:
+        return ValueList([ArrayValue([value] * max(count, 0))])
+    return ValueList([ArrayValue([copy_value(value) for i in range(count)])])
+def check_fill(argument_types : bongtypes.TypeList) -> bongtypes.TypeList:
+    if len(argument_types)!=2:
+        raise bongtypes.BongtypeException("Function 'fill' expects exactly two arguments.")
+    if not isinstance(argument_types[0], bongtypes.Integer):
+        raise bongtypes.BongtypeException("Function 'fill' expects the number of elements (int) as first argument.")
+    return bongtypes.TypeList([bongtypes.Array(argument_types[1])])
+
+# The ints from start (inclusive) to end (exclusive) like python's range():
+# range(end), range(start, end) or range(start, end, step)
+def builtin_func_range(args):
+    if len(args) == 3 and args[2] == 0:
+        raise Exception("Function 'range' expects a step other than 0.")
+    return ValueList([ArrayValue(range(*args))])
+def check_range(argument_types : bongtypes.TypeList) -> bongtypes.TypeList:
+    if len(argument_types) < 1 or len(argument_types) > 3:
+        raise bongtypes.BongtypeException("Function 'range' expects one to three arguments.")
+    for typ in argument_types:
+        if not isinstance(typ, bongtypes.Integer):
+            raise bongtypes.BongtypeException(f"Function 'range' expects int arguments, '{typ}' was found instead.")
+    return bongtypes.TypeList([bongtypes.Array(bongtypes.Integer())])
+
+# A copy of an array of structs that stores the structs column by column,
+# see bongvalues.ColumnStorage. Appends and copies keep the storage columnar.
+def builtin_func_columnar(args):
+    return ValueList([args[0].columnar()])
+def check_columnar(argument_types : bongtypes.TypeList) -> bongtypes.TypeList:
+    if len(argument_types)!=1:
+        raise bongtypes.BongtypeException("Function 'columnar' expects one single argument.")
+    arg = argument_types[0]
+    if not isinstance(arg, bongtypes.Array) or not isinstance(arg.contained_type, bongtypes.Struct):
+        raise bongtypes.BongtypeException(f"Function 'columnar' expects an array of structs, '{arg}' was found instead.")
+    return bongtypes.TypeList([arg])
+
+# The following builtins work on whole arrays (and some on strings) so that
+# common loops run in python's C code. Arrays are passed by value, so new
+# arrays are built from copies of the elements (ArrayValue.values()).
+
+def builtin_func_sort(args):
+    values = args[0].values()
+    values.sort()
+    return ValueList([ArrayValue(values)])
+def check_sort(argument_types : bongtypes.TypeList) -> bongtypes.TypeList:
+    if len(argument_types)!=1:
+        raise bongtypes.BongtypeException("Function 'sort' expects one single argument.")
+    ordered_array("sort", argument_types[0])
+    return bongtypes.TypeList([argument_types[0]])
+
+def builtin_func_reverse(args):
+    if isinstance(args[0], ArrayValue):
+        values = args[0].values()
+        values.reverse()
+        return ValueList([ArrayValue(values)])
+    return ValueList([str(args[0])[::-1]])
+def check_reverse(argument_types : bongtypes.TypeList) -> bongtypes.TypeList:
+    if len(argument_types)!=1:
+        raise bongtypes.BongtypeException("Function 'reverse' expects one single argument.")
+    arg = argument_types[0]
+    if not isinstance(arg, bongtypes.Array) and not isinstance(arg, bongtypes.String):
+        raise bongtypes.BongtypeException(f"Function 'reverse' expects an Array or a String, '{arg}' was found instead.")
+    return bongtypes.TypeList([arg])
+
+# Arrays: Is the value an element? Strings: Is the string a substring?
+def builtin_func_contains(args):
+    if isinstance(args[0], ArrayValue):
+        return ValueList([args[1] in args[0]])
+    return ValueList([str(args[1]) in str(args[0])])
+def check_contains(argument_types : bongtypes.TypeList) -> bongtypes.TypeList:
+    if len(argument_types)!=2:
+        raise bongtypes.BongtypeException("Function 'contains' expects exactly two arguments.")
+    container, value = argument_types
+    if isinstance(container, bongtypes.Array):
+        if not container.contained_type.sametype(value):
+            raise bongtypes.BongtypeException(f"Function 'contains' expects a value of the array's element type '{container.contained_type}', '{value}' was found instead.")
+    elif isinstance(container, bongtypes.String):
+        if not isinstance(value, bongtypes.String):
+            raise bongtypes.BongtypeException(f"Function 'contains' expects a String to search in a String, '{value}' was found instead.")
+    else:
+        raise bongtypes.BongtypeException(f"Function 'contains' expects an Array or a String, '{container}' was found instead.")
+    return bongtypes.TypeList([bongtypes.Boolean()])
+
+# The index of the first element equal to the value, -1 if there is none
+def builtin_func_index_of(args):
+    try:
+        return ValueList([operator.indexOf(args[0], args[1])])
+    except ValueError:
+        return ValueList([-1])
+def check_index_of(argument_types : bongtypes.TypeList) -> bongtypes.TypeList:
+    if len(argument_types)!=2:
+        raise bongtypes.BongtypeException("Function 'index_of' expects exactly two arguments.")
+    array, value = argument_types
+    if not isinstance(array, bongtypes.Array):
+        raise bongtypes.BongtypeException(f"Function 'index_of' expects an Array as first argument, '{array}' was found instead.")
+    if not array.contained_type.sametype(value):
+        raise bongtypes.BongtypeException(f"Function 'index_of' expects a value of the array's element type '{array.contained_type}', '{value}' was found instead.")
+    return bongtypes.TypeList([bongtypes.Integer()])
+
+def builtin_func_join(args):
+    return ValueList([str(args[1]).join(map(str, args[0]))])
+def check_join(argument_types : bongtypes.TypeList) -> bongtypes.TypeList:
+    if len(argument_types)!=2:
+        raise bongtypes.BongtypeException("Function 'join' expects exactly two arguments.")
+    if not argument_types[0].sametype(bongtypes.Array(bongtypes.String())):
+        raise bongtypes.BongtypeException(f"Function 'join' expects an array of strings as first argument, '{argument_types[0]}' was found instead.")
+    if not isinstance(argument_types[1], bongtypes.String):
+        raise bongtypes.BongtypeException(f"Function 'join' expects a separator String as second argument, '{argument_types[1]}' was found instead.")
+    return bongtypes.TypeList([bongtypes.String()])
+
+# The elements (characters) from start (inclusive) to end (exclusive), like
+# the slice expression sequence[start:end]
+def builtin_func_slice(args):
+    return ValueList([slice_value(args[0], args[1], args[2])])
+def check_slice(argument_types : bongtypes.TypeList) -> bongtypes.TypeList:
+    if len(argument_types)!=3:
+        raise bongtypes.BongtypeException("Function 'slice' expects exactly three arguments.")
+    sequence = argument_types[0]
+    if not isinstance(sequence, bongtypes.Array) and not isinstance(sequence, bongtypes.String):
+        raise bongtypes.BongtypeException(f"Function 'slice' expects an Array or a String, '{sequence}' was found instead.")
+    for typ in argument_types[1:]:
+        if not isinstance(typ, bongtypes.Integer):
+            raise bongtypes.BongtypeException(f"Function 'slice' expects int indices, '{typ}' was found instead.")
+    return bongtypes.TypeList([sequence])
+
+# Concatenation of all arrays of an array of arrays (for strings, see join)
+def builtin_func_concat_all(args):
+    return ValueList([ArrayValue(list(itertools.chain.from_iterable(array.values() for array in args[0])))])
+def check_concat_all(argument_types : bongtypes.TypeList) -> bongtypes.TypeList:
+    if len(argument_types)!=1:
+        raise bongtypes.BongtypeException("Function 'concat_all' expects one single argument.")
+    arg = argument_types[0]
+    if not isinstance(arg, bongtypes.Array) or not isinstance(arg.contained_type, bongtypes.Array):
+        raise bongtypes.BongtypeException(f"Function 'concat_all' expects an array of arrays, '{arg}' was found instead.")
+    return bongtypes.TypeList([arg.contained_type])
+
+# The elements without duplicates, in the order of their first occurrence
+def builtin_func_unique(args):
+    return ValueList([ArrayValue(list(dict.fromkeys(args[0])))])
+def check_unique(argument_types : bongtypes.TypeList) -> bongtypes.TypeList:
+    if len(argument_types)!=1:
+        raise bongtypes.BongtypeException("Function 'unique' expects one single argument.")
+    arg = argument_types[0]
+    if (not isinstance(arg, bongtypes.Array)
+            or not any(isinstance(arg.contained_type, typ) for typ in
+                (bongtypes.Integer, bongtypes.Float, bongtypes.String, bongtypes.Boolean))):
+        raise bongtypes.BongtypeException(f"Function 'unique' expects an array of int, float, str or bool, '{arg}' was found instead.")
+    return bongtypes.TypeList([arg])
+
+# String processing. Strings may be built strings (bongvalues.StringValue),
+# str() joins them.
+
+def check_strings(name : str, argument_types : bongtypes.TypeList, count : int):
+    if len(argument_types)!=count:
+        raise bongtypes.BongtypeException(f"Function '{name}' expects {count} String argument(s).")
+    for typ in argument_types:
+        if not isinstance(typ, bongtypes.String):
+            raise bongtypes.BongtypeException(f"Function '{name}' expects String arguments, '{typ}' was found instead.")
+
+# The parts of the string between the separators
+def builtin_func_split(args):
+    if len(args[1]) == 0:
+        raise Exception("Function 'split' expects a non-empty separator.")
+    return ValueList([ArrayValue(str(args[0]).split(str(args[1])))])
+def check_split(argument_types : bongtypes.TypeList) -> bongtypes.TypeList:
+    check_strings("split", argument_types, 2)
+    return bongtypes.TypeList([bongtypes.Array(bongtypes.String())])
+
+# The lines of the string without line breaks
+def builtin_func_lines(args):
+    return ValueList([ArrayValue(str(args[0]).splitlines())])
+def check_lines(argument_types : bongtypes.TypeList) -> bongtypes.TypeList:
+    check_strings("lines", argument_types, 1)
+    return bongtypes.TypeList([bongtypes.Array(bongtypes.String())])
+
+# The words of the string, separated by whitespace
+def builtin_func_fields(args):
+    return ValueList([ArrayValue(str(args[0]).split())])
+def check_fields(argument_types : bongtypes.TypeList) -> bongtypes.TypeList:
+    check_strings("fields", argument_types, 1)
+    return bongtypes.TypeList([bongtypes.Array(bongtypes.String())])
+
+# The index of the first occurrence of the substring, -1 if there is none
+def builtin_func_find(args):
+    return ValueList([str(args[0]).find(str(args[1]))])
+def check_find(argument_types : bongtypes.TypeList) -> bongtypes.TypeList:
+    check_strings("find", argument_types, 2)
+    return bongtypes.TypeList([bongtypes.Integer()])
+
+# All occurrences of the second string replaced by the third one
+def builtin_func_replace(args):
+    return ValueList([str(args[0]).replace(str(args[1]), str(args[2]))])
+def check_replace(argument_types : bongtypes.TypeList) -> bongtypes.TypeList:
+    check_strings("replace", argument_types, 3)
+    return bongtypes.TypeList([bongtypes.String()])
+
+# The string without leading and trailing whitespace
+def builtin_func_trim(args):
+    return ValueList([str(args[0]).strip()])
+def check_trim(argument_types : bongtypes.TypeList) -> bongtypes.TypeList:
+    check_strings("trim", argument_types, 1)
+    return bongtypes.TypeList([bongtypes.String()])
+
+def builtin_func_starts_with(args):
+    return ValueList([str(args[0]).startswith(str(args[1]))])
+def check_starts_with(argument_types : bongtypes.TypeList) -> bongtypes.TypeList:
+    check_strings("starts_with", argument_types, 2)
+    return bongtypes.TypeList([bongtypes.Boolean()])
+
+# The length characters from start on, a negative start counts from the end
+def builtin_func_substr(args):
+    string, start, length = str(args[0]), args[1], args[2]
+    if start < 0:
+        start = max(start + len(string), 0)
+    return ValueList([string[start:start + max(length, 0)]])
+def check_substr(argument_types : bongtypes.TypeList) -> bongtypes.TypeList:
+    if len(argument_types)!=3:
+        raise bongtypes.BongtypeException("Function 'substr' expects exactly three arguments.")
+    if not isinstance(argument_types[0], bongtypes.String):
+        raise bongtypes.BongtypeException(f"Function 'substr' expects a String as first argument, '{argument_types[0]}' was found instead.")
+    for typ in argument_types[1:]:
+        if not isinstance(typ, bongtypes.Integer):
+            raise bongtypes.BongtypeException(f"Function 'substr' expects int start and length, '{typ}' was found instead.")
+    return bongtypes.TypeList([bongtypes.String()])
+
+# Conversions. Strings that do not contain a number are runtime errors,
+# floats are truncated towards 0.
+def builtin_func_to_int(args):
+    value = args[0]
+    return ValueList([int(value if isinstance(value, float) else str(value))])
+def check_to_int(argument_types : bongtypes.TypeList) -> bongtypes.TypeList:
+    if len(argument_types)!=1:
+        raise bongtypes.BongtypeException("Function 'to_int' expects one single argument.")
+    if not isinstance(argument_types[0], bongtypes.String) and not isinstance(argument_types[0], bongtypes.Float):
+        raise bongtypes.BongtypeException(f"Function 'to_int' expects a String or a float, '{argument_types[0]}' was found instead.")
+    return bongtypes.TypeList([bongtypes.Integer()])
+
+def builtin_func_to_float(args):
+    value = args[0]
+    return ValueList([float(value if isinstance(value, int) else str(value))])
+def check_to_float(argument_types : bongtypes.TypeList) -> bongtypes.TypeList:
+    if len(argument_types)!=1:
+        raise bongtypes.BongtypeException("Function 'to_float' expects one single argument.")
+    if not isinstance(argument_types[0], bongtypes.String) and not isinstance(argument_types[0], bongtypes.Integer):
+        raise bongtypes.BongtypeException(f"Function 'to_float' expects a String or an int, '{argument_types[0]}' was found instead.")
+    return bongtypes.TypeList([bongtypes.Float()])
+
+# Any value as printed by print(). The name is also the type name 'str',
+# see the FunctionCall case in TypeChecker.check().
+def builtin_func_str(args):
+    return ValueList([str(args[0])])
+def check_str(argument_types : bongtypes.TypeList) -> bongtypes.TypeList:
+    if len(argument_types)!=1:
+        raise bongtypes.BongtypeException("Function 'str' expects one single argument.")
+    return bongtypes.TypeList([bongtypes.String()])
+
+# Maps: The first argument is a Map, the second one a key (if given)
+def check_map(name : str, argument_types : bongtypes.TypeList, count : int) -> bongtypes.Map:
+    if len(argument_types)!=count:
+        raise bongtypes.BongtypeException(f"Function '{name}' expects {'one single argument' if count == 1 else 'exactly two arguments'}.")
+    if not isinstance(argument_types[0], bongtypes.Map):
+        raise bongtypes.BongtypeException(f"Function '{name}' expects first parameter of type Map.")
+    if count > 1 and not argument_types[0].key_type.sametype(argument_types[1]):
+        raise bongtypes.BongtypeException(f"Key type does not match map type in function '{name}'.")
+    return argument_types[0]
+
+def builtin_func_has(args):
+    return ValueList([args[1] in args[0]])
+def check_has(argument_types : bongtypes.TypeList) -> bongtypes.TypeList:
+    check_map("has", argument_types, 2)
+    return bongtypes.TypeList([bongtypes.Boolean()])
+
+# The keys in insertion order
+def builtin_func_keys(args):
+    return ValueList([ArrayValue(list(args[0]))])
+def check_keys(argument_types : bongtypes.TypeList) -> bongtypes.TypeList:
+    return bongtypes.TypeList([bongtypes.Array(check_map("keys", argument_types, 1).key_type)])
+
+# Copies of the values in the order of the keys
+def builtin_func_values(args):
+    return ValueList([ArrayValue(args[0].values())])
+def check_values(argument_types : bongtypes.TypeList) -> bongtypes.TypeList:
+    return bongtypes.TypeList([bongtypes.Array(check_map("values", argument_types, 1).value_type)])
+
+# Removes the key from the map in place (if it is there), like an assignment
+# m[k] = v writes to m, see writing_builtins
+def builtin_func_delete(args):
+    if args[1] in args[0]:
+        del args[0][args[1]]
+    return ValueList([])
+def check_delete(argument_types : bongtypes.TypeList) -> bongtypes.TypeList:
+    check_map("delete", argument_types, 2)
+    return bongtypes.TypeList([])
+
 functions = {
     #"call": self.callprogram,
     "len": (
         builtin_func_len,   # function to call
-        check_len           # function to check params
+        check_len,          # function to check params
+        False               # function writes to or returns its arguments,
+                            # so they have to be copied (call by value)
     ),
-    "get_argv": (builtin_func_get_argv, check_get_argv),
-    "append": (builtin_func_append, check_append),
+    "get_argv": (builtin_func_get_argv, check_get_argv, False),
+    "append": (builtin_func_append, check_append, True),
+    "sum": (builtin_func_sum, check_sum, False),
+    "min": (builtin_func_min, check_min, False),
+    "max": (builtin_func_max, check_max, False),
+    "dot": (builtin_func_dot, check_dot, False),
+    "fill": (builtin_func_fill, check_fill, False),
+    "range": (builtin_func_range, check_range, False),
+    "columnar": (builtin_func_columnar, check_columnar, False),
+    "sort": (builtin_func_sort, check_sort, False),
+    "reverse": (builtin_func_reverse, check_reverse, False),
+    "contains": (builtin_func_contains, check_contains, False),
+    "index_of": (builtin_func_index_of, check_index_of, False),
+    "join": (builtin_func_join, check_join, False),
+    "slice": (builtin_func_slice, check_slice, False),
+    "concat_all": (builtin_func_concat_all, check_concat_all, False),
+    "unique": (builtin_func_unique, check_unique, False),
+    "split": (builtin_func_split, check_split, False),
+    "lines": (builtin_func_lines, check_lines, False),
+    "fields": (builtin_func_fields, check_fields, False),
+    "find": (builtin_func_find, check_find, False),
+    "replace": (builtin_func_replace, check_replace, False),
+    "trim": (builtin_func_trim, check_trim, False),
+    "starts_with": (builtin_func_starts_with, check_starts_with, False),
+    "substr": (builtin_func_substr, check_substr, False),
+    "to_int": (builtin_func_to_int, check_to_int, False),
+    "to_float": (builtin_func_to_float, check_to_float, False),
+    "str": (builtin_func_str, check_str, False),
+    "has": (builtin_func_has, check_has, False),
+    "keys": (builtin_func_keys, check_keys, False),
+    "values": (builtin_func_values, check_values, False),
+    "delete": (builtin_func_delete, check_delete, False),
 }
+
+# Builtins that write to their first argument in place instead of returning
+# a changed copy. The argument is not copied, the typechecker requires it to
+# be writable and treats the call like an assignment to an element of it.
+writing_builtins = {"delete"}
@@ -131,6 +131,8 @@ class Function(BaseType):
 	def __init__(self, parameter_types : TypeList, return_types : TypeList):
 		self.parameter_types = parameter_types
 		self.return_types = return_types
+		# Inferred by the typechecker, see TypeChecker.infer_purity()
+		self.pure = False
 	def sametype(self, other):
 		raise Exception("not implemented")
 	def __str__(self):
@@ -140,9 +142,8 @@ class Function(BaseType):
 		return s
 # Even less a first-class type that the user can use
 # The check_func for BuiltinFunction should return TypeList
-import types # python types
 class BuiltinFunction(BaseType):
-	def __init__(self, check_func : types.FunctionType):
+	def __init__(self, check_func : typing.Callable[[TypeList], TypeList]):
 		self.check_func = check_func
 	def check(self, argument_types : TypeList) -> TypeList:
 		return self.check_func(argument_types)
@@ -202,6 +203,11 @@ class Struct(ValueType):
 		#if self.fields != other.fields:
 			#return False
 		#return self.field_types.sametype(other.field_types)
+	# The layout of struct values (bongvalues.StructValue): The fields are
+	# sorted by name so that equal types have the same layout, regardless of
+	# the order in which their fields were given.
+	def field_names(self) -> typing.List[str]:
+		return sorted(self.fields)
 	def __str__(self):
 		names = []
 		for name, typ in self.fields.items():
@@ -334,6 +340,22 @@ class Array(ValueType):
 	def __str__(self):
 		return "Array [" + str(self.contained_type) + "]"
 
+# Hash maps, the keys are Integers, Floats, Booleans or Strings
+class Map(ValueType):
+	def __init__(self, key_type : ValueType, value_type : ValueType):
+		self.key_type : ValueType = key_type
+		self.value_type : ValueType = value_type
+	def sametype(self, other):
+		if type(other)==Map:
+			return self.key_type.sametype(other.key_type) and self.value_type.sametype(other.value_type)
+		else:
+			return False
+	def __str__(self):
+		return "Map [" + str(self.key_type) + "] " + str(self.value_type)
+
+# Types that can be keys of Maps (immutable values)
+key_types = (Integer, Float, Boolean, String)
+
 # Currently, this list of types is used to map type-strings to
 # bongtypes.BaseType (subclass) instances. Maybe, this approach has to be
 # revised in the future so that self-defined types can be used.
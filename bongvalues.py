@@ -1,8 +1,458 @@
+from __future__ import annotations
 from flatlist import FlatList
-from collections import UserDict
-import ast
+import array
+import itertools
 import typing
 
+# Arrays are passed by value but copied lazily (copy on write):
+# copy() creates a new handle that shares the storage with the original and
+# increments the storage's reference count. Whichever handle writes to a
+# shared storage first copies it. Handles decrement the count when they are
+# garbage collected, so an array that was passed to a function is exclusive
+# again as soon as the callee's copy is gone.
+#
+# The storage is copied shallowly, arrays and structs contained in it are
+# copied lazily themselves. Because of this, a contained array or struct is
+# never handed out from a shared storage, reading it copies the storage first.
+# Otherwise, writing to the contained value would be visible to all handles
+# of the storage.
+#
+# A let or an assignment does not copy, though: After 'let row = m[0]', row
+# is the array contained in m's storage, and after 'outer[0] = row' or
+# 'let outer = [row]', outer's storage contains row. Writing through row
+# changes the storage's contained value even if the storage is shared later.
+# The typechecker finds these places, the engines mark such arrays (and
+# maps) as escaped (see escape()) and copies of an escaped array get copies
+# of the contained values instead of sharing the storage.
+#
+# Arrays of ints, floats and bools are stored in contiguous typed buffers
+# (TypedStorage, an array.array) instead of lists of python objects. The
+# typechecker guarantees that all elements of an array have the same type,
+# so the storage is chosen by the type of the first element (see
+# new_storage()), an empty array gets its storage on the first append. Ints
+# that do not fit into 64 bits move the array to a list storage (box()).
+#
+# Arrays of structs can be stored column by column instead (ColumnStorage,
+# see the columnar builtin), one typed storage per field.
+
+# The shared storage of arrays, a list with reference count
+class Storage(list):
+    __slots__ = ("refs",)
+    def __init__(self, elements : typing.Iterable[typing.Any] = ()):
+        super().__init__(elements)
+        self.refs = 1
+    # A storage of the elements from start to end
+    def section(self, start : int, end : int) -> Storage:
+        return Storage(copy_value(e) for e in itertools.islice(self, start, end))
+
+# The shared storage of arrays of primitives, an array.array with reference
+# count. Its elements are immutable, so copies are plain buffer copies.
+class TypedStorage(array.array):
+    __slots__ = ("refs",)
+    refs : int
+    def __new__(cls, typecode : str, elements : typing.Iterable[typing.Any] = ()):
+        storage = super().__new__(cls, typecode, elements)
+        storage.refs = 1
+        return storage
+    def section(self, start : int, end : int) -> TypedStorage:
+        return self.__class__(self.typecode, array.array.__getitem__(self, slice(start, end)))
+
+# Bools are stored as signed chars and converted back on reading
+class BoolStorage(TypedStorage):
+    __slots__ = ()
+    def __getitem__(self, index : int) -> bool: # type: ignore
+        return bool(array.array.__getitem__(self, index))
+    def __iter__(self) -> typing.Iterator[bool]:
+        return map(bool, array.array.__iter__(self))
+
+# Storage class and type code for the elements' python type
+TYPED_STORAGES : typing.Dict[type, typing.Tuple[typing.Type[TypedStorage], str]] = {
+        int: (TypedStorage, "q"),
+        float: (TypedStorage, "d"),
+        bool: (BoolStorage, "b"),
+        }
+
+# Any storage of an array
+AnyStorage = typing.Union[Storage, TypedStorage, "ColumnStorage"]
+
+# A typed storage if the elements are ints, floats or bools
+def new_storage(elements : typing.List[typing.Any]) -> typing.Union[Storage, TypedStorage]:
+    if len(elements) > 0 and type(elements[0]) in TYPED_STORAGES:
+        cls, typecode = TYPED_STORAGES[type(elements[0])]
+        try:
+            return cls(typecode, elements)
+        except OverflowError:
+            pass
+    return Storage(elements)
+
+# Copy for call by value, in O(1) for arrays and maps that are not escaped
+# (see StructValue for structs)
+def copy_value(value : typing.Any) -> typing.Any:
+    if isinstance(value, (ArrayValue, StructValue, MapValue)):
+        return value.copy()
+    return value
+
+def copy_values(values : typing.List[typing.Any]) -> typing.List[typing.Any]:
+    return [copy_value(value) for value in values]
+
+# Mark an array or map whose storage contains a value that is referenced
+# elsewhere as well, its copies must not share the storage any longer
+def escape(value : typing.Any) -> typing.Any:
+    if isinstance(value, (ArrayValue, MapValue)):
+        value.escaped = True
+    return value
+
+# Arrays are views of length elements of their storage, starting at offset.
+# Slices (a[i:j]) are new handles of the same storage with another offset
+# and length. Appending to a handle whose view ends at the end of the
+# storage appends to the storage in place, even if the storage is shared:
+# The other handles do not see the new element. So 'arr = append(arr, x)' is
+# amortised O(1).
+class ArrayValue:
+    __slots__ = ("storage", "offset", "length", "escaped")
+    def __init__(self, elements : typing.Iterable[typing.Any] = ()):
+        self.storage : AnyStorage = new_storage(elements if isinstance(elements, list) else list(elements))
+        self.offset = 0
+        self.length = len(self.storage)
+        self.escaped = False
+    def __del__(self):
+        self.storage.refs -= 1
+    def copy(self) -> ArrayValue:
+        array = ArrayValue.__new__(ArrayValue)
+        if self.escaped:
+            array.storage = self.storage.section(self.offset, self.offset + self.length)
+            array.offset = 0
+        else:
+            array.storage = self.storage
+            array.offset = self.offset
+            self.storage.refs += 1
+        array.length = self.length
+        array.escaped = False
+        return array
+    def __deepcopy__(self, memo) -> ArrayValue:
+        return self.copy()
+    # A slice, see slice_bounds()
+    def view(self, start : typing.Optional[int], end : typing.Optional[int]) -> ArrayValue:
+        start, end = slice_bounds(start, end, self.length)
+        array = self.copy()
+        array.offset += start
+        array.length = end - start
+        return array
+    # Give this handle its own storage
+    def unshare(self):
+        storage = self.storage.section(self.offset, self.offset + self.length)
+        self.storage.refs -= 1
+        self.storage = storage
+        self.offset = 0
+    # Move the elements to a list storage, for ints that do not fit into a
+    # typed storage
+    def box(self):
+        storage = Storage(itertools.islice(self.storage, self.offset, self.offset + self.length))
+        self.storage.refs -= 1
+        self.storage = storage
+        self.offset = 0
+    # Give this handle a new storage for the first element, columnar arrays
+    # stay columnar
+    def start(self, value : typing.Any):
+        if isinstance(self.storage, ColumnStorage):
+            storage : typing.Any = ColumnStorage()
+            storage.append(value)
+        else:
+            storage = new_storage([value])
+        self.storage.refs -= 1
+        self.storage = storage
+        self.offset = 0
+        self.length = 1
+    # A copy of the array with a columnar storage
+    def columnar(self) -> ArrayValue:
+        array = ArrayValue.__new__(ArrayValue)
+        array.storage = ColumnStorage()
+        for struct in self:
+            array.storage.append(copy_value(struct))
+        array.offset = 0
+        array.length = self.length
+        array.escaped = False
+        return array
+    # The storage index of the element
+    def position(self, index : int) -> int:
+        if index < 0:
+            index += self.length
+        if index < 0 or index >= self.length:
+            raise IndexError("list index out of range")
+        return index + self.offset
+    def __len__(self):
+        return self.length
+    def __getitem__(self, index : int) -> typing.Any:
+        value = self.storage[self.position(index)]
+        if self.storage.refs > 1 and isinstance(value, (ArrayValue, StructValue, MapValue)):
+            self.unshare()
+            value = self.storage[self.position(index)]
+        return value
+    def __setitem__(self, index : int, value : typing.Any):
+        if self.storage.refs > 1:
+            self.unshare()
+        try:
+            self.storage[self.position(index)] = value
+        except OverflowError:
+            self.box()
+            self.storage[self.position(index)] = value
+    def append(self, value : typing.Any):
+        if self.length == 0:
+            self.start(value)
+            return
+        if self.offset + self.length != len(self.storage):
+            if self.storage.refs > 1:
+                self.unshare()
+            else:
+                del self.storage[self.offset + self.length:]
+        try:
+            self.storage.append(value)
+        except OverflowError:
+            self.box()
+            self.storage.append(value)
+        self.length += 1
+    def __add__(self, other : ArrayValue) -> ArrayValue:
+        if type(self.storage) == type(other.storage) and isinstance(self.storage, TypedStorage) \
+                and isinstance(other.storage, TypedStorage) and self.storage.typecode == other.storage.typecode:
+            # Buffer copies
+            array = ArrayValue.__new__(ArrayValue)
+            array.storage = self.storage.section(self.offset, self.offset + self.length)
+            array.storage.extend(other.storage.section(other.offset, other.offset + other.length))
+            array.offset = 0
+            array.length = len(array.storage)
+            array.escaped = False
+            return array
+        if isinstance(self.storage, ColumnStorage):
+            array = self.copy()
+            for struct in other:
+                array.append(copy_value(struct))
+            return array
+        return ArrayValue(copy_value(e) for e in itertools.chain(self, other))
+    # Copies of the elements, e.g. for a new array made of them
+    def values(self) -> typing.List[typing.Any]:
+        elements = iter(self)
+        if isinstance(self.storage, TypedStorage):
+            return list(elements)
+        return [copy_value(e) for e in elements]
+    # For reading only, contained arrays and structs must not be written
+    def __iter__(self) -> typing.Iterator[typing.Any]:
+        return itertools.islice(self.storage, self.offset, self.offset + self.length)
+    def __eq__(self, other):
+        if isinstance(other, ArrayValue):
+            other = list(other)
+        return list(self) == other
+    # Printed like python lists
+    def __repr__(self):
+        return "[" + ", ".join(map(repr, self)) + "]"
+
+# The shared storage of maps, a dict with reference count like Storage
+class MapStorage(dict):
+    def __init__(self, items : typing.Iterable[typing.Tuple[typing.Any, typing.Any]] = ()):
+        super().__init__(items)
+        self.refs = 1
+    # A storage with copies of the values
+    def duplicate(self) -> MapStorage:
+        return MapStorage((key, copy_value(value)) for key, value in self.items())
+
+# Maps are handles of a dict, copied on write like arrays: Copies share the
+# dict until one of them writes to it (m[k] = v, delete(m, k)), that handle
+# gets a dict of its own then. Keys are ints, floats, bools or strs, the
+# iteration order is the insertion order.
+class MapValue:
+    __slots__ = ("storage", "escaped")
+    def __init__(self, items : typing.Iterable[typing.Tuple[typing.Any, typing.Any]] = ()):
+        self.storage = MapStorage((map_key(key), value) for key, value in items)
+        self.escaped = False
+    def __del__(self):
+        self.storage.refs -= 1
+    def copy(self) -> MapValue:
+        value = MapValue.__new__(MapValue)
+        if self.escaped:
+            value.storage = self.storage.duplicate()
+        else:
+            value.storage = self.storage
+            self.storage.refs += 1
+        value.escaped = False
+        return value
+    def __deepcopy__(self, memo) -> MapValue:
+        return self.copy()
+    # Give this handle its own storage
+    def unshare(self):
+        storage = self.storage.duplicate()
+        self.storage.refs -= 1
+        self.storage = storage
+    def __len__(self):
+        return len(self.storage)
+    def __contains__(self, key : typing.Any) -> bool:
+        return key in self.storage
+    def __getitem__(self, key : typing.Any) -> typing.Any:
+        value = self.storage[key]
+        if self.storage.refs > 1 and isinstance(value, (ArrayValue, StructValue, MapValue)):
+            self.unshare()
+            value = self.storage[key]
+        return value
+    def __setitem__(self, key : typing.Any, value : typing.Any):
+        if self.storage.refs > 1:
+            self.unshare()
+        self.storage[map_key(key)] = value
+    def __delitem__(self, key : typing.Any):
+        if self.storage.refs > 1:
+            self.unshare()
+        del self.storage[key]
+    # Copies of the values, e.g. for an array made of them
+    def values(self) -> typing.List[typing.Any]:
+        return [copy_value(value) for value in self.storage.values()]
+    # The keys, for reading only like ArrayValue.__iter__()
+    def __iter__(self) -> typing.Iterator[typing.Any]:
+        return iter(self.storage)
+    def __eq__(self, other):
+        if isinstance(other, MapValue):
+            other = other.storage
+        return self.storage == other
+    # Printed like python dicts
+    def __repr__(self):
+        return "{" + ", ".join(f"{key!r}: {value!r}" for key, value in self.storage.items()) + "}"
+
+# Keys are stored as plain strs, not as StringValues which join their
+# buffer on each hash
+def map_key(key : typing.Any) -> typing.Any:
+    if isinstance(key, StringValue):
+        return str(key)
+    return key
+
+# Strings built by concatenation. Bong strings are python strs, but
+# concatenating them creates a new str each time, so building a string in a
+# loop ('s = s + c') takes O(n^2). Instead, concatenations that produce longer
+# strings return a StringValue: a view of the first length characters of a
+# StringBuffer. Just like for arrays (see ArrayValue.append()), appending to
+# a view that ends at the end of its buffer appends to the buffer in place,
+# other views of the buffer do not see the appended characters. So
+# repeated appends take amortised O(1).
+#
+# The string is joined when it is used as a str: printed, compared, hashed
+# or piped to a program (all via str()). The joined string is kept, so this
+# happens once per series of appends.
+#
+# Longer slices of strings (s[i:j]) are StringValues, too: views of the
+# string's buffer that start at an offset, the characters are not copied
+# until the slice is used as a str. Indexing a StringValue does not copy.
+
+# Shorter results of a concatenation are plain strs
+MIN_BUILT_STRING = 64
+# The appended strings are joined to chunks of at least this size
+CHUNK_SIZE = 4096
+
+class StringBuffer:
+    __slots__ = ("chunks", "tail", "tail_size", "size")
+    def __init__(self, initial : str):
+        self.chunks = [initial]
+        self.tail : typing.List[str] = []
+        self.tail_size = 0
+        self.size = len(initial)
+    def append(self, string : str):
+        self.tail.append(string)
+        self.tail_size += len(string)
+        self.size += len(string)
+        if self.tail_size >= CHUNK_SIZE:
+            self.chunks.append("".join(self.tail))
+            self.tail = []
+            self.tail_size = 0
+    def join(self) -> str:
+        if len(self.tail) > 0:
+            self.chunks.append("".join(self.tail))
+            self.tail = []
+            self.tail_size = 0
+        if len(self.chunks) > 1:
+            self.chunks = ["".join(self.chunks)]
+        return self.chunks[0]
+
+class StringValue:
+    __slots__ = ("buffer", "offset", "length")
+    def __init__(self, buffer : StringBuffer, offset : int = 0, length : typing.Optional[int] = None):
+        self.buffer = buffer
+        self.offset = offset
+        self.length = buffer.size - offset if length == None else length
+    def append(self, string : str) -> StringValue:
+        if self.offset + self.length == self.buffer.size:
+            self.buffer.append(string)
+            return StringValue(self.buffer, self.offset)
+        buffer = StringBuffer(str(self))
+        buffer.append(string)
+        return StringValue(buffer)
+    # A slice, see slice_bounds()
+    def view(self, start : typing.Optional[int], end : typing.Optional[int]) -> typing.Union[str, StringValue]:
+        start, end = slice_bounds(start, end, self.length)
+        if end - start < MIN_BUILT_STRING:
+            return self.buffer.join()[self.offset + start:self.offset + end]
+        return StringValue(self.buffer, self.offset + start, end - start)
+    def __str__(self) -> str:
+        string = self.buffer.join()
+        if self.offset != 0 or len(string) != self.length:
+            # A slice or other views appended to the buffer: This view gets
+            # a buffer of its own so that its characters are copied only once
+            string = string[self.offset:self.offset + self.length]
+            self.buffer = StringBuffer(string)
+            self.offset = 0
+        return string
+    def __repr__(self):
+        return repr(str(self))
+    def __len__(self):
+        return self.length
+    def __getitem__(self, index : int) -> str:
+        if index < 0:
+            index += self.length
+        if index < 0 or index >= self.length:
+            raise IndexError("string index out of range")
+        return self.buffer.join()[self.offset + index]
+    def __iter__(self) -> typing.Iterator[str]:
+        return iter(str(self))
+    def __eq__(self, other):
+        return str(self) == str(other)
+    def __ne__(self, other):
+        return str(self) != str(other)
+    def __hash__(self):
+        return hash(str(self))
+    # For sorting arrays of strings
+    def __lt__(self, other):
+        return str(self) < str(other)
+    def __gt__(self, other):
+        return str(self) > str(other)
+    def __add__(self, other : typing.Union[str, StringValue]) -> typing.Union[str, StringValue]:
+        return concat_strings(self, other)
+    def __radd__(self, other : str) -> typing.Union[str, StringValue]:
+        return concat_strings(other, self)
+
+# The str-concat operation
+def concat_strings(lhs : typing.Union[str, StringValue], rhs : typing.Union[str, StringValue]) -> typing.Union[str, StringValue]:
+    if isinstance(lhs, StringValue):
+        return lhs.append(str(rhs))
+    if len(lhs) + len(rhs) < MIN_BUILT_STRING:
+        return lhs + str(rhs)
+    buffer = StringBuffer(lhs)
+    buffer.append(str(rhs))
+    return StringValue(buffer)
+
+# The bounds of the slice [start:end] of a sequence of length elements.
+# Missing bounds are the start and the end of the sequence, negative bounds
+# count from the end. Unlike python's slices, bounds out of range (or a start
+# after the end) are not clamped but an error.
+def slice_bounds(start : typing.Optional[int], end : typing.Optional[int], length : int) -> typing.Tuple[int, int]:
+    low = 0 if start == None else start + length if start < 0 else start
+    high = length if end == None else end + length if end < 0 else end
+    if low < 0 or high > length or low > high:
+        raise IndexError(f"slice [{'' if start == None else start}:{'' if end == None else end}]"
+                f" out of range for length {length}")
+    return low, high
+
+# A slice (s[i:j], a[i:j]) of a string or an array
+def slice_value(value : typing.Union[str, StringValue, ArrayValue], start : typing.Optional[int], end : typing.Optional[int]) -> typing.Any:
+    if isinstance(value, str):
+        start, end = slice_bounds(start, end, len(value))
+        if end - start < MIN_BUILT_STRING:
+            return value[start:end]
+        return StringValue(StringBuffer(value), start, end - start)
+    return value.view(start, end)
+
 class ValueList(FlatList):
     def __init__(self, elements, unwind_return=False):
         super().__init__(elements)
@@ -14,18 +464,132 @@ class ValueList(FlatList):
     def __str__(self):
         return ", ".join(map(str,self.elements))
 
-class StructValue(UserDict):
-    def __init__(self, name : typing.Union[ast.Identifier, ast.DotAccess]):
-        super().__init__()
-        if isinstance(name, ast.Identifier):
-            self.name = name.name
-        elif isinstance(name, ast.DotAccess):
-            self.name = name.rhs
-        else:
-            raise Exception("StructValues should be initialized with ast.Identifier"
-                    " or ast.DotAccess!")
+# The result of a return statement with a tail call (see ast.Return.tail_call):
+# Instead of nesting the call, the engine replaces the returning call with a
+# call of function with the (evaluated) arguments.
+class TailCall(ValueList):
+    def __init__(self, function, arguments : typing.List[typing.Any], unit=None):
+        super().__init__([], True)
+        self.function = function
+        self.arguments = arguments
+        # The translation unit of the function (tree engine only)
+        self.unit = unit
+
+# Struct values are lists of their field values, in the order of the fields
+# of the struct type (bongtypes.Struct). The typechecker resolves field names
+# to these offsets (ast.DotAccess.field), so fields are accessed by index.
+# One subclass is generated per struct type which holds the name and the
+# field names, an instance is not more than a list.
+#
+# Unlike arrays, structs are copied eagerly but shallowly: Contained arrays
+# are copied on write, so a copy takes O(number of fields).
+class StructValue(list):
+    __slots__ = ()
+    name = ""
+    field_names : typing.Tuple[str, ...] = ()
+    def copy(self) -> StructValue:
+        return self.__class__(map(copy_value, self))
+    def __deepcopy__(self, memo) -> StructValue:
+        return self.copy()
+    # The class of plain struct values of this struct's type
+    def struct_type(self) -> typing.Type[StructValue]:
+        return self.__class__
+    # The value of a field given by name (slow, for debugging)
+    def field(self, name : str) -> typing.Any:
+        return self[self.field_names.index(name)]
     def __str__(self):
         fields = []
-        for name, value in self.data.items():
+        for name, value in zip(self.field_names, self):
             fields.append(name + " : " + str(value))
         return str(self.name) + " { " + ", ".join(sorted(fields)) + " }"
+    __repr__ = __str__
+
+_struct_classes : typing.Dict[typing.Tuple[str, typing.Tuple[str, ...]], typing.Type[StructValue]] = {}
+
+# The StructValue subclass for a struct type, field_names in the order of the
+# type's fields (see ast.StructValue.field_names)
+def struct_class(name : str, field_names : typing.Sequence[str]) -> typing.Type[StructValue]:
+    key = (name, tuple(field_names))
+    if key not in _struct_classes:
+        _struct_classes[key] = type(name, (StructValue,), {"__slots__": (), "name": name, "field_names": key[1]})
+    return _struct_classes[key]
+
+# Columnar storage of an array of structs: one column per field, each a
+# typed storage if the field is an int, float or bool. Reading an element
+# returns a StructRow, a struct whose fields are read from and written to
+# the columns directly, so 'arr[i].x' only touches the column of x. A row
+# that is kept in a variable ('let p = arr[i]') stays a view of this storage,
+# so copies of the escaped array get columns of their own (see section()).
+class ColumnStorage:
+    __slots__ = ("refs", "struct_class", "columns", "length")
+    def __init__(self):
+        self.refs = 1
+        # Known from the first struct appended
+        self.struct_class : typing.Type[StructValue] = StructValue
+        self.columns : typing.List[typing.Any] = []
+        self.length = 0
+    def __len__(self):
+        return self.length
+    def __getitem__(self, index : int) -> StructRow:
+        return StructRow(self, index)
+    def __setitem__(self, index : int, struct : StructValue):
+        for offset, value in enumerate(struct):
+            self.set(index, offset, value)
+    def __delitem__(self, indices : slice):
+        for column in self.columns:
+            del column[indices]
+        self.length -= len(range(self.length)[indices])
+    def __iter__(self) -> typing.Iterator[StructRow]:
+        return (StructRow(self, index) for index in range(self.length))
+    def set(self, index : int, offset : int, value : typing.Any):
+        try:
+            self.columns[offset][index] = value
+        except OverflowError:
+            self.columns[offset] = Storage(self.columns[offset])
+            self.columns[offset][index] = value
+    def append(self, struct : StructValue):
+        if self.length == 0 and len(self.columns) == 0:
+            self.struct_class = struct.struct_type()
+            self.columns = [new_storage([value]) for value in struct]
+        else:
+            for offset, value in enumerate(struct):
+                try:
+                    self.columns[offset].append(value)
+                except OverflowError:
+                    self.columns[offset] = Storage(self.columns[offset])
+                    self.columns[offset].append(value)
+        self.length += 1
+    def section(self, start : int, end : int) -> ColumnStorage:
+        storage = ColumnStorage()
+        storage.struct_class = self.struct_class
+        storage.columns = [column.section(start, end) for column in self.columns]
+        storage.length = len(range(self.length)[start:end])
+        return storage
+
+# An element of a columnar array
+class StructRow(StructValue):
+    __slots__ = ("storage", "row")
+    def __init__(self, storage : ColumnStorage, row : int):
+        self.storage = storage
+        self.row = row
+    @property
+    def name(self) -> str: # type: ignore
+        return self.storage.struct_class.name
+    @property
+    def field_names(self) -> typing.Tuple[str, ...]: # type: ignore
+        return self.storage.struct_class.field_names
+    def struct_type(self) -> typing.Type[StructValue]:
+        return self.storage.struct_class
+    def copy(self) -> StructValue:
+        return self.storage.struct_class(map(copy_value, self))
+    def __len__(self):
+        return len(self.storage.columns)
+    # Only single fields are accessed, no slices
+    def __getitem__(self, offset : int) -> typing.Any: # type: ignore
+        return self.storage.columns[offset][self.row]
+    def __setitem__(self, offset : int, value : typing.Any): # type: ignore
+        self.storage.set(self.row, offset, value)
+    def __iter__(self) -> typing.Iterator[typing.Any]:
+        return (column[self.row] for column in self.storage.columns)
+    def __eq__(self, other):
+        return list(self) == list(other)
@@ -0,0 +1,478 @@
+from __future__ import annotations
+import ast
+import bong_builtins
+import bongtypes
+from evaluator import resolve_module, pipeline_syscalls, struct_value_class
+import memo
+import operations
+import typing
+
+# Bytecode for the bong vm (see vm.py). A typechecked program is compiled into
+# one Code object per function plus one for the top-level statements.
+#
+# Instructions are stored in a flat list of integers as pairs of opcode and
+# argument (instructions without argument use 0), a list is indexed faster by
+# the vm than an array.array. Depending on the opcode,
+# the argument is a frame slot, an index into the constants of the Code
+# object, an absolute jump target (the offset in the instruction array) or a
+# count. The vm is a stack machine, the stack effect of each instruction is
+# given below.
+#
+# Expressions are compiled in two different ways: In value context, exactly
+# one value is pushed (like Eval.evaluate(node)[0]). In list context, a
+# ValueList is pushed which can contain any number of values (like
+# Eval.evaluate(node)). Statements leave the stack unchanged. Their results
+# are only required when they could be the result of a function which
+# does not return explicitly (or of the whole program), then they are stored
+# to the result register of the current call.
+
+OPCODES = [
+        "LOAD",          # push frame[arg]
+        "CONST",         # push constants[arg]
+        "STORE",         # frame[arg] = pop
+        "BINARY",        # rhs = pop, lhs = pop, push the result of operation BINARY_OPERATIONS[arg]
+        "JUMP_IF_FALSE", # pop, jump to arg if the value is not true
+        "JUMP",          # jump to arg
+        "CALL",          # pop arguments, call the bong function constants[arg], push its ValueList
+        "CALL_MEMO",     # like CALL, but look up and store the result in the cache of constants[arg]
+        "TAIL_CALL",     # pop arguments, replace the current call by a call of the bong function constants[arg]
+        "CALL_BUILTIN",  # pop arguments, call constants[arg] = (function, argument count, copies arguments), push its ValueList
+        "COPY",          # replace top by its copy (call by value, see bongvalues.copy_value())
+        "ESCAPE",        # mark the array or map on top as escaped (see bongvalues.escape())
+        "RETURN",        # pop ValueList and return it from the current call
+        "RETURN_RESULT", # return the result register (empty ValueList if not set)
+        "FIRST",         # replace the ValueList on top by its first value
+        "BUILD_LIST",    # pop arg values, push them as ValueList
+        "NEW_LIST",      # push empty ValueList
+        "APPEND",        # pop value or ValueList, append to (flattened) the ValueList on top
+        "UNPACK",        # pop ValueList with arg values, push them in reverse order
+        "DUP",           # push top again
+        "POP",           # pop and discard
+        "SET_RESULT",    # pop ValueList into the result register
+        "NOT",           # replace top by its negation
+        "NEG",           # replace top by -top
+        "INDEX",         # container = pop, index = pop, push container[index]
+        "SLICE",         # container = pop, high = pop, low = pop, push the slice container[low:high]
+        "STORE_INDEX",   # container = pop, index = pop, value = pop, container[index] = value
+        "GET_FIELD",     # replace struct on top by its field at offset arg
+        "STORE_FIELD",   # struct = pop, value = pop, struct[arg] = value (field offset arg)
+        "BUILD_ARRAY",   # pop arg values, push them as array
+        "BUILD_MAP",     # pop arg keys and values (key, value, key, ...), push them as map
+        "BUILD_STRUCT",  # constants[arg] = (StructValue class, field offsets or None if in order), pop field values, push StructValue
+        "PRINT",         # pop ValueList and print it
+        "SYSCALL",       # call the program described by the ast.SysCall constants[arg], push its exit code
+        "PIPELINE",      # stdin = pop, run constants[arg] = (program calls, output count), push exit code and ValueList of outputs
+        "UNKNOWN",       # raise an error about the unknown identifier constants[arg]
+        ]
+# The opcodes are the indices in OPCODES
+LOAD, CONST, STORE, BINARY, JUMP_IF_FALSE, JUMP, CALL, CALL_MEMO, TAIL_CALL, \
+        CALL_BUILTIN, COPY, ESCAPE, RETURN, RETURN_RESULT, FIRST, BUILD_LIST, NEW_LIST, \
+        APPEND, UNPACK, DUP, POP, SET_RESULT, NOT, NEG, INDEX, SLICE, STORE_INDEX, \
+        GET_FIELD, STORE_FIELD, BUILD_ARRAY, BUILD_MAP, BUILD_STRUCT, PRINT, \
+        SYSCALL, PIPELINE, UNKNOWN = range(len(OPCODES))
+
+# The argument of BINARY is the index of the operation in this list, see
+# operations.py
+BINARY_OPERATIONS = list(operations.BINARY_OPERATIONS)
+BINARY_INDEX = {name: index for index, name in enumerate(BINARY_OPERATIONS)}
+
+# A compiled function (or the top-level statements of a unit)
+class Code:
+    def __init__(self, name : str, frame_size : int = 0, parameter_slots : typing.Optional[typing.List[int]] = None):
+        self.name = name
+        self.frame_size = frame_size
+        self.parameter_slots = parameter_slots if parameter_slots != None else []
+        self.instructions : typing.List[int] = []
+        self.constants : typing.List[typing.Any] = []
+        # The cache of a memoized function, see memo.py
+        self.cache : typing.Optional[memo.MemoCache] = None
+    def __str__(self):
+        return f"<code {self.name}>"
+
+class Compiler:
+    def __init__(self, modules : typing.Dict[str, ast.TranslationUnit], memoized : typing.Optional[memo.Memo] = None):
+        # Modules are registered by the vm before compiling a program
+        self.modules = modules
+        # The vm's caches for memoized functions
+        self.memo = memoized
+        # Compiled bong functions of all units, each compiled once
+        self.functions : typing.Dict[ast.FunctionDefinition, Code] = {}
+        # The Code object and unit which are compiled currently
+        self.code = Code("")
+        self.unit : typing.Optional[ast.TranslationUnit] = None
+        # Deduplication of the current Code object's constants
+        self.constant_indices : typing.Dict[typing.Any, int] = {}
+
+    # Compile the top-level statements of the given translation unit. Global
+    # names are resolved in unit which can differ from node in shell mode
+    # (where all function definitions are retained in one unit).
+    def compile_unit(self, node : ast.TranslationUnit, unit : ast.TranslationUnit) -> Code:
+        code = Code("<main>", node.frame_size)
+        def body():
+            for i, stmt in enumerate(node.statements):
+                # Only the last statement's result is the program's result
+                self.compile_statement(stmt, i == len(node.statements) - 1)
+            self.emit(RETURN_RESULT)
+        self.build(code, unit, body)
+        return code
+
+    def compile_function(self, unit : ast.TranslationUnit, definition : ast.FunctionDefinition) -> Code:
+        if definition in self.functions:
+            return self.functions[definition]
+        # Register the Code object before compiling the body so that recursive
+        # calls can refer to it
+        code = Code(definition.name, definition.frame_size, definition.parameter_slots)
+        if self.memo != None:
+            code.cache = self.memo.cache(definition)
+        self.functions[definition] = code
+        def body():
+            self.compile_statement(definition.body, True)
+            self.emit(RETURN_RESULT)
+        self.build(code, unit, body)
+        return code
+
+    # Run body() with code as the compilation target. Functions are compiled
+    # when the first call is compiled, so builds can be nested.
+    def build(self, code : Code, unit : ast.TranslationUnit, body : typing.Callable[[], None]):
+        previous = (self.code, self.unit, self.constant_indices)
+        self.code, self.unit, self.constant_indices = code, unit, {}
+        try:
+            body()
+        finally:
+            self.code, self.unit, self.constant_indices = previous
+
+    def emit(self, op : int, arg : int = 0) -> int:
+        self.code.instructions.append(op)
+        self.code.instructions.append(arg)
+        return len(self.code.instructions) - 2
+
+    # Emit a jump whose target is set later with patch()
+    def emit_jump(self, op : int) -> int:
+        return self.emit(op, -1)
+    def patch(self, jump : int, target : typing.Optional[int] = None):
+        self.code.instructions[jump + 1] = target if target != None else len(self.code.instructions)
+    def position(self) -> int:
+        return len(self.code.instructions)
+
+    def constant(self, value : typing.Any) -> int:
+        # Equal values of different types (1, 1.0, true) must not be merged,
+        # unhashable constants (ast nodes are hashed by identity) are not
+        # deduplicated.
+        try:
+            key : typing.Any = (type(value), value)
+            hash(key)
+        except TypeError:
+            key = (type(value), id(value))
+        if key not in self.constant_indices:
+            self.constant_indices[key] = len(self.code.constants)
+            self.code.constants.append(value)
+        return self.constant_indices[key]
+
+    # Statements leave the stack unchanged. If keep_result is set, the
+    # statement's result (see Eval.evaluate()) is stored to the result
+    # register.
+    def compile_statement(self, node : ast.BaseNode, keep_result : bool):
+        if isinstance(node, ast.Block):
+            for i, stmt in enumerate(node.stmts):
+                self.compile_statement(stmt, keep_result and i == len(node.stmts) - 1)
+            if keep_result and len(node.stmts) == 0:
+                self.emit_empty_result()
+        elif isinstance(node, ast.Return):
+            if node.result == None:
+                self.emit(NEW_LIST)
+            elif node.tail_call != None:
+                # The callee's result is returned directly
+                unit, funcname = self.resolve_call(node.tail_call)
+                callee = self.compile_arguments(unit, funcname, node.tail_call)
+                self.emit(TAIL_CALL, self.constant(callee))
+                return
+            else:
+                self.compile_list(node.result)
+            self.emit(RETURN)
+        elif isinstance(node, ast.IfElseStatement):
+            self.compile_value(node.cond)
+            to_else = self.emit_jump(JUMP_IF_FALSE)
+            self.compile_statement(node.thn, keep_result)
+            to_end = self.emit_jump(JUMP)
+            self.patch(to_else)
+            if isinstance(node.els, ast.BaseNode):
+                self.compile_statement(node.els, keep_result)
+            elif keep_result:
+                self.emit_empty_result()
+            self.patch(to_end)
+        elif isinstance(node, ast.WhileStatement):
+            # Without any iteration, the result is empty
+            if keep_result:
+                self.emit_empty_result()
+            start = self.position()
+            self.compile_value(node.cond)
+            to_end = self.emit_jump(JUMP_IF_FALSE)
+            self.compile_statement(node.t, keep_result)
+            self.emit(JUMP, start)
+            self.patch(to_end)
+        elif isinstance(node, ast.Let):
+            if (len(node.names) == 1 and isinstance(node.expr, ast.ExpressionList)
+                    and self.is_single_value(node.expr)):
+                self.compile_value(node.expr.elements[0])
+            else:
+                self.compile_list(node.expr)
+                self.emit(UNPACK, len(node.names))
+            for slot in node.slots:
+                self.emit(STORE, slot)
+            if keep_result:
+                self.emit_empty_result()
+        elif isinstance(node, ast.Print):
+            self.compile_list(node.expr)
+            self.emit(PRINT)
+            if keep_result:
+                self.emit_empty_result()
+        elif keep_result:
+            self.compile_list(node)
+            self.emit(SET_RESULT)
+        elif (isinstance(node, ast.AssignOp) and len(node.lhs) == 1
+                and isinstance(node.rhs, ast.ExpressionList) and self.is_single_value(node.rhs)):
+            # Fast path for simple assignments whose result is not used
+            self.compile_value(node.rhs.elements[0])
+            self.compile_assignment_target(node.lhs[0])
+        else:
+            self.compile_list(node)
+            self.emit(POP)
+
+    def emit_empty_result(self):
+        self.emit(NEW_LIST)
+        self.emit(SET_RESULT)
+
+    # An ExpressionList that consists of a single expression with a single
+    # value
+    def is_single_value(self, node : ast.ExpressionList) -> bool:
+        return len(node.elements) == 1 and self.is_value_node(node.elements[0])
+
+    # Nodes which are evaluated to exactly one value natively
+    def is_value_node(self, node : ast.BaseNode) -> bool:
+        return (isinstance(node, ast.Identifier) or isinstance(node, ast.BinOp)
+                or isinstance(node, ast.UnaryOp) or isinstance(node, ast.Integer)
+                or isinstance(node, ast.Float) or isinstance(node, ast.String)
+                or isinstance(node, ast.Bool) or isinstance(node, ast.IndexAccess)
+                or isinstance(node, ast.SliceAccess)
+                or isinstance(node, ast.DotAccess) or isinstance(node, ast.Array)
+                or isinstance(node, ast.Map)
+                or isinstance(node, ast.StructValue) or isinstance(node, ast.SysCall)
+                or isinstance(node, ast.Pipeline))
+
+    # Push one ValueList
+    def compile_list(self, node : ast.BaseNode):
+        if isinstance(node, ast.ExpressionList):
+            if len(node.elements) == 1:
+                self.compile_list(node.elements[0])
+            elif all(self.is_value_node(e) for e in node.elements):
+                for e in node.elements:
+                    self.compile_value(e)
+                self.emit(BUILD_LIST, len(node.elements))
+            else:
+                self.emit(NEW_LIST)
+                for e in node.elements:
+                    if self.is_value_node(e):
+                        self.compile_value(e)
+                    else:
+                        self.compile_list(e)
+                    self.emit(APPEND)
+        elif isinstance(node, ast.FunctionCall):
+            self.compile_call(node)
+        elif isinstance(node, ast.AssignOp):
+            # The assignment evaluates to the assigned values
+            self.compile_list(node.rhs)
+            self.emit(DUP)
+            self.emit(UNPACK, len(node.lhs))
+            for target in node.lhs:
+                self.compile_assignment_target(target)
+        elif self.is_value_node(node):
+            self.compile_value(node)
+            self.emit(BUILD_LIST, 1)
+        else:
+            raise Exception("unknown ast node")
+
+    # Push one value
+    def compile_value(self, node : ast.BaseNode):
+        if isinstance(node, ast.Identifier):
+            if node.slot != None:
+                self.emit(LOAD, node.slot)
+            else:
+                self.emit(UNKNOWN, self.constant(node.name))
+        elif isinstance(node, ast.BinOp):
+            # The typechecker has chosen the operation for the operand types
+            self.compile_value(node.lhs)
+            self.compile_value(node.rhs)
+            self.emit(BINARY, BINARY_INDEX[node.operation])
+        elif isinstance(node, ast.UnaryOp):
+            self.compile_value(node.rhs)
+            if node.operation == "bool-not":
+                self.emit(NOT)
+            elif node.operation == "int-neg" or node.operation == "float-neg":
+                self.emit(NEG)
+            else:
+                raise Exception("unrecognised unary operation: " + str(node.operation))
+        elif (isinstance(node, ast.Integer) or isinstance(node, ast.Float)
+                or isinstance(node, ast.String) or isinstance(node, ast.Bool)):
+            self.emit(CONST, self.constant(node.value))
+        elif isinstance(node, ast.IndexAccess):
+            self.compile_value(node.rhs)
+            self.compile_value(node.lhs)
+            if node.escapes:
+                self.emit(ESCAPE)
+            self.emit(INDEX)
+        elif isinstance(node, ast.SliceAccess):
+            for bound in (node.low, node.high):
+                if bound != None:
+                    self.compile_value(bound)
+                else:
+                    self.emit(CONST, self.constant(None))
+            self.compile_value(node.lhs)
+            self.emit(SLICE)
+        elif isinstance(node, ast.DotAccess):
+            self.compile_value(node.lhs)
+            self.emit(GET_FIELD, node.field)
+        elif isinstance(node, ast.Array):
+            for e in node.elements:
+                self.compile_value(e)
+            self.emit(BUILD_ARRAY, len(node.elements))
+            if node.escapes:
+                self.emit(ESCAPE)
+        elif isinstance(node, ast.Map):
+            for key, value in zip(node.keys, node.values):
+                self.compile_value(key)
+                self.compile_value(value)
+            self.emit(BUILD_MAP, len(node.keys))
+            if node.escapes:
+                self.emit(ESCAPE)
+        elif isinstance(node, ast.StructValue):
+            # The vm moves the values to their offsets unless they are given
+            # in the type's field order already
+            for expr in node.fields.values():
+                self.compile_value(expr)
+            offsets = None
+            if list(node.fields) != node.field_names:
+                offsets = tuple(node.field_names.index(name) for name in node.fields)
+            self.emit(BUILD_STRUCT, self.constant((struct_value_class(node), offsets)))
+        elif isinstance(node, ast.SysCall):
+            self.emit(SYSCALL, self.constant(node))
+        elif isinstance(node, ast.Pipeline):
+            self.compile_pipeline(node)
+        else:
+            self.compile_list(node)
+            self.emit(FIRST)
+
+    # Pops the value on top of the stack and assigns it to node
+    def compile_assignment_target(self, node : ast.BaseNode):
+        if isinstance(node, ast.Identifier):
+            # Only local variables can be assigned, so there is a slot
+            self.emit(STORE, node.slot) # type: ignore
+        elif isinstance(node, ast.IndexAccess):
+            self.compile_value(node.rhs)
+            self.compile_value(node.lhs)
+            if node.escapes:
+                self.emit(ESCAPE)
+            self.emit(STORE_INDEX)
+        elif isinstance(node, ast.DotAccess):
+            self.compile_value(node.lhs)
+            self.emit(STORE_FIELD, node.field)
+        else:
+            raise Exception("Can only assign to variable or indexed variable")
+
+    # Push the exit code of the pipeline
+    def compile_pipeline(self, node : ast.Pipeline):
+        if isinstance(node.elements[0], ast.SysCall):
+            self.emit(CONST, self.constant(None))
+        else:
+            self.compile_list(node.elements[0])
+        self.emit(PIPELINE, self.constant(pipeline_syscalls(node)))
+        assignto = node.elements[-1]
+        if isinstance(assignto, ast.PipelineLet):
+            self.emit(UNPACK, len(assignto.names))
+            for slot in assignto.slots:
+                self.emit(STORE, slot)
+        elif isinstance(assignto, ast.ExpressionList):
+            self.emit(UNPACK, len(assignto))
+            for target in assignto:
+                self.compile_assignment_target(target)
+        elif not isinstance(assignto, ast.SysCall):
+            self.emit(UNPACK, 1)
+            self.compile_assignment_target(assignto)
+        else:
+            self.emit(POP)
+
+    # The called function is resolved at compile time, either in the current
+    # unit or in the module described by the DotAccess.
+    def resolve_call(self, node : ast.FunctionCall) -> typing.Tuple[ast.TranslationUnit, str]:
+        assert(self.unit != None)
+        if isinstance(node.name, ast.Identifier):
+            return self.unit, node.name.name
+        elif isinstance(node.name, ast.DotAccess):
+            return resolve_module(self.modules, self.unit, node.name.lhs), node.name.rhs
+        raise Exception("Identifier or DotAccess for function name expected.")
+
+    # Push the arguments of a bong function call, return the callee's code.
+    # Call by value! Arrays and structs are copied on write, arguments of
+    # read-only parameters not at all.
+    def compile_arguments(self, unit : ast.TranslationUnit, funcname : str, node : ast.FunctionCall) -> Code:
+        definition = unit.function_definitions[funcname]
+        for a, readonly in zip(node.args, definition.readonly_parameters):
+            self.compile_value(a)
+            if not readonly:
+                self.emit(COPY)
+        return self.compile_function(unit, definition)
+
+    # Push the ValueList returned by the function
+    def compile_call(self, node : ast.FunctionCall):
+        unit, funcname = self.resolve_call(node)
+        if isinstance(unit.symbols_global[funcname], bongtypes.Function):
+            code = self.compile_arguments(unit, funcname, node)
+            self.emit(CALL if code.cache == None else CALL_MEMO, self.constant(code))
+        else:
+            builtin, check, copies = bong_builtins.functions[funcname]
+            for a in node.args:
+                self.compile_value(a)
+            self.emit(CALL_BUILTIN, self.constant((builtin, len(node.args), copies)))
+
+# Human readable listing of the code object and all functions it calls
+def disassemble(code : Code) -> str:
+    lines : typing.List[str] = []
+    pending = [code]
+    listed = set()
+    while len(pending) > 0:
+        code = pending.pop(0)
+        if id(code) in listed:
+            continue
+        listed.add(id(code))
+        lines.append(f"{code.name} (frame size {code.frame_size}, parameter slots {code.parameter_slots}):")
+        instructions = code.instructions
+        for offset in range(0, len(instructions), 2):
+            op, arg = instructions[offset], instructions[offset+1]
+            line = f"{offset:6} {OPCODES[op]:<14}"
+            if op in (LOAD, STORE):
+                line += f" {arg:<5} (slot)"
+            elif op in (JUMP, JUMP_IF_FALSE):
+                line += f" {arg:<5} (target)"
+            elif op in (BUILD_LIST, UNPACK, BUILD_ARRAY, BUILD_MAP):
+                line += f" {arg:<5} (count)"
+            elif op in (GET_FIELD, STORE_FIELD):
+                line += f" {arg:<5} (field)"
+            elif op == BINARY:
+                line += f" {arg:<5} ({BINARY_OPERATIONS[arg]})"
+            elif op in (CONST, CALL, CALL_MEMO, TAIL_CALL, CALL_BUILTIN,
+                    BUILD_STRUCT, SYSCALL, PIPELINE, UNKNOWN):
+                constant = code.constants[arg]
+                if op == CALL or op == CALL_MEMO or op == TAIL_CALL:
+                    pending.append(constant)
+                    constant = constant.name
+                elif op == CALL_BUILTIN:
+                    constant = constant[0].__name__
+                elif op == BUILD_STRUCT:
+                    constant = f"{constant[0].name} {{ {', '.join(constant[0].field_names)} }}"
+                elif op == PIPELINE:
+                    constant = " | ".join(map(str, constant[0])) + f", {constant[1]} output(s)"
+                elif op == CONST:
+                    constant = repr(constant)
+                line += f" {arg:<5} ({constant})"
+            lines.append(line.rstrip())
+        lines.append("")
+    return "\n".join(lines)
@@ -0,0 +1,428 @@
+from __future__ import annotations
+import ast
+import bong_builtins
+import bongtypes
+from bongvalues import ValueList, ArrayValue, MapValue, TailCall, copy_value, copy_values, slice_value, escape
+from evaluator import Eval, RecursionDepthError, resolve_module, pipeline_syscalls, struct_value_class
+from operations import BINARY_OPERATIONS, UNARY_OPERATIONS
+import sys
+import typing
+
+# The closure engine is an alternative to the tree walking Eval.evaluate().
+# Instead of dispatching on the node type again and again whenever a node is
+# evaluated, the typechecked ast is converted once into a tree of python
+# closures. Each closure evaluates one node, everything that can be decided
+# ahead of time (the operator, the child closures, the frame slots, the
+# called function) is already bound when the closure is created.
+#
+# All closures take the current frame (the list of local variables, see
+# Eval.locals) as their only argument. There are two kinds of closures:
+# - value closures (compile_value()) return the single value of an
+#   expression. They are used wherever the evaluator would take the first
+#   element of an evaluated ValueList.
+# - list closures (compile()) return a (new) ValueList, exactly like
+#   Eval.evaluate() does for the same node. Statements are compiled to list
+#   closures so that return statements can be unwound.
+#
+# Everything the tree walker does not need the ast for is inherited from Eval
+# (program calls, pipelines, cd, the top-level frame, the modules).
+
+Frame = typing.List[typing.Any]
+ValueClosure = typing.Callable[[Frame], typing.Any]
+ListClosure = typing.Callable[[Frame], ValueList]
+AssignClosure = typing.Callable[[Frame, typing.Any], None]
+
+# The most frequent arithmetic operations use the python operator directly
+# instead of calling the operation's function
+SPECIALISED_CLOSURES : typing.Dict[str, typing.Callable[[ValueClosure, ValueClosure], ValueClosure]] = {
+        "int-add": lambda lhs, rhs: lambda frame: lhs(frame) + rhs(frame),
+        "int-sub": lambda lhs, rhs: lambda frame: lhs(frame) - rhs(frame),
+        "int-mul": lambda lhs, rhs: lambda frame: lhs(frame) * rhs(frame),
+        "float-add": lambda lhs, rhs: lambda frame: lhs(frame) + rhs(frame),
+        "float-sub": lambda lhs, rhs: lambda frame: lhs(frame) - rhs(frame),
+        "float-mul": lambda lhs, rhs: lambda frame: lhs(frame) * rhs(frame),
+        "num-lt": lambda lhs, rhs: lambda frame: lhs(frame) < rhs(frame),
+        "num-le": lambda lhs, rhs: lambda frame: lhs(frame) <= rhs(frame),
+        "num-eq": lambda lhs, rhs: lambda frame: lhs(frame) == rhs(frame),
+        }
+
+# Value closure for a copy of the value
+def copying(value : ValueClosure) -> ValueClosure:
+    return lambda frame: copy_value(value(frame))
+
+# A bong function, compiled once. The body is set after the function object
+# has been registered so that recursive calls can refer to it.
+class CompiledFunction:
+    def __init__(self, definition : ast.FunctionDefinition):
+        self.frame_size = definition.frame_size
+        self.parameter_slots = definition.parameter_slots
+        self.body : ListClosure = lambda frame: ValueList([])
+
+class ClosureEval(Eval):
+    def __init__(self, printfunc=print):
+        super().__init__(printfunc)
+        # Compiled functions of all units, each compiled on first use
+        self.functions : typing.Dict[ast.FunctionDefinition, CompiledFunction] = {}
+        # The translation unit whose nodes are compiled currently. Global
+        # names (functions, modules, types) are resolved in its symbol table.
+        self.unit = self.current_unit.unit
+
+    def evaluate(self, node : ast.BaseNode) -> ValueList:
+        if isinstance(node, ast.Program):
+            # Register all imported modules
+            for k, m in node.modules.items():
+                self.modules[k] = m
+            try:
+                return self.compile_unit(node.main_unit)(self.locals)
+            except RecursionError:
+                raise RecursionDepthError() from None
+        elif isinstance(node, ast.TranslationUnit):
+            return self.compile_unit(node)(self.locals)
+        return self.compile(node)(self.locals)
+
+    # The main unit's function definitions and symbols are retained across
+    # evaluations in shell mode, just like in Eval.evaluate().
+    def compile_unit(self, node : ast.TranslationUnit) -> ListClosure:
+        unit = self.current_unit.unit
+        for k, f in node.function_definitions.items():
+            unit.function_definitions[k] = f
+        unit.symbols_global = node.symbols_global
+        if len(self.locals) < node.frame_size:
+            self.locals.extend([None] * (node.frame_size - len(self.locals)))
+        self.unit = unit
+        stmts = [self.compile(stmt) for stmt in node.statements]
+        def run_unit(frame):
+            res = ValueList([])
+            for stmt in stmts:
+                res = stmt(frame)
+                if res.unwind_return:
+                    # ast.Program is the top-level-node, return means exit then
+                    sys.exit(res[0] if len(res) > 0 else None)
+            return res
+        return run_unit
+
+    def compile_function(self, unit : ast.TranslationUnit, definition : ast.FunctionDefinition) -> CompiledFunction:
+        if definition in self.functions:
+            return self.functions[definition]
+        function = CompiledFunction(definition)
+        self.functions[definition] = function
+        # Function bodies are compiled in the context of their own unit
+        previous_unit = self.unit
+        self.unit = unit
+        try:
+            function.body = self.compile(definition.body)
+        finally:
+            self.unit = previous_unit
+        return function
+
+    # Compile a node to a list closure
+    def compile(self, node : ast.BaseNode) -> ListClosure:
+        if isinstance(node, ast.Block):
+            stmts = [self.compile(stmt) for stmt in node.stmts]
+            def block(frame):
+                result = ValueList([])
+                for stmt in stmts:
+                    result = stmt(frame)
+                    if result.unwind_return:
+                        break
+                return result
+            return block
+        elif isinstance(node, ast.Return):
+            if node.result == None:
+                return lambda frame: ValueList([], True)
+            if node.tail_call != None:
+                # The call replaces the current call, see compile_call()
+                function, args = self.compile_function_call(node.tail_call)
+                def tail_call(frame):
+                    return TailCall(function, [a(frame) for a in args])
+                return tail_call
+            result = self.compile(node.result)
+            def return_(frame):
+                values = result(frame)
+                values.unwind_return = True
+                return values
+            return return_
+        elif isinstance(node, ast.IfElseStatement):
+            cond = self.compile_value(node.cond)
+            thn = self.compile(node.thn)
+            if isinstance(node.els, ast.BaseNode):
+                els = self.compile(node.els)
+            else:
+                els = lambda frame: ValueList([])
+            def if_else(frame):
+                if cond(frame) == True:
+                    return thn(frame)
+                return els(frame)
+            return if_else
+        elif isinstance(node, ast.WhileStatement):
+            cond = self.compile_value(node.cond)
+            body = self.compile(node.t)
+            def while_(frame):
+                ret = ValueList([])
+                while cond(frame) == True:
+                    ret = body(frame)
+                    if ret.unwind_return:
+                        break
+                return ret
+            return while_
+        elif isinstance(node, ast.AssignOp):
+            rhs = self.compile(node.rhs)
+            assign = self.compile_assignment(node.lhs)
+            def assign_op(frame):
+                values = rhs(frame)
+                assign(frame, values)
+                return values
+            return assign_op
+        elif isinstance(node, ast.Pipeline):
+            return self.compile_pipeline(node)
+        elif isinstance(node, ast.FunctionCall):
+            return self.compile_call(node)
+        elif isinstance(node, ast.Print):
+            expr = self.compile(node.expr)
+            printfunc = self.printfunc
+            def print_(frame):
+                printfunc(expr(frame))
+                return ValueList([])
+            return print_
+        elif isinstance(node, ast.Let):
+            expr = self.compile(node.expr)
+            slots = node.slots
+            count = len(node.names)
+            def let(frame):
+                results = expr(frame)
+                if count != len(results):
+                    raise Exception("number of expressions between rhs and lhs do not match")
+                for slot, result in zip(slots, results):
+                    frame[slot] = result
+                return ValueList([])
+            return let
+        elif isinstance(node, ast.ExpressionList):
+            elements = [self.compile(exp) for exp in node.elements]
+            if len(elements) == 1:
+                # The element's closure already returns a new ValueList
+                return elements[0]
+            def expression_list(frame):
+                results = ValueList([])
+                for exp in elements:
+                    results.append(exp(frame))
+                return results
+            return expression_list
+        # Everything else is a single value
+        value = self.compile_value(node)
+        return lambda frame: ValueList([value(frame)])
+
+    # Compile an expression to a value closure
+    def compile_value(self, node : ast.BaseNode) -> ValueClosure:
+        if isinstance(node, ast.Identifier):
+            slot = node.slot
+            if slot != None:
+                return lambda frame: frame[slot]
+            name = node.name
+            def unknown_identifier(frame):
+                raise Exception(f"Unknown identifier '{name}' specified. TODO: global environment.")
+            return unknown_identifier
+        elif isinstance(node, ast.BinOp):
+            # The typechecker has chosen the operation for the operand types
+            lhs = self.compile_value(node.lhs)
+            rhs = self.compile_value(node.rhs)
+            if node.operation in SPECIALISED_CLOSURES:
+                return SPECIALISED_CLOSURES[node.operation](lhs, rhs)
+            binary = BINARY_OPERATIONS[node.operation][0]
+            return lambda frame: binary(lhs(frame), rhs(frame))
+        elif isinstance(node, ast.UnaryOp):
+            unary = UNARY_OPERATIONS[node.operation][0]
+            rhs = self.compile_value(node.rhs)
+            return lambda frame: unary(rhs(frame))
+        elif (isinstance(node, ast.Integer) or isinstance(node, ast.Float)
+                or isinstance(node, ast.String) or isinstance(node, ast.Bool)):
+            constant = node.value
+            return lambda frame: constant
+        elif isinstance(node, ast.SysCall):
+            callprogram = self.callprogram
+            return lambda frame: callprogram(node)
+        elif isinstance(node, ast.IndexAccess):
+            index = self.compile_value(node.rhs)
+            lhs = self.compile_value(node.lhs)
+            if node.escapes:
+                def escaping_index_access(frame):
+                    i = index(frame)
+                    return escape(lhs(frame))[i]
+                return escaping_index_access
+            def index_access(frame):
+                i = index(frame)
+                return lhs(frame)[i]
+            return index_access
+        elif isinstance(node, ast.SliceAccess):
+            low = self.compile_value(node.low) if node.low != None else lambda frame: None
+            high = self.compile_value(node.high) if node.high != None else lambda frame: None
+            lhs = self.compile_value(node.lhs)
+            def slice_access(frame):
+                i = low(frame)
+                j = high(frame)
+                return slice_value(lhs(frame), i, j)
+            return slice_access
+        elif isinstance(node, ast.DotAccess):
+            # Module accesses are only used in function calls and struct
+            # values which resolve them at compile time
+            struct = self.compile_value(node.lhs)
+            field = node.field
+            return lambda frame: struct(frame)[field]
+        elif isinstance(node, ast.Array):
+            elements = [self.compile_value(e) for e in node.elements]
+            if node.escapes:
+                return lambda frame: escape(ArrayValue([e(frame) for e in elements]))
+            return lambda frame: ArrayValue([e(frame) for e in elements])
+        elif isinstance(node, ast.Map):
+            keys = [self.compile_value(key) for key in node.keys]
+            values = [self.compile_value(value) for value in node.values]
+            entries = list(zip(keys, values))
+            if node.escapes:
+                return lambda frame: escape(MapValue([(key(frame), value(frame)) for key, value in entries]))
+            return lambda frame: MapValue([(key(frame), value(frame)) for key, value in entries])
+        elif isinstance(node, ast.StructValue):
+            cls = struct_value_class(node)
+            exprs = [self.compile_value(expr) for expr in node.fields.values()]
+            if list(node.fields) == node.field_names:
+                return lambda frame: cls([expr(frame) for expr in exprs])
+            # Evaluate in source order, then move to the type's field order
+            offsets = [node.field_names.index(name) for name in node.fields]
+            def struct_value(frame):
+                values : typing.List[typing.Any] = [None] * len(offsets)
+                for offset, expr in zip(offsets, exprs):
+                    values[offset] = expr(frame)
+                return cls(values)
+            return struct_value
+        elif (isinstance(node, ast.Block) or isinstance(node, ast.Return)
+                or isinstance(node, ast.IfElseStatement)
+                or isinstance(node, ast.WhileStatement)
+                or isinstance(node, ast.AssignOp) or isinstance(node, ast.Pipeline)
+                or isinstance(node, ast.FunctionCall) or isinstance(node, ast.Print)
+                or isinstance(node, ast.Let) or isinstance(node, ast.ExpressionList)):
+            compiled = self.compile(node)
+            return lambda frame: compiled(frame)[0]
+        raise Exception("unknown ast node")
+
+    # Compile the lhs of an assignment to a closure which assigns all values
+    # of a ValueList (see Eval.assign())
+    def compile_assignment(self, lhs : ast.ExpressionList) -> typing.Callable[[Frame, ValueList], None]:
+        targets = [self.compile_target(l) for l in lhs]
+        def assign(frame, rhs):
+            if len(rhs)!=len(targets):
+                raise Exception("number of elements on lhs and rhs does not match")
+            for target, value in zip(targets, rhs):
+                target(frame, value)
+        return assign
+
+    def compile_target(self, node : ast.BaseNode) -> AssignClosure:
+        if isinstance(node, ast.Identifier):
+            slot = node.slot
+            def assign_variable(frame, value):
+                frame[slot] = value
+            return assign_variable
+        elif isinstance(node, ast.IndexAccess):
+            index = self.compile_value(node.rhs)
+            array = self.compile_value(node.lhs)
+            if node.escapes:
+                def assign_escaping_index(frame, value):
+                    i = index(frame)
+                    escape(array(frame))[i] = value
+                return assign_escaping_index
+            def assign_index(frame, value):
+                i = index(frame)
+                array(frame)[i] = value
+            return assign_index
+        elif isinstance(node, ast.DotAccess):
+            struct = self.compile_value(node.lhs)
+            field = node.field
+            def assign_field(frame, value):
+                struct(frame)[field] = value
+            return assign_field
+        raise Exception("Can only assign to variable or indexed variable")
+
+    def compile_pipeline(self, node : ast.Pipeline) -> ListClosure:
+        if isinstance(node.elements[0], ast.SysCall):
+            stdin : typing.Callable[[Frame], typing.Optional[ValueList]] = lambda frame: None
+        else:
+            stdin = self.compile(node.elements[0])
+        assignto = node.elements[-1]
+        if isinstance(assignto, ast.PipelineLet):
+            slots = assignto.slots
+            count = len(assignto.names)
+            def assign(frame, results):
+                if count != len(results):
+                    raise Exception("number of expressions between rhs and lhs do not match")
+                for slot, result in zip(slots, results):
+                    frame[slot] = result
+        elif isinstance(assignto, ast.ExpressionList):
+            assign = self.compile_assignment(assignto)
+        elif not isinstance(assignto, ast.SysCall):
+            assign = self.compile_assignment(ast.ExpressionList([], [assignto]))
+        else:
+            assign = lambda frame, results: None
+        run_pipeline = self.run_pipeline
+        syscalls, numOutputPipes = pipeline_syscalls(node)
+        def pipeline(frame):
+            results, returncode = run_pipeline(syscalls, stdin(frame), numOutputPipes)
+            assign(frame, results)
+            return ValueList([returncode])
+        return pipeline
+
+    # The called function is resolved at compile time, either in the current
+    # unit or in the module described by the DotAccess.
+    def resolve_call(self, node : ast.FunctionCall) -> typing.Tuple[ast.TranslationUnit, str]:
+        if isinstance(node.name, ast.Identifier):
+            return self.unit, node.name.name
+        elif isinstance(node.name, ast.DotAccess):
+            return resolve_module(self.modules, self.unit, node.name.lhs), node.name.rhs
+        raise Exception("Identifier or DotAccess for function name expected.")
+
+    # The compiled bong function and the argument closures of a call
+    def compile_function_call(self, node : ast.FunctionCall) -> typing.Tuple[CompiledFunction, typing.List[ValueClosure]]:
+        unit, funcname = self.resolve_call(node)
+        definition = unit.function_definitions[funcname]
+        function = self.compile_function(unit, definition)
+        # Call by value! Arrays and structs are copied on write, arguments of
+        # read-only parameters not at all.
+        args = [self.compile_value(a) for a in node.args]
+        args = [arg if readonly else copying(arg) for arg, readonly in zip(args, definition.readonly_parameters)]
+        return function, args
+
+    def compile_call(self, node : ast.FunctionCall) -> ListClosure:
+        unit, funcname = self.resolve_call(node)
+        if isinstance(unit.symbols_global[funcname], bongtypes.Function):
+            # Bong function
+            function, args = self.compile_function_call(node)
+            cache = self.memo.cache(unit.function_definitions[funcname])
+            def invoke(values):
+                called = function
+                while True:
+                    callee = [None] * called.frame_size
+                    for slot, value in zip(called.parameter_slots, values):
+                        callee[slot] = value
+                    result = called.body(callee)
+                    if not isinstance(result, TailCall):
+                        break
+                    # Tail call: Call the returned function in place of this
+                    # one
+                    called, values = result.function, result.arguments
+                result.unwind_return = False
+                return result
+            if cache == None:
+                return lambda frame: invoke([a(frame) for a in args])
+            def memoized_call(frame):
+                values = [a(frame) for a in args]
+                key = tuple(values)
+                cached = cache.get(key)
+                if cached != None:
+                    return ValueList(cached)
+                result = invoke(values)
+                cache.put(key, result.elements)
+                return result
+            return memoized_call
+        # Builtin function
+        builtin, check, copies = bong_builtins.functions[funcname]
+        args = [self.compile_value(a) for a in node.args]
+        if copies:
+            # Copied once all arguments are evaluated, like in Eval
+            return lambda frame: builtin(copy_values([a(frame) for a in args]))
+        return lambda frame: builtin([a(frame) for a in args])
@@ -0,0 +1,15 @@
+import sys
+import unittest
+
+# The interpreter's ast.py shadows the ast module of the standard library.
+# pytest has imported the standard library's module already, drop it so that
+# the interpreter's modules import their own ast.
+if "ast" in sys.modules and hasattr(sys.modules["ast"], "NodeVisitor"):
+    del sys.modules["ast"]
+
+# The tests are unittest test cases, module level functions like test_eval()
+# are helpers and no tests
+def pytest_pycollect_makeitem(collector, name, obj):
+    if not (isinstance(obj, type) and issubclass(obj, unittest.TestCase)):
+        return []
+    return None
@@ -2,10 +2,10 @@ from __future__ import annotations
 import ast
 import bong_builtins
 import bongtypes
-from bongvalues import ValueList, StructValue
+from bongvalues import ValueList, StructValue, ArrayValue, MapValue, TailCall, copy_value, copy_values, struct_class, slice_value, escape
+from operations import BINARY_OPERATIONS, UNARY_OPERATIONS
+import memo
 import collections
-from symbol_tree import SymbolTree, SymbolTreeNode
-import copy
 
 # For subprocesses
 import os
@@ -17,6 +17,14 @@ import sys
 
 import typing
 
+# The tree and closure engines and translated code nest python calls for
+# bong calls, so deep non-tail recursion exceeds the python stack. The vm
+# keeps the bong call stack on the heap instead.
+class RecursionDepthError(Exception):
+    def __init__(self):
+        super().__init__("RuntimeError: Maximum recursion depth exceeded, run"
+                " deep non-tail recursion with the vm (--engine=vm).")
+
 class Eval:
     # Defined here so that it can be used by the parser
     BUILTIN_ENVIRONMENT = {
@@ -31,17 +39,16 @@ class Eval:
         # either in globals or locals.
         # Globals is a dictionary that maps global names to instances. It
         # contains modules, typedefs, functions.
-        # Locals is an array which acts as a stack for local variables.
-        # Top-level statements behave like being encapsulated in an implicit
-        # main()-function, i.e. their variables are not global!
-        # I think that we could always use a self.locals.append() whenever
-        # new names are pushed on the stack (function arguments and in let
-        # statements) but it looks more high-level to access the variables
-        # always in the same way, which is: self.locals[symbol_tree.get_index()].
-        # To enable this when declaring variables, we use a list that
-        # automatically grows.
+        # Locals is the frame of the current function call, a list which
+        # holds the local variables. Top-level statements behave like being
+        # encapsulated in an implicit main()-function, i.e. their variables
+        # are not global!
+        # The typechecker has already assigned a slot in the frame to each
+        # variable (see TypeChecker.assign_slot()) and computed how many
+        # slots a function requires, so frames are allocated with their
+        # final size and variables are accessed with self.locals[slot].
         #self.globals : typing.Dict[str, ]
-        self.locals = StackList()
+        self.locals : typing.List[typing.Any] = []
         # Modules/Imports, custom types and function definitions are accessed through
         # the ast.TranslationUnit directly. The evaluator can access/read the symbol table
         # to identify stuff.
@@ -49,11 +56,8 @@ class Eval:
         self.current_unit = TranslationUnitRef(ast.TranslationUnit([], collections.OrderedDict(), collections.OrderedDict(), [], {}))
         # All imported modules
         self.modules : typing.Dict[str, ast.TranslationUnit] = {}
-        # 
-        self.symbol_tree = SymbolTree()
-
-    def restore_symbol_tree(self, node : SymbolTreeNode):
-        self.symbol_tree.restore_snapshot(node)
+        # Results of calls of pure functions, see memo.py
+        self.memo = memo.Memo()
 
     def evaluate(self, node: ast.BaseNode) -> ValueList:
         if isinstance(node, ast.Program):
@@ -61,7 +65,10 @@ class Eval:
             for k, m in node.modules.items():
                 self.modules[k] = m
             # Then evaluate the main module/file/input
-            return self.evaluate(node.main_unit)
+            try:
+                return self.evaluate(node.main_unit)
+            except RecursionError:
+                raise RecursionDepthError() from None
         elif isinstance(node, ast.TranslationUnit):
             # First, retain/copy all function definitions. The other stuff seems
             # not to be required currently.
@@ -71,6 +78,10 @@ class Eval:
                 self.current_unit.unit.function_definitions[k] = f
             # Set the current symbol table (which could be a reused one)
             self.current_unit.unit.symbols_global = node.symbols_global
+            # The top-level frame is retained as well, it only has to grow
+            # for the variables declared by new input.
+            if len(self.locals) < node.frame_size:
+                self.locals.extend([None] * (node.frame_size - len(self.locals)))
             # Afterwards, run all non-function statements
             res = ValueList([])
             for stmt in node.statements:
@@ -83,17 +94,21 @@ class Eval:
                     sys.exit(res[0] if len(res) > 0 else None)
             return res
         elif isinstance(node, ast.Block):
-            symtree = self.symbol_tree.take_snapshot()
             result = ValueList([])
             for stmt in node.stmts:
                 result = self.evaluate(stmt)
                 if result.returned():
                     break
-            self.symbol_tree.restore_snapshot(symtree)
             return result
         elif isinstance(node, ast.Return):
             if node.result == None:
                 return ValueList([], True)
+            if node.tail_call != None:
+                # The call replaces the current call instead of nesting in it,
+                # see FunctionCall below
+                unit, funcname = self.get_function(node.tail_call)
+                args = [self.evaluate(a)[0] for a in node.tail_call.args]
+                return TailCall(unit.function_definitions[funcname], args, unit)
             result = self.evaluate(node.result)
             result.unwind_return = True
             return result
@@ -116,52 +131,12 @@ class Eval:
             self.assign(node.lhs, values)
             return values
         elif isinstance(node, ast.BinOp):
-            op = node.op
+            # The typechecker has chosen the operation for the operand types
             lhs = self.evaluate(node.lhs)[0]
             rhs = self.evaluate(node.rhs)[0]
-            if op == "+":
-                res = lhs + rhs
-            elif op == "-":
-                res = lhs - rhs
-            elif op == "*":
-                res = lhs * rhs
-            elif op == "/":
-                if isinstance(lhs, int):
-                    res = lhs // rhs
-                else:
-                    res = lhs / rhs
-            elif op == "%":
-                res = lhs % rhs
-            elif op == "^":
-                res = lhs ** rhs
-            elif op == "&&":
-                res = lhs and rhs
-            elif op == "||":
-                res = lhs or rhs
-            elif op == "==":
-                res = lhs == rhs
-            elif op == "!=":
-                res = lhs != rhs
-            elif op == "<":
-                res = lhs < rhs
-            elif op == ">":
-                res = lhs > rhs
-            elif op == "<=":
-                res = lhs <= rhs
-            elif op == ">=":
-                res = lhs >= rhs
-            else:
-                raise Exception("unrecognised operator: " + str(node.op))
-            return ValueList([res])
+            return ValueList([BINARY_OPERATIONS[node.operation][0](lhs, rhs)])
         elif isinstance(node, ast.UnaryOp):
-            op = node.op
-            if op == "!":
-                val = not self.evaluate(node.rhs)[0]
-            elif op == "-":
-                val = -self.evaluate(node.rhs)[0]
-            else:
-                raise Exception("unrecognised unary operator: " + str(node.op))
-            return ValueList([val])
+            return ValueList([UNARY_OPERATIONS[node.operation][0](self.evaluate(node.rhs)[0])])
         elif isinstance(node, ast.Integer):
             return ValueList([node.value])
         elif isinstance(node, ast.Float):
@@ -173,74 +148,29 @@ class Eval:
         elif isinstance(node, ast.SysCall):
             return self.callprogram(node)
         elif isinstance(node, ast.Pipeline):
-            if len(node.elements) < 2:
-                raise Exception("Pipelines should have more than one element. This seems to be a parser bug.")
-            syscalls = []
             # First pipeline element: First syscall or stdin
             if isinstance(node.elements[0], ast.SysCall):
-                syscalls.append(node.elements[0])
                 stdin = None
             else:
                 stdin = self.evaluate(node.elements[0])
-            # Other pipeline elements until last: syscalls
-            for sc in node.elements[1:-1]:
-                assert(isinstance(sc, ast.SysCall))
-                syscalls.append(sc)
-            # Last pipeline element: Last syscall or stdout (+stderr)
-            if isinstance(node.elements[-1], ast.SysCall):
-                syscalls.append(node.elements[-1])
-                assignto = None
-            else:
-                assignto = node.elements[-1]
-            # Special case: piping an ordinary expression into a variable
-            if len(syscalls) == 0:
-                raise Exception("The special case, assigning regular values"
-                        " via pipelines, is not supported currently.")
-                """
-                if assignto == None:
-                    raise Exception("Assertion error: Whenever a pipeline has no syscalls, it should consist of an expression that is assigned to something. No assignment was found here.")
-                self.assign(assignto, stdin)
-                return stdin
-                """
-            processes = []
-            for syscall in syscalls[:-1]:
-                process = self.callprogram(syscall, stdin, True)
-                processes.append(process)
-                stdin = process.stdout
-            numOutputPipes = 0 if assignto==None else self.numInputsExpected(assignto)
-            lastProcess = self.callprogram(syscalls[-1], stdin, numOutputPipes)
-            # So, there is this single case that is different from everything else
-            # and that needs special treatment:
-            # Whenever the first process is opened with stdin=PIPE, we must
-            # close its stdin except when this is the only process, then we
-            # must not close the stdin, because then communicate() will fail.
-            if not isinstance(node.elements[0], ast.SysCall) and len(processes):
-                processes[0].stdin.close()
-            outstreams = lastProcess.communicate()
-            for process in processes:
-                process.wait()
+            syscalls, numOutputPipes = pipeline_syscalls(node)
+            results, returncode = self.run_pipeline(syscalls, stdin, numOutputPipes)
             # Assign stdout,stderr to variables
-            #results = ValueList(outstreams[:numOutputPipes])
-            results = ValueList([])
-            for o in outstreams[:numOutputPipes]:
-                results.append(o.decode('utf-8'))
+            assignto = node.elements[-1]
             if isinstance(assignto, ast.PipelineLet): # copied from ast.Let
                 if len(assignto.names) != len(results):
                     raise Exception("number of expressions between rhs and lhs do not match")
-                self.symbol_tree.restore_snapshot(assignto.symbol_tree_snapshot)
-                for name, result in zip(assignto.names, results):
-                    index = self.symbol_tree.get_index(name)
-                    self.locals[index] = result
+                for slot, result in zip(assignto.slots, results):
+                    self.locals[slot] = result
             elif isinstance(assignto, ast.ExpressionList):
                 self.assign(assignto, results)
-            elif isinstance(assignto, ast.BaseNode):
-                self.assign(ast.ExpressionList(assignto.tokens, [assignto]), results)
+            elif not isinstance(assignto, ast.SysCall):
+                self.assign(ast.ExpressionList([], [assignto]), results)
             # Return exitcode of subprocess
-            return ValueList([lastProcess.returncode])
+            return ValueList([returncode])
         elif isinstance(node, ast.Identifier):
-            if node.name in self.symbol_tree:
-                index = self.symbol_tree.get_index(node.name)
-                return ValueList([self.locals[index]])
+            if node.slot != None:
+                return ValueList([self.locals[node.slot]])
             elif node.name in self.current_unit.unit.symbols_global:
                 pass
                 # TODO Add global environment
@@ -248,24 +178,21 @@ class Eval:
         elif isinstance(node, ast.IndexAccess):
             index = self.evaluate(node.rhs)[0]
             lhs = self.evaluate(node.lhs)[0]
+            if node.escapes:
+                escape(lhs)
             return ValueList([lhs[index]])
+        elif isinstance(node, ast.SliceAccess):
+            low = self.evaluate(node.low)[0] if node.low != None else None
+            high = self.evaluate(node.high)[0] if node.high != None else None
+            lhs = self.evaluate(node.lhs)[0]
+            return ValueList([slice_value(lhs, low, high)])
         elif isinstance(node, ast.DotAccess):
             # The following is only used for StructValue, modules are only used
             # for module- and function-access which is handled in FunctionCall below.
-            val = self.evaluate(node.lhs)[0][node.rhs]
+            val = self.evaluate(node.lhs)[0][node.field]
             return ValueList([val])
         elif isinstance(node, ast.FunctionCall):
-            # node.name should either be an ast.Identifier, then we call a function
-            # in the current module/unit, or an ast.DotAccess, then we call a function
-            # in the specified module/unit.
-            if isinstance(node.name, ast.Identifier):
-                unit = self.current_unit.unit
-                funcname = node.name.name
-            elif isinstance(node.name, ast.DotAccess):
-                unit = self.get_module(node.name.lhs)
-                funcname = node.name.rhs
-            else:
-                raise Exception("Identifier or DotAccess for function name expected.")
+            unit, funcname = self.get_function(node)
             # Change (PUSH) the current unit. We also do this if we call a function
             # in the current unit/module because then we do not have to decide
             # afterwards if we have to pop the translation unit back, we just do it.
@@ -277,32 +204,45 @@ class Eval:
                 args = []
                 for a in node.args:
                     args.append(self.evaluate(a)[0])
-                # Call by value!
-                args = copy.deepcopy(args)
                 # Call function, either builtin or defined
                 if isinstance(unit.symbols_global[funcname], bongtypes.Function):
                     # Bong function
                     function = unit.function_definitions[funcname]
-                    symbol_tree_snapshot = self.symbol_tree.take_snapshot()
-                    self.symbol_tree.restore_snapshot(function.symbol_tree_snapshot)
+                    cache = self.memo.cache(function)
+                    if cache != None:
+                        key = tuple(args)
+                        cached = cache.get(key)
+                        if cached != None:
+                            return ValueList(cached)
                     local_env_snapshot = self.locals
-                    self.locals = StackList()
                     try:
-                        # Add arguments to new local environment, then eval func
-                        for name, arg in zip(function.parameter_names, args):
-                            index = self.symbol_tree.get_index(name)
-                            self.locals[index] = arg
-                        result = self.evaluate(function.body)
+                        while True:
+                            self.locals = [None] * function.frame_size
+                            # Add arguments to new frame, then eval func.
+                            # Call by value! Arrays and structs are copied on
+                            # write, arguments of read-only parameters not at
+                            # all.
+                            for slot, arg, readonly in zip(function.parameter_slots, args, function.readonly_parameters):
+                                self.locals[slot] = arg if readonly else copy_value(arg)
+                            result = self.evaluate(function.body)
+                            if not isinstance(result, TailCall):
+                                break
+                            # Tail call: Call the returned function in place
+                            # of this one, in its unit
+                            function, args = result.function, result.arguments
+                            self.current_unit = TranslationUnitRef(result.unit, self.current_unit.parent)
                     finally:
-                        self.symbol_tree.restore_snapshot(symbol_tree_snapshot)
                         self.locals = local_env_snapshot
+                    if cache != None:
+                        cache.put(key, result.elements)
                     if result.returned():
                         result.unwind_return = False
                         return result
                     return result
                 else:
                     # Builtin function
-                    return bong_builtins.functions[funcname][0](args)
+                    builtin, check, copies = bong_builtins.functions[funcname]
+                    return builtin(copy_values(args) if copies else args)
             finally:
                 # Change back (POP) the current unit
                 self.current_unit = self.current_unit.parent
@@ -317,22 +257,29 @@ class Eval:
             # left side.
             if len(node.names) != len(results):
                 raise Exception("number of expressions between rhs and lhs do not match")
-            self.symbol_tree.restore_snapshot(node.symbol_tree_snapshot)
-            for name, result in zip(node.names, results):
-                index = self.symbol_tree.get_index(name)
-                self.locals[index] = result
+            for slot, result in zip(node.slots, results):
+                self.locals[slot] = result
         elif isinstance(node, ast.Array):
             elements = []
             for e in node.elements:
                 elements.append(self.evaluate(e)[0])
-            return ValueList([elements])
+            if node.escapes:
+                return ValueList([escape(ArrayValue(elements))])
+            return ValueList([ArrayValue(elements)])
+        elif isinstance(node, ast.Map):
+            items = []
+            for key_node, value_node in zip(node.keys, node.values):
+                items.append((self.evaluate(key_node)[0], self.evaluate(value_node)[0]))
+            if node.escapes:
+                return ValueList([escape(MapValue(items))])
+            return ValueList([MapValue(items)])
         elif isinstance(node, ast.StructValue):
-            assert(isinstance(node.name, ast.Identifier)
-                    or isinstance(node.name, ast.DotAccess))
-            structval = StructValue(node.name)
+            # Fields are evaluated in the given order but stored in the
+            # order of the struct type
+            fields : typing.List[typing.Any] = [None] * len(node.field_names)
             for name, expr in node.fields.items():
-                structval[name] = self.evaluate(expr)[0]
-            return ValueList([structval])
+                fields[node.field_names.index(name)] = self.evaluate(expr)[0]
+            return ValueList([struct_value_class(node)(fields)])
         elif isinstance(node, ast.ExpressionList):
             results = ValueList([])
             for exp in node.elements:
@@ -353,26 +300,47 @@ class Eval:
             # lhs evaluation: The lhs can be a variable assignment, an
             # index access, a DotAccess
             if isinstance(l, ast.Identifier):
-                name = l.name
-                stack_index = self.symbol_tree.get_index(name)
-                self.locals[stack_index] = value
+                # Only local variables can be assigned, so there is a slot
+                self.locals[l.slot] = value # type: ignore
             elif isinstance(l, ast.IndexAccess):
                 index_access_index = self.evaluate(l.rhs)[0]
                 array = self.evaluate(l.lhs)[0]
+                if l.escapes:
+                    escape(array)
                 array[index_access_index] = value
             elif isinstance(l, ast.DotAccess):
                 struct = self.evaluate(l.lhs)[0]
-                struct[l.rhs] = value
+                struct[l.field] = value
             else:
                 raise Exception("Can only assign to variable or indexed variable")
 
-    def numInputsExpected(self, assignto):
-        if isinstance(assignto, ast.PipelineLet):
-            return len(assignto.names)
-        elif isinstance(assignto, ast.ExpressionList):
-            return len(assignto.elements)
-        else: # Currently only used in pipelines, it's a single variable then
-            return 1
+    # Run the program calls of a pipeline. The stdin is None if the pipeline
+    # starts with a program call, the already evaluated first element
+    # otherwise. Returns the numOutputPipes outputs of the last program call
+    # and its exit code.
+    def run_pipeline(self, syscalls : typing.List[ast.SysCall], stdin : typing.Any, numOutputPipes : int) -> typing.Tuple[ValueList, int]:
+        piped_input = stdin != None
+        processes = []
+        for syscall in syscalls[:-1]:
+            process = self.callprogram(syscall, stdin, True)
+            processes.append(process)
+            stdin = process.stdout
+        lastProcess = self.callprogram(syscalls[-1], stdin, numOutputPipes)
+        # So, there is this single case that is different from everything else
+        # and that needs special treatment:
+        # Whenever the first process is opened with stdin=PIPE, we must
+        # close its stdin except when this is the only process, then we
+        # must not close the stdin, because then communicate() will fail.
+        if piped_input and len(processes):
+            processes[0].stdin.close()
+        outstreams = lastProcess.communicate()
+        for process in processes:
+            process.wait()
+        #results = ValueList(outstreams[:numOutputPipes])
+        results = ValueList([])
+        for o in outstreams[:numOutputPipes]:
+            results.append(o.decode('utf-8'))
+        return results, lastProcess.returncode
 
     def callprogram(self, program, stdin=None, numOutputPipes=0):
         # TODO We pass a whole ast.SysCall object to callprogram, only the args
@@ -489,23 +457,78 @@ class Eval:
 
     # Takes an Identifier or DotAccess which should describe a module
     # and returns the corresponding ast.TranslationUnit. The search
-    # is started at self.current_unit's symbol table. For each resolution
-    # step, another (the next) symbol table is used.
+    # is started at self.current_unit's symbol table.
     def get_module(self, name : ast.BaseNode) -> ast.TranslationUnit: # name should be Identifier (returns current_unit) or DotAccess (returns resolved DotAccess.lhs)
-        # DotAccesses are forwarded until an Identifier is found. The
-        # Identifier uses the current_unit's symbol table to resolve
-        # the module. The DotAccesses use the returned units to resolve
-        # further modules afterwards.
-        if isinstance(name, ast.Identifier):
-            module = self.current_unit.unit.symbols_global[name.name]
-        elif isinstance(name, ast.DotAccess):
-            unit = self.get_module(name.lhs)
-            module = unit.symbols_global[name.rhs]
-        else:
-            raise Exception("Identifier or DotAccess expected.")
-        if not isinstance(module, bongtypes.Module):
-            raise Exception("Module expected.")
-        return self.modules[module.path]
+        return resolve_module(self.modules, self.current_unit.unit, name)
+
+    # Find the unit and the name of the function which is called by a
+    # FunctionCall. node.name should either be an ast.Identifier, then we call
+    # a function in the current module/unit, or an ast.DotAccess, then we call
+    # a function in the specified module/unit.
+    def get_function(self, node : ast.FunctionCall) -> typing.Tuple[ast.TranslationUnit, str]:
+        if isinstance(node.name, ast.Identifier):
+            return self.current_unit.unit, node.name.name
+        elif isinstance(node.name, ast.DotAccess):
+            return self.get_module(node.name.lhs), node.name.rhs
+        raise Exception("Identifier or DotAccess for function name expected.")
+
+# The bongvalues.StructValue class for the struct type of a struct value
+def struct_value_class(node : ast.StructValue) -> typing.Type[StructValue]:
+    if isinstance(node.name, ast.Identifier):
+        name = node.name.name
+    elif isinstance(node.name, ast.DotAccess):
+        name = node.name.rhs
+    else:
+        raise Exception("Identifier or DotAccess for struct name expected.")
+    return struct_class(name, node.field_names)
+
+# Resolve the module described by an Identifier or DotAccess, starting at the
+# symbol table of the given unit. For each resolution step, another (the
+# next) symbol table is used.
+def resolve_module(modules : typing.Dict[str, ast.TranslationUnit], unit : ast.TranslationUnit, name : ast.BaseNode) -> ast.TranslationUnit:
+    # DotAccesses are forwarded until an Identifier is found. The
+    # Identifier uses the unit's symbol table to resolve the module. The
+    # DotAccesses use the returned units to resolve further modules
+    # afterwards.
+    if isinstance(name, ast.Identifier):
+        module = unit.symbols_global[name.name]
+    elif isinstance(name, ast.DotAccess):
+        module = resolve_module(modules, unit, name.lhs).symbols_global[name.rhs]
+    else:
+        raise Exception("Identifier or DotAccess expected.")
+    if not isinstance(module, bongtypes.Module):
+        raise Exception("Module expected.")
+    return modules[module.path]
+
+# Collect the program calls of a pipeline and determine how many outputs
+# (stdout, stderr) are written to the last element.
+def pipeline_syscalls(node : ast.Pipeline) -> typing.Tuple[typing.List[ast.SysCall], int]:
+    if len(node.elements) < 2:
+        raise Exception("Pipelines should have more than one element. This seems to be a parser bug.")
+    syscalls = []
+    # First pipeline element: First syscall or stdin
+    if isinstance(node.elements[0], ast.SysCall):
+        syscalls.append(node.elements[0])
+    # Other pipeline elements until last: syscalls
+    for sc in node.elements[1:-1]:
+        assert(isinstance(sc, ast.SysCall))
+        syscalls.append(sc)
+    # Last pipeline element: Last syscall or stdout (+stderr)
+    assignto = node.elements[-1]
+    if isinstance(assignto, ast.SysCall):
+        syscalls.append(assignto)
+        numOutputPipes = 0
+    elif isinstance(assignto, ast.PipelineLet):
+        numOutputPipes = len(assignto.names)
+    elif isinstance(assignto, ast.ExpressionList):
+        numOutputPipes = len(assignto.elements)
+    else: # a single variable
+        numOutputPipes = 1
+    # Special case: piping an ordinary expression into a variable
+    if len(syscalls) == 0:
+        raise Exception("The special case, assigning regular values"
+                " via pipelines, is not supported currently.")
+    return syscalls, numOutputPipes
 
 def isTruthy(value):
     if value[0] == True:
@@ -517,13 +540,6 @@ def ensureValueList(value):
         return ValueList([value])
     return value
 
-# https://stackoverflow.com/a/4544699
-class StackList(list):
-    def __setitem__(self, index, value):
-        if index >= len(self):
-            self.extend(["UninitializedStackValue"]*(index + 1 - len(self)))
-        list.__setitem__(self, index, value)
-
 class TranslationUnitRef:
     def __init__(self, unit : ast.TranslationUnit, parent : typing.Optional[TranslationUnitRef] = None):
         self.unit = unit
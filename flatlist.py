@@ -1,4 +1,8 @@
+# FlatList has no slots itself (subclasses have to provide the elements
+# attribute) so that slotted classes like ast.ExpressionList can derive from
+# FlatList and another slotted class at the same time.
 class FlatList:
+	__slots__ = ()
 	def __init__(self, elements):
 		self.elements = elements
 	# Flattened append (no FlatList inside a FlatList)
@@ -13,14 +17,8 @@ class FlatList:
 		return len(self.elements)
 	def __getitem__(self, index):
 		return self.elements[index]
-	# The next two methods make this class iterable
+	# Make this class iterable
 	def __iter__(self):
-		self.iterationCounter = -1
-		return self
-	def __next__(self):
-		self.iterationCounter += 1
-		if self.iterationCounter < len(self.elements):
-			return self.elements[self.iterationCounter]
-		raise StopIteration
+		return iter(self.elements)
 	def __str__(self):
 		return "FlatList [" + ", ".join(map(str,self.elements)) + "]"
@@ -1,33 +1,427 @@
 import token_def as token
 from token_def import Token
 import eof_exception
+from line_index import LineIndex
+import re
+import io
+import os
+import mmap
+import collections
+import codecs
+import typing
 
+# The scanner tries all alternatives at the current position, the name of the
+# group that matched (Match.lastgroup) tells get_token() what was found.
+# The order matters: comments before '/', two-character operators before
+# one-character operators, strings without escape sequences before all other
+# strings and everything else becomes a single OTHER character.
+SCANNER = re.compile(r"""
+    (?P<whitespace>[ \t\r\n]+)
+  | (?P<identifier>[a-zA-Z][a-zA-Z_]*)
+  | (?P<line_comment>//[^\r\n]*[\r\n]*)
+  | (?P<block_comment>/\*)
+  | (?P<operator>==|!=|<=|>=|&&|\|\||[;,.:+\-*/%^(){}\[\]=!<>&|])
+  | (?P<number>[0-9]+(?:\.[0-9]+)?)
+  | (?P<string>"[^"\\]*")
+  | (?P<escaped_string>")
+  | (?P<other>.)
+""", re.VERBOSE | re.DOTALL)
+NEWLINE = re.compile("[\r\n]")
+# Characters with a special meaning in shell words (syscall arguments),
+# everything in between is taken over literally.
+SHELL_SPECIAL = re.compile(r"""[ \t\r\n|&;{}()=/"']""")
+# Characters that end the arguments of a syscall. '=' only does so as part
+# of '==' and '(' is not special at all, see shell_words().
+SHELL_END = {"\r", "\n", "|", "&", ";", "{", "}", ")"}
+COMMENT_DELIMITER = re.compile(r"/\*|\*/")
+STRING_DELIMITER = re.compile(r'["\\]')
+
+OPERATORS = {
+    ";": token.SEMICOLON, ",": token.COMMA, ".": token.DOT, ":": token.COLON,
+    "+": token.OP_ADD, "-": token.OP_SUB, "*": token.OP_MULT, "/": token.OP_DIV,
+    "%": token.OP_MOD, "^": token.OP_POW,
+    "(": token.LPAREN, ")": token.RPAREN, "{": token.LBRACE, "}": token.RBRACE,
+    "[": token.LBRACKET, "]": token.RBRACKET,
+    "=": token.ASSIGN, "==": token.OP_EQ, "!": token.OP_NEG, "!=": token.OP_NEQ,
+    "<": token.OP_LT, "<=": token.OP_LE, ">": token.OP_GT, ">=": token.OP_GE,
+    "&": token.AMPERSAND, "&&": token.OP_AND, "|": token.BONG, "||": token.OP_OR,
+}
+
+KEYWORDS = {
+    "print": token.PRINT,
+    "true": token.BOOL_VALUE,
+    "false": token.BOOL_VALUE,
+    "let": token.LET,
+    "if": token.IF,
+    "else": token.ELSE,
+    "while": token.WHILE,
+    "func": token.FUNC,
+    "return": token.RETURN,
+    "import": token.IMPORT,
+    "as": token.AS,
+    "struct": token.STRUCT,
+}
+
+# Streams are read in chunks of this size. Consumed chunks are dropped.
+CHUNK_SIZE = 64*1024
+# Number of characters that have to be available behind a match so that it
+# can not be extended by the next chunk ('1' '.5')
+SCAN_LOOKAHEAD = 2
+# When dropping consumed chunks, the text of this many recently generated
+# tokens is kept. The parser rewinds the lexer to the end of the token it has
+# just consumed when switching to shell words, so this must exceed the
+# parser's look ahead.
+RETAINED_TOKENS = 8
+
+# A newline after one of these tokens is an implicit semicolon
+IMPLICIT_SEMICOLON = {
+    token.IDENTIFIER, token.INT_VALUE, token.BOOL_VALUE,
+    token.RPAREN, token.RBRACKET, token.STRING, token.RETURN,
+    token.SHELL_WORDS
+}
+
+# The lexer accepts the code as a string or as a text stream (anything with
+# a read(size) method like open files, sys.stdin or MappedFile). Streams are
+# read lazily chunk by chunk while tokens are requested, and the part of the
+# code that is already tokenized is dropped.
 class Lexer:
     def __init__(self, code, filepath):
+        if isinstance(code, str):
+            self.stream = None
+        else:
+            self.stream = code
+            code = ""
+        # The current chunk(s) of code, self.base is the offset of its
+        # first character in the whole input
         self.code = code
+        self.base = 0
         self.current_pos = 0
         self.last_token = None
         self.had_whitespace = False
+        self.recent_offsets : typing.Deque[int] = collections.deque(maxlen=RETAINED_TOKENS)
         # Fields for reporting (error) positions
-        # For line and col we use an ever-growing list that lets us look
-        # back in time
+        # Tokens only remember their offset, line and column are looked up
+        # in the line index when they are needed.
         self.filepath = filepath
-        self.line = [1]
-        self.col = [1]
+        self.line_index = LineIndex(code, filepath)
+
+    # Generator that tokenizes the input on demand. After the end of the
+    # input, it continues to generate EOF tokens. Errors are not raised but
+    # handed out as ERROR tokens because the parser looks ahead and the
+    # erroneous part could still be scanned differently by shell_words().
+    def tokens(self):
+        while True:
+            try:
+                yield self.get_token()
+            except (TokenizeException, eof_exception.UnexpectedEof) as e:
+                yield Token(token.ERROR, self.filepath, self.line_index,
+                        self.base + self.current_pos, 0, False, e)
+
+    # Reads the next chunk of a stream into self.code. Returns False if
+    # there is nothing left to read.
+    def fill(self):
+        if self.stream == None:
+            return False
+        chunk = self.stream.read(CHUNK_SIZE)
+        if not chunk:
+            self.stream = None
+            return False
+        self.line_index.add_text(chunk, self.base + len(self.code))
+        self.code += chunk
+        return True
 
     def create_token(self, typ, length=1, lexeme=None):
-        # The ever-growing lits in the past is [current, previous, ...]
         # The last character that was part of the token we currently generate
-        # was just "matched-away" or removed with next(). Thus, for length==1,
-        # we do not need index 0 but index 1 instead.
-        line = self.line[length]
-        col = self.col[length]
+        # was just "matched-away" or removed with next(). Thus, the token
+        # starts length characters before the current position.
+        offset = self.base + self.current_pos - length
         # DEBUG: Print what kinds of tokens are generated
-        #print(typ, self.filepath, line, col, length, lexeme)
-        self.last_token = Token(typ, self.filepath, line, col, length, self.had_whitespace, lexeme)
+        #print(typ, self.filepath, self.line_index.position(offset), length, lexeme)
+        self.last_token = Token(typ, self.filepath, self.line_index, offset, length, self.had_whitespace, lexeme)
         self.had_whitespace = False
+        self.recent_offsets.append(offset)
         return self.last_token
 
+    def get_token(self):
+        # Drop everything that has already been tokenized (except for the
+        # recent tokens, see RETAINED_TOKENS)
+        if self.stream != None and self.current_pos > CHUNK_SIZE:
+            keep = self.current_pos
+            if len(self.recent_offsets) > 0:
+                keep = min(keep, self.recent_offsets[0] - self.base)
+            self.code = self.code[keep:]
+            self.base += keep
+            self.current_pos -= keep
+        while True:
+            code = self.code
+            m = SCANNER.match(code, self.current_pos)
+            # The match could continue in the next chunk
+            if (self.stream != None
+                    and (m == None or m.end() + SCAN_LOOKAHEAD > len(code))
+                    and self.fill()):
+                continue
+            if m == None: # EOF
+                # Each EOF token is one character behind the previous one,
+                # just like the character-wise lexer does it.
+                self.current_pos = max(self.current_pos, len(code)) + 1
+                return self.create_token(token.EOF)
+            kind = m.lastgroup
+            start, end = m.span()
+            if kind == "whitespace":
+                # implicit semicolons
+                if self.last_token != None and self.last_token.type in IMPLICIT_SEMICOLON:
+                    newline = NEWLINE.search(code, start, end)
+                    if newline != None:
+                        if newline.start() > start:
+                            self.had_whitespace = True
+                        self.current_pos = newline.end()
+                        return self.create_token(token.SEMICOLON)
+                # squeeze multiple whitespaces together
+                self.had_whitespace = True
+                self.current_pos = end
+                continue
+            self.current_pos = end
+            if kind == "identifier":
+                lex = m.group()
+                return self.create_token(KEYWORDS.get(lex, token.IDENTIFIER), end-start, lex)
+            if kind == "operator":
+                return self.create_token(OPERATORS[m.group()], end-start)
+            if kind == "number":
+                lex = m.group()
+                typ = token.FLOAT_VALUE if "." in lex else token.INT_VALUE
+                return self.create_token(typ, end-start, lex)
+            if kind == "string":
+                return self.create_token(token.STRING, end-start, code[start+1:end-1])
+            if kind == "line_comment":
+                # Newlines after single-line comments are removed as well,
+                # so there is no implicit semicolon
+                continue
+            if kind == "block_comment":
+                self.skip_block_comment()
+                continue
+            if kind == "escaped_string":
+                lex = self.scan_string(start)
+                return self.create_token(token.STRING, self.current_pos-start, lex)
+            return self.create_token(token.OTHER, 1, m.group())
+
+    # Called after '/*', skips everything until the matching '*/'.
+    # Comments can be nested. Unclosed comments end at EOF.
+    def skip_block_comment(self):
+        commentlevel = 1
+        while commentlevel > 0:
+            m = COMMENT_DELIMITER.search(self.code, self.current_pos)
+            if m == None:
+                # The last character could start a delimiter that is
+                # completed by the next chunk
+                self.current_pos = max(self.current_pos, len(self.code)-1)
+                if self.fill():
+                    continue
+                self.current_pos = len(self.code)
+                return
+            self.current_pos = m.end()
+            commentlevel += 1 if m.group() == "/*" else -1
+
+    # Scans a string that contains escape sequences, start is the offset of
+    # the opening quotes. Returns the string's content.
+    def scan_string(self, start):
+        lex = ""
+        self.current_pos = start + 1
+        def nextChar():
+            if self.current_pos >= len(self.code) and not self.fill():
+                raise eof_exception.UnexpectedEof("Unfinished String.")
+            char = self.code[self.current_pos]
+            self.current_pos += 1
+            return char
+        while True:
+            m = STRING_DELIMITER.search(self.code, self.current_pos)
+            if m == None:
+                lex += self.code[self.current_pos:]
+                self.current_pos = len(self.code)
+                if self.fill():
+                    continue
+                raise eof_exception.UnexpectedEof("Unfinished String.")
+            lex += self.code[self.current_pos:m.start()]
+            self.current_pos = m.end()
+            if m.group() == "\"":
+                return lex
+            # begin escape sequence
+            lex += self.escape_sequence(nextChar)
+
+    # Raw scanning mode for the arguments of syscalls. The parser calls this
+    # once it has recognized a syscall, offset is the end of the token that
+    # the syscall's first word begins with. The lexer continues at offset,
+    # splits the source text at whitespace into words (the first word begins
+    # with first_word) and returns them in a single SHELL_WORDS token.
+    # Normal tokenizing continues where the words end, at a newline or at
+    # one of '|', '&', ';', '{', '}', ')' or '=='. Double-quoted strings
+    # (with escape sequences) and single-quoted strings (taken literally)
+    # can contain all of these and whitespace. Words beginning with '//' or
+    # '/*' are comments.
+    def shell_words(self, offset, first_word):
+        self.current_pos = offset - self.base
+        words : typing.List[str] = []
+        word = first_word
+        in_word = True # We are behind the first word's first token
+        end = offset # Offset behind the last word
+        while True:
+            code = self.code
+            m = SHELL_SPECIAL.search(code, self.current_pos)
+            # '=' and '/' need to see the following character as well
+            if (self.stream != None
+                    and (m == None or m.end() + 1 > len(code))
+                    and self.fill()):
+                continue
+            stop = len(code) if m == None else m.start()
+            if stop > self.current_pos:
+                word += code[self.current_pos:stop]
+                in_word = True
+            self.current_pos = stop
+            if m == None: # EOF
+                break
+            c = m.group()
+            if c in SHELL_END or (c == "=" and code.startswith("==", stop)):
+                break
+            if c == " " or c == "\t":
+                if in_word:
+                    words.append(word)
+                    word = ""
+                    in_word = False
+                    end = self.base + stop
+                self.current_pos = stop + 1
+            elif c == "/" and not in_word and code.startswith("//", stop):
+                line_end = NEWLINE.search(code, stop)
+                while line_end == None and self.fill():
+                    code = self.code
+                    line_end = NEWLINE.search(code, stop)
+                self.current_pos = len(code) if line_end == None else line_end.start()
+            elif c == "/" and not in_word and code.startswith("/*", stop):
+                self.current_pos = stop + 2
+                self.skip_block_comment()
+            elif c == "\"":
+                word += self.scan_string(stop)
+                in_word = True
+            elif c == "'":
+                closing = code.find("'", stop + 1)
+                while closing < 0:
+                    if not self.fill():
+                        raise eof_exception.UnexpectedEof("Unfinished String.")
+                    code = self.code
+                    closing = code.find("'", stop + 1)
+                word += code[stop+1:closing]
+                in_word = True
+                self.current_pos = closing + 1
+            else: # a literal '=', '/' or '('
+                word += c
+                in_word = True
+                self.current_pos = stop + 1
+        if in_word:
+            words.append(word)
+            end = self.base + self.current_pos
+        self.had_whitespace = self.base + self.current_pos > end
+        self.last_token = Token(token.SHELL_WORDS, self.filepath,
+                self.line_index, offset, end - offset, False, words)
+        return self.last_token
+
+    # Translates the escape sequence after a backslash. Characters are read
+    # with next_char() which has to raise UnexpectedEof at the end of input.
+    # Unknown escape sequences are dropped.
+    def escape_sequence(self, next_char):
+        char = next_char()
+        if char == "\\":
+            return "\\"
+        elif char == "\"":
+            return "\""
+        elif char == "0":
+            return chr(0)
+        elif char == "n":
+            return "\n"
+        elif char == "r":
+            return "\r"
+        elif char == "t":
+            return "\t"
+        elif char == "x":
+            high = next_char()
+            low = next_char()
+            try:
+                val = int(high+low, 16)
+            except ValueError as e:
+                self.raise_token_exception("Escape sequence \\x"
+                        " requires exactly two digits between"
+                        f" 0 and F/f, '{high+low}' found instead.", 4)
+            if val < 0 or val > 127:
+                self.raise_token_exception("Escape sequence \\x"
+                        " must evaluate to a value between 0 and"
+                        f" 127, {val} was calculated instead.", 4)
+            return chr(val)
+        elif char == "u":
+            char = next_char()
+            if char != "{":
+                self.raise_token_exception("Escape sequence"
+                        " \\u{...} expects an opening brace,"
+                        f" '{char}' found instead", 3)
+            unic = ""
+            char = next_char()
+            while char != "}":
+                unic += char
+                if len(unic) > 6:
+                    self.raise_token_exception("Escape sequence"
+                            " \\u{...} expects at most 6 digits.",
+                            10) # len = \u{ + 7
+                char = next_char()
+            try:
+                val = int(unic, 16)
+            except ValueError as e:
+                self.raise_token_exception("Escape sequence \\u{...}"
+                        " requires only digits between"
+                        f" 0 and F/f, '{unic}' found instead.", 4+len(unic))
+            if val < 0 or val > 0x10FFFF:
+                self.raise_token_exception("Escape sequence \\u{...}"
+                        " must evaluate to a value between 0 and"
+                        f" 0x10FFFF, {hex(val)} was calculated instead.", 4+len(unic))
+            return chr(val)
+        return ""
+
+    def raise_token_exception(self, msg, length):
+        line, col = self.line_index.position(self.base + self.current_pos - length)
+        raise TokenizeException(msg, self.filepath, line, col, length)
+
+# Text stream over a memory-mapped utf-8 file. Like files opened in text mode,
+# it translates '\r\n' and '\r' to '\n'.
+class MappedFile:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size > 0:
+                self.map : typing.Union[mmap.mmap, bytes] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else: # Empty files can not be mapped
+                self.map = b""
+        self.pos = 0
+        self.decoder = io.IncrementalNewlineDecoder(
+                codecs.getincrementaldecoder("utf-8")(), translate=True)
+
+    def read(self, size):
+        text = ""
+        # Decoding can return nothing if the data ends within a multi-byte
+        # character, so read until we actually got something.
+        while text == "":
+            data = self.map[self.pos:self.pos+size]
+            self.pos += len(data)
+            text = self.decoder.decode(data, final=len(data)==0)
+            if len(data) == 0:
+                break
+        return text
+
+    def close(self):
+        if isinstance(self.map, mmap.mmap):
+            self.map.close()
+
+    def __enter__(self):
+        return self
+    def __exit__(self, *args):
+        self.close()
+
+# The original character-by-character lexer. It is slow but straightforward,
+# so it is kept as the reference implementation that Lexer is tested against.
+class CharLexer(Lexer):
     def get_token(self):
         c = self.next()
         while c!="" and is_whitespace(c):
@@ -230,14 +624,6 @@ class Lexer:
     def next(self):
         c = self.peek()
         self.current_pos += 1
-        if is_newline(c):
-            newline = self.line[0]+1
-            newcol = 1
-        else:
-            newline = self.line[0]
-            newcol = self.col[0]+1
-        self.line = [newline] + self.line
-        self.col = [newcol] + self.col
         return c
 
     def match(self, compare):
@@ -247,11 +633,6 @@ class Lexer:
             return True
         return False
 
-    def raise_token_exception(self, msg, length):
-        line = self.line[length]
-        col = self.col[length]
-        raise TokenizeException(msg, self.filepath, line, col, length)
-
 def is_number(arg):
     return arg >= "0" and arg <= "9"
 
@@ -0,0 +1,33 @@
+import bisect
+import re
+import typing
+
+# Both '\r' and '\n' start a new line on their own, so '\r\n' counts as two
+# line breaks. This is what the lexer has always done, so we keep it.
+NEWLINE = re.compile("[\r\n]")
+
+# Index of all line-start offsets of one source file. Instead of tracking
+# line and column for every character that the lexer consumes, tokens only
+# remember their offset into the source. Line and column are calculated from
+# that offset whenever somebody actually asks for them (error messages,
+# locations of ast nodes). There is one LineIndex per source file, so it also
+# identifies the file.
+class LineIndex:
+    def __init__(self, code : str = "", filepath : str = ""):
+        self.filepath = filepath
+        # starts[i] is the offset of the first character in line i+1
+        self.starts : typing.List[int] = [0]
+        self.add_text(code, 0)
+
+    # Register all line starts contained in text, text itself has to start at
+    # the given offset of the source file. Text has to be added in order.
+    def add_text(self, text : str, offset : int):
+        for m in NEWLINE.finditer(text):
+            self.starts.append(offset + m.end())
+
+    # Returns the (1-based) line and column of the given offset
+    def position(self, offset : int) -> typing.Tuple[int, int]:
+        if offset < 0:
+            offset = 0
+        line = bisect.bisect_right(self.starts, offset)
+        return line, offset - self.starts[line-1] + 1
@@ -5,24 +5,95 @@ import lexer
 import parser
 import typechecker
 import evaluator
+import closure_eval
+import vm
+import translator
+import bytecode
+import module_cache
+import memo
 import repl
 
+# Execution engines, selected with --engine=<name>
+ENGINES = {
+        "tree": evaluator.Eval,
+        "closure": closure_eval.ClosureEval,
+        "vm": vm.VM,
+        "python": translator.CompiledEval,
+        }
+
 def main():
-    arguments = sys.argv
+    arguments = sys.argv[:1]
+    engine = ENGINES["tree"]
+    disassemble = False
+    memo_capacity = memo.DEFAULT_CAPACITY
+    memo_stats = False
+    # Options precede the script
+    options = sys.argv[1:]
+    while len(options) > 0 and options[0].startswith("--"):
+        option = options.pop(0)
+        name = option[len("--engine="):]
+        if option.startswith("--engine=") and name in ENGINES:
+            engine = ENGINES[name]
+        elif option == "--compile":
+            # Shorthand for translating to (cached) python code
+            engine = ENGINES["python"]
+        elif option == "--disassemble":
+            disassemble = True
+        elif option.startswith("--memo-capacity=") and option[len("--memo-capacity="):].isdigit():
+            # Cached calls per memoized function, 0 disables memoization
+            memo_capacity = int(option[len("--memo-capacity="):])
+        elif option == "--memo-stats":
+            memo_stats = True
+        else:
+            print(f"Unknown option '{option}', available: --engine={{{','.join(ENGINES)}}}, --compile, --disassemble, --memo-capacity=<n>, --memo-stats")
+            return
+    arguments.extend(options)
     if len(arguments) == 1:
-        return repl.main()
+        return repl.main(engine, memo_capacity)
     if len(arguments) >= 2:
-        with open(arguments[1]) as f:
-            code = f.read()
-            l = lexer.Lexer(code, arguments[1])
+        # The script is tokenized lazily while it is parsed, '-' reads the
+        # script from stdin
+        if arguments[1] == "-":
+            l = lexer.Lexer(sys.stdin, "stdin")
             p = parser.Parser(l)
             ast = p.compile()
             if not ast:
                 return
             program = typechecker.TypeChecker().checkprogram(ast)
-            if not program:
-                return
-            evaluator.Eval().evaluate(program)
+        else:
+            # Scripts that did not change since the last run are loaded
+            # from the module cache, parsed and typechecked already
+            path = arguments[1]
+            program = module_cache.load_program(path)
+            if program == None:
+                ast = module_cache.parse_module(path)
+                if not ast:
+                    return
+                program = typechecker.TypeChecker().checkprogram(ast)
+                if program:
+                    module_cache.store_program(path, program)
+        if not program:
+            return
+        if disassemble:
+            # Print the bytecode instead of running the program
+            machine = vm.VM()
+            machine.modules.update(program.modules)
+            print(bytecode.disassemble(machine.compile(program.main_unit)))
+            return
+        if engine == translator.CompiledEval:
+            # The translation of a script is cached next to it
+            machine = translator.CompiledEval(path=arguments[1] if arguments[1] != "-" else None)
+        else:
+            machine = engine()
+        machine.memo.capacity = memo_capacity
+        try:
+            machine.evaluate(program)
+        except (translator.BongRuntimeError, evaluator.RecursionDepthError) as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
+        finally:
+            if memo_stats:
+                print(machine.memo, file=sys.stderr)
     else:
         print("Too many arguments\nrun without arguments to start the REPL or run with one file as argument to evaluate")
 
@@ -0,0 +1,72 @@
+from __future__ import annotations
+import ast
+from bongvalues import copy_values
+import collections
+import typing
+
+# Memoization of pure bong functions. The typechecker infers which functions
+# are pure (no print, no program calls or pipelines, no writes to their
+# parameters, only calls of pure functions) and marks the pure functions that
+# call themselves (directly or via other functions) in a non-tail position
+# for memoization, see FunctionDefinition.memoize. The engines look up the
+# results of calls of these functions in a bounded LRU cache per function.
+#
+# Calls are keyed by the tuple of their arguments. Calls with unhashable
+# arguments (arrays, structs) are neither looked up nor cached. Results are
+# passed by value: The cache stores copies and hands out copies (cheap, see
+# bongvalues.ArrayValue).
+
+# Default number of cached calls per function, 0 disables memoization
+DEFAULT_CAPACITY = 1024
+
+class MemoCache:
+    def __init__(self, name : str, capacity : int):
+        self.name = name
+        self.capacity = capacity
+        self.entries : typing.OrderedDict[typing.Tuple[typing.Any, ...], typing.List[typing.Any]] = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    # Copies of the values returned for the arguments, None if not cached
+    def get(self, key : typing.Tuple[typing.Any, ...]) -> typing.Optional[typing.List[typing.Any]]:
+        try:
+            values = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        except TypeError:
+            # Unhashable arguments
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return copy_values(values)
+
+    def put(self, key : typing.Tuple[typing.Any, ...], values : typing.Iterable[typing.Any]):
+        try:
+            self.entries[key] = copy_values(list(values))
+        except TypeError:
+            return
+        if len(self.entries) > self.capacity:
+            # Evict the least recently used call
+            self.entries.popitem(last=False)
+
+    def __str__(self):
+        return f"{self.name}: {self.hits} hits, {self.misses} misses, {len(self.entries)}/{self.capacity} cached"
+
+# The caches of one engine
+class Memo:
+    def __init__(self, capacity : int = DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.caches : typing.Dict[ast.FunctionDefinition, MemoCache] = {}
+
+    # The cache for calls of the function, None if the function is not
+    # memoized
+    def cache(self, definition : ast.FunctionDefinition) -> typing.Optional[MemoCache]:
+        if not definition.memoize or self.capacity <= 0:
+            return None
+        if definition not in self.caches:
+            self.caches[definition] = MemoCache(definition.name, self.capacity)
+        return self.caches[definition]
+
+    def __str__(self):
+        return "\n".join(str(cache) for cache in self.caches.values())
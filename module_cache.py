@@ -0,0 +1,177 @@
+import ast
+import lexer
+import parser
+import os
+import sys
+import glob
+import pickle
+import hashlib
+import zlib
+import gc
+import contextlib
+import typing
+
+# Parsed modules and typechecked programs are cached on disk, similar to
+# python's __pycache__. The cache files live in a __bongcache__ directory
+# next to the source file:
+# - foo.bon.unit holds the ast.TranslationUnit right after parsing foo.bon
+#   (before the typechecker has added anything to it).
+# - foo.bon.program holds the typechecked ast.Program with foo.bon as the main
+#   unit, it is valid as long as foo.bon and all of its transitive imports are
+#   unchanged.
+# Each cache file contains a small pickled header which tells if the entry is
+# still valid, followed by the zlib-compressed pickle of the actual data which
+# is only unpickled then.
+# Caching is best effort, failing to read or write the cache is ignored.
+CACHE_DIR = "__bongcache__"
+
+# Setting this environment variable (to anything) disables the cache
+DISABLE_VARIABLE = "BONG_NO_CACHE"
+
+# Pickles refer to the classes of the interpreter, so cache entries are only
+# valid for exactly the same python and bong implementation. The latter is
+# identified by a hash over the interpreter's sources. Computed on first use.
+_version : typing.Optional[str] = None
+
+def interpreter_version() -> str:
+    global _version
+    if _version == None:
+        digest = hashlib.sha256()
+        directory = os.path.dirname(os.path.abspath(__file__))
+        for path in sorted(glob.glob(os.path.join(directory, "*.py"))):
+            name = os.path.basename(path)
+            if name.startswith("test_") or name.startswith("bench_"):
+                continue
+            with open(path, "rb") as f:
+                digest.update(name.encode())
+                digest.update(f.read())
+        _version = sys.implementation.cache_tag + "-" + digest.hexdigest()
+    return _version
+
+def enabled() -> bool:
+    return DISABLE_VARIABLE not in os.environ
+
+def source_hash(path : str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def cache_path(path : str, kind : str) -> str:
+    directory, name = os.path.split(path)
+    return os.path.join(directory, CACHE_DIR, f"{name}.{kind}")
+
+# The header identifies how the cached data was generated. Besides the
+# interpreter version and the sources, the paths matter because tokens store
+# the filepath for error messages and import paths are resolved relative to
+# the working directory.
+def make_header(path : str, sources : typing.Dict[str, str]) -> typing.Dict[str, typing.Any]:
+    return {
+            "version": interpreter_version(),
+            "path": path,
+            "basepath": os.getcwd(),
+            "sources": sources,
+            }
+
+# Pickling and unpickling create lots of small objects which would trigger
+# the garbage collector again and again, and each run would scan the whole
+# ast. There is no garbage to be found there, so the collector is paused.
+@contextlib.contextmanager
+def paused_gc():
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if collecting:
+            gc.enable()
+
+# Unpickle the compressed data following the header
+def read_data(f : typing.BinaryIO) -> typing.Any:
+    data = zlib.decompress(f.read())
+    with paused_gc():
+        return pickle.loads(data)
+
+def read_entry(path : str, kind : str, header : typing.Dict[str, typing.Any]) -> typing.Any:
+    try:
+        with open(cache_path(path, kind), "rb") as f:
+            if pickle.load(f) != header:
+                return None
+            return read_data(f)
+    except Exception:
+        return None
+
+def write_entry(path : str, kind : str, header : typing.Dict[str, typing.Any], data : typing.Any):
+    target = cache_path(path, kind)
+    try:
+        # Deeply nested asts can exceed the recursion limit of pickle, those
+        # are just not cached.
+        with paused_gc():
+            payload = zlib.compress(pickle.dumps(data, pickle.HIGHEST_PROTOCOL))
+        directory = os.path.dirname(target)
+        os.makedirs(directory, exist_ok=True)
+        # Write to a temporary file first so that concurrent runs never see
+        # half-written entries
+        tmp = f"{target}.{os.getpid()}.tmp"
+        fd = os.open(tmp, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(header, f, pickle.HIGHEST_PROTOCOL)
+                f.write(payload)
+            os.replace(tmp, target)
+        except OSError:
+            os.unlink(tmp)
+            raise
+    except (OSError, RecursionError, pickle.PicklingError):
+        pass
+
+# Parse the module at path. The result is taken from the cache if possible.
+# Raises OSError if the file can not be read, returns None if parsing failed
+# (the parser has reported the error already).
+def parse_module(path : str) -> typing.Optional[ast.TranslationUnit]:
+    if not enabled():
+        return parse_source(path)
+    header = make_header(path, {path: source_hash(path)})
+    unit = read_entry(path, "unit", header)
+    if isinstance(unit, ast.TranslationUnit):
+        return unit
+    unit = parse_source(path)
+    if unit != None:
+        write_entry(path, "unit", header, unit)
+    return unit
+
+def parse_source(path : str) -> typing.Optional[ast.TranslationUnit]:
+    with lexer.MappedFile(path) as f:
+        l = lexer.Lexer(f, path)
+        p = parser.Parser(l)
+        return p.compile()
+
+# Return the cached, typechecked program for the main script at path or
+# None if there is no valid cache entry. All transitive imports are hashed
+# again to detect changes.
+def load_program(path : str) -> typing.Optional[ast.Program]:
+    if not enabled():
+        return None
+    try:
+        with open(cache_path(path, "program"), "rb") as f:
+            header = pickle.load(f)
+            if (not isinstance(header, dict)
+                    or header != make_header(path, header.get("sources", {}))
+                    or path not in header["sources"]):
+                return None
+            for source, digest in header["sources"].items():
+                if source_hash(source) != digest:
+                    return None
+            program = read_data(f)
+    except Exception:
+        return None
+    return program if isinstance(program, ast.Program) else None
+
+def store_program(path : str, program : ast.Program):
+    if not enabled():
+        return
+    try:
+        sources = {path: source_hash(path)}
+        for module in program.modules:
+            sources[module] = source_hash(module)
+    except OSError:
+        return
+    write_entry(path, "program", make_header(path, sources), program)
@@ -0,0 +1,103 @@
+import bongtypes
+from bongvalues import concat_strings
+import operator
+import typing
+
+# Specialised operations for the operators. The typechecker knows the operand
+# types of each ast.BinOp and ast.UnaryOp and records the matching operation
+# name (e.g. "int-add", "float-div", "str-concat", "num-lt") in the node's
+# operation attribute, see TypeChecker.check(). The execution engines look up
+# the operation instead of dispatching on the operator and the runtime type of
+# the operands.
+#
+# Operation names are plain strings so that typechecked asts can be cached.
+
+# Name -> (function, python operator used by the translator or None if the
+# translator calls the function)
+BinaryOperation = typing.Tuple[typing.Callable[[typing.Any, typing.Any], typing.Any], typing.Optional[str]]
+UnaryOperation = typing.Tuple[typing.Callable[[typing.Any], typing.Any], str]
+
+BINARY_OPERATIONS : typing.Dict[str, BinaryOperation] = {
+        "int-add": (operator.add, "+"),
+        "int-sub": (operator.sub, "-"),
+        "int-mul": (operator.mul, "*"),
+        # Integer division rounds down
+        "int-div": (operator.floordiv, "//"),
+        "int-mod": (operator.mod, "%"),
+        "int-pow": (operator.pow, "**"),
+        "float-add": (operator.add, "+"),
+        "float-sub": (operator.sub, "-"),
+        "float-mul": (operator.mul, "*"),
+        "float-div": (operator.truediv, "/"),
+        "float-pow": (operator.pow, "**"),
+        # Builds long strings in amortised O(1) per append
+        "str-concat": (concat_strings, None),
+        "array-concat": (operator.add, "+"),
+        # Comparisons of ints and floats with each other
+        "num-eq": (operator.eq, "=="),
+        "num-ne": (operator.ne, "!="),
+        "num-lt": (operator.lt, "<"),
+        "num-gt": (operator.gt, ">"),
+        "num-le": (operator.le, "<="),
+        "num-ge": (operator.ge, ">="),
+        "str-eq": (operator.eq, "=="),
+        "str-ne": (operator.ne, "!="),
+        # Strings are ordered lexicographically, false is less than true
+        "str-lt": (operator.lt, "<"),
+        "str-gt": (operator.gt, ">"),
+        "str-le": (operator.le, "<="),
+        "str-ge": (operator.ge, ">="),
+        "bool-eq": (operator.eq, "=="),
+        "bool-ne": (operator.ne, "!="),
+        "bool-lt": (operator.lt, "<"),
+        "bool-gt": (operator.gt, ">"),
+        "bool-le": (operator.le, "<="),
+        "bool-ge": (operator.ge, ">="),
+        # Both sides are always evaluated, so the bitwise operators do
+        "bool-and": (operator.and_, "&"),
+        "bool-or": (operator.or_, "|"),
+        }
+
+UNARY_OPERATIONS : typing.Dict[str, UnaryOperation] = {
+        "bool-not": (operator.not_, "not "),
+        "int-neg": (operator.neg, "-"),
+        "float-neg": (operator.neg, "-"),
+        }
+
+# Operators -> operation name suffixes
+BINARY_SUFFIXES = {
+        "+": "add", "-": "sub", "*": "mul", "/": "div", "%": "mod", "^": "pow",
+        "==": "eq", "!=": "ne", "<": "lt", ">": "gt", "<=": "le", ">=": "ge",
+        "&&": "and", "||": "or",
+        }
+UNARY_SUFFIXES = {"!": "not", "-": "neg"}
+
+TYPE_PREFIXES : typing.Dict[type, str] = {
+        bongtypes.Integer: "int",
+        bongtypes.Float: "float",
+        bongtypes.String: "str",
+        bongtypes.Boolean: "bool",
+        bongtypes.Array: "array",
+        }
+
+# The operation for op applied to operands of the given (already checked)
+# types. Raises a BongtypeException (which the typechecker reports at the
+# operator) if the engines have no such operation.
+def binary_operation(op : str, lhs : bongtypes.BaseType, rhs : bongtypes.BaseType) -> str:
+    prefix = TYPE_PREFIXES.get(type(lhs))
+    suffix = BINARY_SUFFIXES.get(op)
+    if (prefix == "str" or prefix == "array") and suffix == "add":
+        suffix = "concat"
+    elif prefix == "int" or prefix == "float":
+        if suffix in ("eq", "ne", "lt", "gt", "le", "ge"):
+            prefix = "num"
+    name = f"{prefix}-{suffix}"
+    if name not in BINARY_OPERATIONS:
+        raise bongtypes.BongtypeException(f"No operation for '{op}' with operands {lhs} and {rhs}.")
+    return name
+
+def unary_operation(op : str, rhs : bongtypes.BaseType) -> str:
+    name = f"{TYPE_PREFIXES.get(type(rhs))}-{UNARY_SUFFIXES.get(op)}"
+    if name not in UNARY_OPERATIONS:
+        raise bongtypes.BongtypeException(f"No operation for '{op}' with operand {rhs}.")
+    return name
@@ -33,6 +33,13 @@ class Parser:
             for btypename, btype in bongtypes.basic_types.items():
                 self.symbols_global[btypename] = bongtypes.Typedef(btype())
 
+    # Whether a global name is taken already. Builtin functions can be
+    # shadowed by imports, functions and structs of the same name, so adding
+    # builtins does not break programs.
+    def is_global_name(self, name : str) -> bool:
+        return (name in self.symbols_global
+                and not isinstance(self.symbols_global[name], bongtypes.BuiltinFunction))
+
     # TODO Somehow, the Parser is re-initialized each input round, the
     # evaluator is not. This is somehow the reason why snapshots have to be
     # taken and restored on the parser.
@@ -136,7 +143,7 @@ class Parser:
         toks.add(self.match(token.SEMICOLON))
         if not os.path.isabs(path):
             path = os.path.join(self.basepath, path)
-        if name in self.symbols_global:
+        if self.is_global_name(name):
             raise ParseException(f"Name '{name}' already exists in global symbol table. Import impossible.")
         self.symbols_global[name] = bongtypes.UnknownType()
         return ast.Import(toks, name, path)
@@ -150,7 +157,7 @@ class Parser:
         if not toks.add(self.match(token.IDENTIFIER)):
             raise ParseException("Expected function name.")
         name = self.peek(-1).lexeme
-        if name in self.symbols_global:
+        if self.is_global_name(name):
             raise ParseException(f"Name '{name}' already exists in symbol table. Function definition impossible.")
         # Register function name before parsing parameter names (no parameter name should have the function name!)
         self.symbols_global[name] = bongtypes.UnknownType()
@@ -202,7 +209,7 @@ class Parser:
         if not toks.add(self.match(token.IDENTIFIER)):
             raise ParseException("Expected struct name.")
         name = self.peek(-1).lexeme
-        if name in self.symbols_global:
+        if self.is_global_name(name):
             raise ParseException(f"Name '{name}' already exists in global symbol table. Struct definition impossible.")
         # {
         if not toks.add(self.match(token.LBRACE)):
@@ -262,6 +269,13 @@ class Parser:
         if not self.match(token.IDENTIFIER):
             raise ParseException("Expected identifier as module or type.")
         typename = [self.peek(-1).lexeme]
+        # Map types: map[K]V
+        if typename[0] == "map" and self.match(token.LBRACKET):
+            key_type = self.parse_type()
+            if not self.match(token.RBRACKET):
+                raise ParseException("Expected closing bracket ']' in map type specification.")
+            value_type = self.parse_type()
+            return ast.BongtypeIdentifier(typename, num_array_levels, (key_type, value_type))
         while self.match(token.DOT):
             if not self.match(token.IDENTIFIER):
                 raise ParseException("Expected identifier as module or type.")
@@ -281,7 +295,7 @@ class Parser:
     def expression_stmt(self) -> ast.BaseNode:
         expr = self.assignment()
         if tok := self.match(token.SEMICOLON):
-            expr.tokens.append(tok)
+            expr.extend_span([tok])
         return expr
 
     def let_stmt(self) -> ast.Let:
@@ -393,51 +407,56 @@ class Parser:
         return lhs
 
     def expression(self) -> ast.BaseNode:
-        return self.parse_or()
-
-    def parse_or(self) -> ast.BaseNode:
-        lhs = self.parse_and()
-        while tok := self.match(token.OP_OR):
-            lhs = ast.BinOp([tok], lhs, "||", self.parse_and())
-        return lhs
-
-    def parse_and(self) -> ast.BaseNode:
-        lhs = self.parse_not()
-        while tok := self.match(token.OP_AND):
-            lhs = ast.BinOp([tok], lhs, "&&", self.parse_not())
-        return lhs
-
-    def parse_not(self) -> ast.BaseNode:
-        if tok := self.match(token.OP_NEG):
-            return ast.UnaryOp([tok], "!", self.parse_not())
-        return self.compare()
-
-    def compare(self) -> ast.BaseNode:
-        lhs = self.parse_pipeline()
-        while tok := self.match([token.OP_EQ, token.OP_NEQ, token.OP_GT, token.OP_GE, token.OP_LT, token.OP_LE]):
-            prev = self.peek(-1)
-            rhs = self.parse_pipeline()
-            if prev.type == token.OP_EQ:
-                op = "=="
-            elif prev.type == token.OP_NEQ:
-                op = "!="
-            elif prev.type == token.OP_GT:
-                op = ">"
-            elif prev.type == token.OP_GE:
-                op = ">="
-            elif prev.type == token.OP_LT:
-                op = "<"
-            elif prev.type == token.OP_LE:
-                op = "<="
+        return self.parse_expression(Precedence.OR)
+
+    # Precedence climbing / Pratt parser for all unary and binary operators.
+    # It parses an expression whose operators bind at least as tight as
+    # level. Like this, each expression only needs a few nested calls
+    # instead of one call for each precedence level of the grammar.
+    # Besides the level, the operators are limited by a ceiling: After an
+    # operator was applied, only operators of the same or a looser level can
+    # follow. This resembles exactly which operators the grammar's rules
+    # accept at which position (e.g. no 'a | b & | c').
+    def parse_expression(self, level : int) -> ast.BaseNode:
+        # Prefix operators
+        tok = self.peek()
+        lhs : ast.BaseNode
+        if tok.type == token.OP_NEG and level <= Precedence.NOT:
+            self.next()
+            lhs = ast.UnaryOp([tok], "!", self.parse_expression(Precedence.NOT))
+            ceiling = Precedence.AND
+        elif tok.type == token.OP_SUB and level <= Precedence.SIGNED:
+            self.next()
+            lhs = ast.UnaryOp([tok], "-", self.parse_expression(Precedence.EXPONENTIATION))
+            ceiling = Precedence.MULTIPLICATION
+        elif tok.type == token.OP_ADD and level <= Precedence.SIGNED:
+            self.next()
+            lhs = self.parse_expression(Precedence.EXPONENTIATION)
+            ceiling = Precedence.MULTIPLICATION
+        else:
+            lhs = self.access()
+            ceiling = Precedence.EXPONENTIATION
+        # Binary operators
+        while True:
+            precedence = BINARY_OPERATORS.get(self.peek().type)
+            if precedence == None or precedence < level or precedence > ceiling:
+                return lhs
+            if precedence == Precedence.PIPELINE:
+                lhs = self.parse_pipeline(lhs)
+                ceiling = Precedence.COMPARE
+                continue
+            tok = self.next()
+            if precedence == Precedence.EXPONENTIATION: # right-associative
+                rhs = self.parse_expression(Precedence.EXPONENTIATION)
+                ceiling = Precedence.MULTIPLICATION
             else:
-                raise Exception("Assertion failed \"== > < !=\".")
-            lhs = ast.BinOp([tok], lhs, op, rhs)
-        return lhs
+                rhs = self.parse_expression(precedence + 1)
+                ceiling = precedence
+            # The token types of binary operators are the operators themselves
+            lhs = ast.BinOp([tok], lhs, tok.type, rhs)
 
-    def parse_pipeline(self) -> ast.BaseNode:
-        leftmost = self.addition()
-        if not self.peek().type==token.BONG:
-            return leftmost
+    # Called when a BONG follows the leftmost expression of a pipeline
+    def parse_pipeline(self, leftmost : ast.BaseNode) -> ast.Pipeline:
         # Pipelines consist of:
         # a) stdin for the first syscall (string or string-variable)
         # b) syscalls
@@ -459,57 +478,13 @@ class Parser:
                 # (index-access or whatever) that we want to assign to.
                 elements.append(self.parse_commata_expressions())
             else:
-                elements.append(self.addition())
+                elements.append(self.parse_expression(Precedence.ADDITION))
         nonblocking = True if toks.add(self.match(token.AMPERSAND)) else False
         pipeline = ast.Pipeline(toks, elements, nonblocking)
         #if not self.match(token.SEMICOLON):
             #raise ParseException("A pipeline should end a line!")
         return pipeline
 
-    def addition(self) -> ast.BaseNode:
-        lhs = self.multiplication()
-        while tok := self.match([token.OP_ADD, token.OP_SUB]):
-            prev = self.peek(-1)
-            rhs = self.multiplication()
-            if prev.type == token.OP_ADD:
-                op = "+"
-            elif prev.type == token.OP_SUB:
-                op = "-"
-            else:
-                raise Exception("Assertion failed: \"+-\".")
-            lhs = ast.BinOp([tok], lhs, op, rhs)
-        return lhs
-
-    def multiplication(self):
-        lhs = self.signed()
-        while tok := self.match([token.OP_MULT, token.OP_DIV, token.OP_MOD]):
-            prev = self.peek(-1)
-            rhs = self.signed()
-            if prev.type == token.OP_MULT:
-                op = "*"
-            elif prev.type == token.OP_DIV:
-                op = "/"
-            elif prev.type == token.OP_MOD:
-                op = "%"
-            else:
-                raise Exception("Assertion failed: */%")
-            lhs = ast.BinOp([tok], lhs, op, rhs)
-        return lhs
-
-    def signed(self):
-        if tok := self.match(token.OP_SUB):
-            return ast.UnaryOp([tok], "-", self.exponentiation())
-        if self.match(token.OP_ADD):
-            pass # return self.exponentiation()
-        return self.exponentiation()
-
-    def exponentiation(self):
-        lhs = self.access()
-        if tok := self.match(token.OP_POW):
-            rhs = self.exponentiation()
-            lhs = ast.BinOp([tok], lhs, "^", rhs)
-        return lhs
-
     def access(self):
         lhs = self.primary()
         toks = TokenList()
@@ -527,10 +502,18 @@ class Parser:
         while self.following_access():
             if toks.add(self.match(token.LBRACKET)):
                 self.check_eof("Missing expression for indexing.")
-                rhs = self.expression()
-                if not toks.add(self.match(token.RBRACKET)):
-                    raise ParseException("Missing ] for indexing.")
-                lhs = ast.IndexAccess(toks, lhs, rhs)
+                # Slices: lhs[low:high], lhs[low:], lhs[:high], lhs[:]
+                low = self.expression() if self.peek().type != token.COLON else None
+                if toks.add(self.match(token.COLON)):
+                    self.check_eof("Missing ] for slicing.")
+                    high = self.expression() if self.peek().type != token.RBRACKET else None
+                    if not toks.add(self.match(token.RBRACKET)):
+                        raise ParseException("Missing ] for slicing.")
+                    lhs = ast.SliceAccess(toks, lhs, low, high)
+                else:
+                    if not toks.add(self.match(token.RBRACKET)):
+                        raise ParseException("Missing ] for indexing.")
+                    lhs = ast.IndexAccess(toks, lhs, low)
             elif toks.add(self.match(token.LPAREN)):
                 arguments = self.parse_arguments()
                 if not toks.add(self.match(token.RPAREN)):
@@ -594,7 +577,7 @@ class Parser:
             exp = self.expression()
             if not toks.add(self.match(token.RPAREN)):
                 raise ParseException("Missing closing parenthesis ).")
-            exp.tokens.extend(toks)
+            exp.extend_span(toks)
             return exp
         # array values [ ... ]
         if toks.add(self.match(token.LBRACKET)):
@@ -604,12 +587,35 @@ class Parser:
             if not toks.add(self.match(token.RBRACKET)):
                 raise ParseException("Expected ].")
             return ast.Array(toks, elements)
+        # map values { key : value, ... }
+        if toks.add(self.match(token.LBRACE)):
+            keys : typing.List[ast.BaseNode] = []
+            values : typing.List[ast.BaseNode] = []
+            if self.peek().type != token.RBRACE:
+                keys.append(self.expression())
+                if not toks.add(self.match(token.COLON)):
+                    raise ParseException("':' missing between map key and value.")
+                values.append(self.expression())
+                while toks.add(self.match(token.COMMA)):
+                    keys.append(self.expression())
+                    if not toks.add(self.match(token.COLON)):
+                        raise ParseException("':' missing between map key and value.")
+                    values.append(self.expression())
+            # implicit semicolon
+            self.match(token.SEMICOLON)
+            if not toks.add(self.match(token.RBRACE)):
+                raise ParseException("Expected }.")
+            return ast.Map(toks, keys, values)
         # variable name, function call, struct value, ... here, we only
         # parse the corresponding identifier or ... program call fallback
         if toks.add(self.match(token.IDENTIFIER)):
             identifier = self.peek(-1).lexeme
+            # Builtin functions are only called with parentheses, otherwise
+            # their names are programs like any unknown name ('ls | sort',
+            # 'find . -name x')
+            builtin = isinstance(self.symbols_global.get(identifier), bongtypes.BuiltinFunction)
             if (identifier in self.symbol_tree 
-                    or identifier in self.symbols_global
+                    or (identifier in self.symbols_global and not builtin)
                     or self.following_access()):
                 return ast.Identifier(toks, identifier)
             # Program Call fallback!
@@ -676,28 +682,15 @@ class Parser:
             elements.append(self.expression())
         return elements
 
+    # The arguments of a syscall are no bong tokens. The lexer scans them
+    # as shell words directly from the source, beginning right behind the
+    # last consumed token which is the beginning of the first word (name).
     def syscall_arguments(self, name) -> typing.List[str]:
-        #valid = [token.OP_SUB, token.OP_DIV, token.OP_MULT, token.OP
-        # TODO complete list of invalid tokens (which finish syscall args)
-        invalid = [token.BONG, token.AMPERSAND, token.SEMICOLON, token.LBRACE, token.OP_EQ, token.RPAREN, token.EOF]
-        arguments : typing.List[str] = []
-        arg = name
-        while self.peek().type not in invalid:
-            c = self.next()
-            # if whitespace is found, this goes to the next arg
-            if c.prec_by_space:
-                arguments.append(arg)
-                arg = ""
-            # for valid tokens, translate
-            # only for int_value, bool_value, identifier, we have to use the lexeme
-            # otherwise, the type is equivalent to what was matched before (which is what we want to restore here)
-            if c.type in [token.IDENTIFIER, token.INT_VALUE, token.FLOAT_VALUE, token.BOOL_VALUE, token.STRING, token.OTHER]:
-                arg += c.lexeme
-            else:
-                arg += c.type
-        arguments.append(arg)
+        last = self.peek(-1)
+        words = self.lexer.shell_words(last.offset + last.length, name)
+        self.restart_token_access(words)
         self.match(token.SEMICOLON) # match away a possible semicolon
-        return arguments
+        return words.lexeme
 
     # The check_eof() method is used whenever we could expect the (current)
     # input to end before (complete) parsing was successful which happens
@@ -709,48 +702,95 @@ class Parser:
 
     #
     # Token access methods
-    # This is implemented with a list of tokens for the future / look ahead
-    # and a list for the past / looking back
+    # This is implemented with a ring buffer that holds BACK tokens of the
+    # past / looking back and AHEAD tokens for the future / look ahead.
+    # The tokens are pulled from the lexer's token generator on demand.
     #
     BACK = 3
     AHEAD = 5
+    RING_SIZE = BACK + AHEAD
 
     def init_token_access(self):
-        self.past_tokens = [token.EOF] * Parser.BACK
-        self.next_tokens = []
+        self.tokens = self.lexer.tokens()
+        self.ring = [token.EOF] * Parser.RING_SIZE
+        self.ring_head = 0 # Index of the current token
+        for i in range(Parser.AHEAD):
+            self.ring[i] = next(self.tokens)
+        self.check_error()
+
+    # Make tok the last consumed token and refill the look ahead. Used when
+    # the lexer has been rewound so that the look ahead is outdated.
+    def restart_token_access(self, tok):
+        self.ring[self.ring_head] = tok
+        self.ring_head = (self.ring_head + 1) % Parser.RING_SIZE
         for i in range(Parser.AHEAD):
-            self.next_tokens.append(self.lexer.get_token())
+            self.ring[(self.ring_head + i) % Parser.RING_SIZE] = next(self.tokens)
+        self.check_error()
+
+    # Raise the lexer's error when the current token is an ERROR token
+    def check_error(self):
+        t = self.ring[self.ring_head]
+        if t.type == token.ERROR:
+            raise t.lexeme
 
     # Return current token
     def peek(self, steps=0):
-        if steps >= 0:
-            if steps >= Parser.AHEAD:
-                raise Exception("Looking ahead too far!")
-            return self.next_tokens[steps]
-        else:
-            steps = -1*steps - 1
-            if steps >= Parser.BACK:
-                raise Exception("Looking back too far!")
-            return self.past_tokens[steps]
+        if steps >= Parser.AHEAD:
+            raise Exception("Looking ahead too far!")
+        if steps < -Parser.BACK:
+            raise Exception("Looking back too far!")
+        return self.ring[(self.ring_head + steps) % Parser.RING_SIZE]
 
     # Return current token and advance to the next one
     def next(self):
-        t = self.peek()
-        self.past_tokens = [self.next_tokens[0]] + self.past_tokens[:-1]
-        self.next_tokens = self.next_tokens[1:] + [self.lexer.get_token()]
+        t = self.ring[self.ring_head]
+        # The slot behind the look ahead holds the oldest token of the past
+        # which is overwritten now
+        self.ring[(self.ring_head + Parser.AHEAD) % Parser.RING_SIZE] = next(self.tokens)
+        self.ring_head = (self.ring_head + 1) % Parser.RING_SIZE
+        if self.ring[self.ring_head].type == token.ERROR:
+            self.check_error()
         return t
 
     # Match current token against the type (or list of types) given in compare.
     # If found, return the current token and advance, otherwise return None.
     def match(self, compare):
-        typ = self.peek().type
-        if not isinstance(compare, list):
-            compare = [compare]
-        for c in compare:
-            if c == typ:
-                return self.next()
+        typ = self.ring[self.ring_head].type
+        if typ == compare or (isinstance(compare, list) and typ in compare):
+            return self.next()
         return False
 
+# Binding power of the expression levels, from loosest to tightest.
+# NOT and SIGNED are prefix operators, the rest are binary operators.
+class Precedence:
+    OR = 1
+    AND = 2
+    NOT = 3
+    COMPARE = 4
+    PIPELINE = 5
+    ADDITION = 6
+    MULTIPLICATION = 7
+    SIGNED = 8
+    EXPONENTIATION = 9
+
+BINARY_OPERATORS = {
+    token.OP_OR: Precedence.OR,
+    token.OP_AND: Precedence.AND,
+    token.OP_EQ: Precedence.COMPARE,
+    token.OP_NEQ: Precedence.COMPARE,
+    token.OP_GT: Precedence.COMPARE,
+    token.OP_GE: Precedence.COMPARE,
+    token.OP_LT: Precedence.COMPARE,
+    token.OP_LE: Precedence.COMPARE,
+    token.BONG: Precedence.PIPELINE,
+    token.OP_ADD: Precedence.ADDITION,
+    token.OP_SUB: Precedence.ADDITION,
+    token.OP_MULT: Precedence.MULTIPLICATION,
+    token.OP_DIV: Precedence.MULTIPLICATION,
+    token.OP_MOD: Precedence.MULTIPLICATION,
+    token.OP_POW: Precedence.EXPONENTIATION,
+}
+
 class TokenList(list):
     def __init__(self):
         nothing : typing.List[token.Token] = []
@@ -5,6 +5,7 @@ from parser import Parser
 from typechecker import TypeChecker
 from evaluator import Eval
 from eof_exception import UnexpectedEof
+import memo
 import typing
 import ast
 import symbol_tree
@@ -103,7 +104,7 @@ def tab_completer(text, i): # i = it is called several times
 #readline.insert_text("cd dev")
 #tab_completer("cd dev", 0)
 
-def main():
+def main(engine : typing.Type[Eval] = Eval, memo_capacity : int = memo.DEFAULT_CAPACITY):
     config_print_results = True # Switches on and off the P in REPL
     # For a stricter mode, uncomment the following two lines. Currently, this
     # is disabled because it generates warnings when piped subprocesses are
@@ -113,7 +114,8 @@ def main():
     #TODO auto complete global symtable
     #DEBUG symbol_table_snapshot = ({}, None)
     symbol_table_snapshot = None
-    evaluator = Eval()
+    evaluator = engine()
+    evaluator.memo.capacity = memo_capacity
     readline.set_completer(tab_completer)
     readline.parse_and_bind("tab: complete")
     # Unset all completer_delimiters (defaults to `~!@#$%^&*()-=+[{]}\|;:'",<>/? ).
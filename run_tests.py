@@ -0,0 +1,24 @@
+#!/usr/bin/python
+
+import sys
+import os
+
+# The interpreter's ast.py shadows the ast module of the standard library
+# which unittest needs (via inspect), so 'python -m unittest' fails in this
+# directory. Import unittest with the standard library's ast first, then
+# drop that module again so that the interpreter's modules import their own.
+directory = os.path.dirname(os.path.abspath(__file__))
+sys.path = [path for path in sys.path if os.path.abspath(path or ".") != directory]
+import unittest
+sys.path.insert(0, directory)
+del sys.modules["ast"]
+
+# Runs the given test modules (e.g. test_lexer) or all of them
+if __name__ == '__main__':
+    names = [name.removesuffix(".py") for name in sys.argv[1:]]
+    if len(names) > 0:
+        tests = unittest.defaultTestLoader.loadTestsFromNames(names)
+    else:
+        tests = unittest.defaultTestLoader.discover(directory)
+    result = unittest.TextTestRunner().run(tests)
+    sys.exit(0 if result.wasSuccessful() else 1)
@@ -1,13 +1,27 @@
 #!/usr/bin/python
 
 import unittest
+import os
 from lexer import Lexer
 from parser import Parser
 from typechecker import TypeChecker
-from evaluator import Eval
+from evaluator import Eval, RecursionDepthError
+from closure_eval import ClosureEval
+from vm import VM
+from translator import CompiledEval, BongRuntimeError
+import bytecode
 from test_typechecker import typecheck
 
 class TestEvaluator(unittest.TestCase):
+    # The execution engine under test
+    engine = Eval
+
+    # The cd builtin changes the working directory of the whole test run
+    def setUp(self):
+        self.cwd = os.getcwd()
+    def tearDown(self):
+        os.chdir(self.cwd)
+
     def test_function(self):
         test_eval("func f() {}", None, self)
         test_eval("func f() {} f()", None, self)
@@ -25,7 +39,7 @@ class TestEvaluator(unittest.TestCase):
         try:
             checked = typecheck(code) # see below test_eval()
             self.assertTrue(checked, "Expected typechecker to succeed.")
-            x = evaluate(code, self.printer)
+            x = evaluate(code, self.printer, self.engine)
             self.assertTrue(False, "Expected 'return' to raise a SystemExit exception.")
         except SystemExit as e:
             if expected_value != None:
@@ -58,6 +72,12 @@ class TestEvaluator(unittest.TestCase):
         test_eval('let a=""; let b=""; echo "foo\nbar" | grep foo | a,b; a', "foo\n", self)
         test_eval('let a=""; let b=""; echo "foo\nbar" | grep foo | grep bar | b,a; b', "", self)
         test_eval('let a = "foo"; a | grep foo | let b; b', "foo\n", self)
+        # Programs with the names of builtin functions
+        test_eval('ls | sort | grep foobar', 1, self)
+        test_eval('sort -o /dev/null tests/module.bon', 0, self)
+        test_eval('echo "b\na" | sort | let s; s', "a\nb\n", self)
+        test_eval('find tests -name module.bon | let f; f', "tests/module.bon\n", self)
+        test_eval('split --version | head -1 | let v; starts_with(v, "split")', True, self)
 
     def test_builtin_functions(self):
         # TODO The call() builtin will be removed 
@@ -150,12 +170,308 @@ class TestEvaluator(unittest.TestCase):
         self.check("struct T { x : B } struct B { y : int } let t = T { x : B { y : 7 } }; t.x", "B { y : 7 }")
         self.check("struct T { x : B } struct B { y : int } T { x : B { y : 7 } }.x.y", "7")
         self.check("struct T { x : B } struct B { y : int } let t = T { x : B { y : 7 } }; t.x.y", "7")
+        # Fields are stored by offset, in the order of their names
+        self.check("struct P { y : int, x : int, z : []int } let p = P { z : [3], x : 1, y : 2 };"
+                " p.y = p.x + p.y; p.z[0] = p.y; p", "P { x : 1, y : 3, z : [3] }")
+        self.check("struct P { y : int, x : int } func f(p : P) : int { p.x = 5; return p.x * 10 + p.y }"
+                " let p = P { y : 2, x : 1 }; f(p) * 10 + p.x", 521)
+        self.check("struct P { b : int, a : []int } func f(n : int) : int { print(n); return n }"
+                " let p = P { b : f(1), a : [f(2)] }; p", "P { a : [2], b : 1 }")
+        self.assertEqual(self.result, "2")
 
     def test_import(self):
         self.check("import \"tests/module.bon\" as mod; let s = mod.moduletype { a : 0, b : 1 }; s.b", 1)
         self.check("import \"tests/module.bon\" as mod; let s = mod.moduletype { a : 0, b : 1 }; s", "moduletype { a : 0, b : 1 }")
         self.check("import \"tests/module.bon\" as mod; let s = mod.modulefunc(); s", 42)
 
+    def test_frame_slots(self):
+        self.check("let a = 5 { let a = 10; a = a + 1 } a", 5)
+        self.check("let a = 5 { let b = 10; a = b } { let c = 1 } a", 10)
+        self.check("func f(n : int) : int { let a = n * 2 { let b = a + 1; return b } } let x = 3; f(x) + x", 10)
+        self.check("func f(n : int) : int { if n == 0 { return 0 } let a = n; return f(n-1) + a } f(4)", 10)
+        # The typechecker annotates the frame layout
+        unit = Parser(Lexer("func f(p : int, q : int) { let a = p { let b = q } let c = a } let x = 1; let y = x", "test")).compile()
+        program = TypeChecker().checkprogram(unit)
+        f = program.main_unit.function_definitions["f"]
+        self.assertEqual(f.parameter_slots, [0, 1])
+        self.assertEqual(f.frame_size, 4)
+        self.assertEqual([stmt.slots for stmt in f.body.stmts[::2]], [[2], [3]])
+        self.assertEqual(program.main_unit.frame_size, 2)
+        self.assertEqual(program.main_unit.statements[1].expr.elements[0].slot, 0)
+        # Frames are retained across several inputs (as in the repl)
+        parser = Parser(Lexer("let a = 3", "test"))
+        evaluator = self.engine(self.printer)
+        evaluator.evaluate(TypeChecker().checkprogram(parser.compile()))
+        snapshot = parser.take_snapshot()
+        parser = Parser(Lexer("let b = 4; print(a + b)", "test"), snapshot)
+        evaluator.evaluate(TypeChecker(snapshot[1]).checkprogram(parser.compile()))
+        self.assertEqual(self.result, "7")
+        self.assertEqual(evaluator.locals, [3, 4])
+
+    def test_operations(self):
+        self.check("7 / 2", 3)
+        self.check("-7 / 2", -4)
+        self.check("7.0 / 2.0", 3.5)
+        self.check("2 < 2.5", True)
+        self.check("!(1 == 1.0)", False)
+        self.check("true && !false || false", True)
+        self.check("\"a\" < \"b\"", True)
+        self.check("\"ab\" >= \"b\"", False)
+        self.check("\"a\" <= \"a\"", True)
+        self.check("true > false", True)
+        self.check("true < false", False)
+        self.check("let s = \"foo\"; s > \"bar\" && false <= true", True)
+        # The typechecker records the operation specialised to the operand types
+        code = "let a = [1] + [2]; let s = \"a\" + \"b\"; let i = -(1 + 2); let f = 1.0 / 2.0; let b = 1 < 2.0"
+        program = TypeChecker().checkprogram(Parser(Lexer(code, "test")).compile())
+        operations = [stmt.expr.elements[0] for stmt in program.main_unit.statements]
+        self.assertEqual([op.operation for op in operations],
+                ["array-concat", "str-concat", "int-neg", "float-div", "num-lt"])
+        self.assertEqual(operations[2].rhs.operation, "int-add")
+
+    def test_copy_on_write(self):
+        # Arrays and structs are passed by value but copied lazily
+        self.check("func f(a : []int) : int { a[0] = 5; return a[0] } let a = [1, 2]; f(a) + a[0]", 6)
+        self.check("func f(a : []int) : int { a[0] = 5; return a[0] } let a = [1, 2]; f(a); a", [1, 2])
+        self.check("func f(m : [][]int) { let row = m[0]; row[0] = 5 } let m = [[1], [2]]; f(m); m", [[1], [2]])
+        self.check("func f(m : [][]int) : [][]int { m[0][0] = 5; return m } let m = [[1]]; let n = f(m); m", [[1]])
+        self.check("func f(m : [][]int) : [][]int { m[0][0] = 5; return m } let m = [[1]]; let n = f(m); n", [[5]])
+        self.check("let a = [1]; let b = append(a, 2); let c = append(a, 3); a", [1])
+        self.check("let a = [1]; let b = append(a, 2); let c = append(a, 3); b", [1, 2])
+        self.check("let a = [1]; let b = append(a, 2); let c = append(a, 3); c", [1, 3])
+        self.check("let a = [1]; let b = append(a, 2); b[0] = 7; let c = append(b, 3); a + c", [1, 7, 2, 3])
+        self.check("let a = [[1]]; let b = a + a; b[0][0] = 2; a + b", [[1], [2], [1]])
+        self.check("struct P { x : int, a : []int } func f(p : P) : int { p.x = 2; p.a[0] = 9; return p.x }"
+                " let p = P { x : 1, a : [1] }; f(p); p", "P { a : [1], x : 1 }")
+
+    def test_escaped_values(self):
+        # A variable and an array's element can be the same array, writing
+        # through the variable must not change copies of the array
+        append = "let outer : [][][]int = []; outer = append(outer, m); row[0] = 9; "
+        self.check("let m = [[1, 2]]; let row = m[0]; " + append + "outer[0][0][0] * 10 + m[0][0]", 19)
+        self.check("let row = [1]; let m = [row]; " + append + "outer[0][0][0] * 10 + m[0][0]", 19)
+        self.check("let row = [1]; let m = [[0]]; m[0] = row; " + append + "outer[0][0][0] * 10 + m[0][0]", 19)
+        self.check("let m = [[[1]]]; let row = m[0][0]; let outer : [][][]int = []; outer = append(outer, m[0]);"
+                " row[0] = 9; outer[0][0][0] * 10 + m[0][0][0]", 19)
+        self.check("struct S { a : []int } let m = [S { a : [1] }]; let row = m[0].a; let outer : [][]S = [];"
+                " outer = append(outer, m); row[0] = 9; outer[0][0].a[0] * 10 + m[0].a[0]", 19)
+
+    def test_typed_arrays(self):
+        # Arrays of ints, floats and bools have a typed storage, they behave
+        # just like other arrays
+        self.check("let a = [1, 2]; let b = a + [3]; b[0] = 5; append(a, 4) + b", [1, 2, 4, 5, 2, 3])
+        self.check("let a : []bool = []; a = append(a, true); a = append(a, false); a[1] = true; a", [True, True])
+        self.check("let a = [0.5]; a = append(a, 1.5); a[0] + a[1]", 2.0)
+        self.check("let a = [1]; a = append(a, 9223372036854775807 + 1); a[0] = -a[1]; a",
+                [-9223372036854775808, 9223372036854775808])
+        # Bulk builtins
+        self.check("let a = range(5); sum(a) * 100 + min(a) * 10 + max(a)", 1004)
+        self.check("dot([1.5, 2.0], [2.0, 0.25])", 3.5)
+        self.check("range(3, 0, -1) + range(2, 4)", [3, 2, 1, 2, 3])
+        self.check("let a = fill(3, 0); a[1] = 1; a", [0, 1, 0])
+        self.check("let a = fill(2, [1]); a[0][0] = 2; a", [[2], [1]])
+
+    def test_collection_builtins(self):
+        self.check("let a = [3, 1, 2]; sort(a) + reverse(a) + a", [1, 2, 3, 2, 1, 3, 3, 1, 2])
+        self.check("sort([\"b\", \"c\", \"a\"])", ["a", "b", "c"])
+        self.check("reverse(\"abc\")", "cba")
+        self.check("contains([1, 2], 2) && !contains([1, 2], 3) && contains(\"bong\", \"on\")", True)
+        self.check("index_of([4, 5, 4], 4) * 10 + index_of([4], 5)", -1)
+        self.check("join([\"a\", \"b\"], \", \")", "a, b")
+        self.check("min([\"b\", \"a\"]) + max([\"b\", \"a\"])", "ab")
+        self.check("slice([1, 2, 3, 4], 1, 3) + slice([1, 2, 3], -1, 3)", [2, 3, 3])
+        self.check("slice(\"hello\", 1, -1)", "ell")
+        self.check("concat_all([[1], [], [2, 3]])", [1, 2, 3])
+        self.check("unique([3, 1, 3, 2, 1])", [3, 1, 2])
+        # The new arrays hold copies of the elements (or share them until
+        # they are changed)
+        self.check("let m = [[1], [2]]; let r = reverse(m); r[0][0] = 5; let s = slice(m, 0, 1); s[0][0] = 6;"
+                " let c = concat_all([m]); c[0][0] = 7; m", [[1], [2]])
+
+    def test_string_builtins(self):
+        text = "let text = \" a 1\\nbb 22 \\n\"; "
+        self.check(text + "lines(text)", [" a 1", "bb 22 "])
+        self.check(text + "fields(text)", ["a", "1", "bb", "22"])
+        self.check(text + "split(trim(text), \" \")", ["a", "1\nbb", "22"])
+        self.check(text + "find(text, \"bb\") * 10 + find(text, \"c\")", 49)
+        self.check(text + "replace(trim(text), \"\\n\", \",\")", "a 1,bb 22")
+        self.check(text + "starts_with(text, \" a\") && !starts_with(text, \"a\")", True)
+        self.check("substr(\"Hi, Bong!\", 4, 4) + substr(\"Hi, Bong!\", -1, 5)", "Bong!")
+        self.check("to_int(\"42\") + to_int(-2.5)", 40)
+        self.check("to_float(\"0.5\") + to_float(1)", 1.5)
+        self.check("str(1) + str(0.5) + str([1])", "10.5[1]")
+
+    def test_builtin_shadowing(self):
+        # Functions and structs can have the name of a builtin function
+        self.check("func sum(a : []int) : int { return 42 } sum([1, 2])", 42)
+        self.check("func lines(s : str) : int { return len(s) } lines(\"ab\") + len(fields(\"a b\"))", 4)
+        self.check("struct values { x : int } let v = values { x : max([1, 3]) }; v.x + len(keys({1 : 2}))", 4)
+
+    def test_columnar_arrays(self):
+        # Arrays of structs stored column by column behave like other arrays
+        # of structs
+        struct = "struct P { x : int, a : []int } "
+        self.check(struct + "let ps = columnar([P { x : 1, a : [] }]); ps = append(ps, P { a : [2], x : 2 });"
+                " ps[0].x = ps[1].x + 1; ps[1].a[0] = 3; ps", "[P { a : [], x : 3 }, P { a : [3], x : 2 }]")
+        self.check(struct + "func f(ps : []P) : int { ps[0].x = 5; return ps[0].x }"
+                " let ps = columnar([P { x : 1, a : [1] }]); f(ps) * 10 + ps[0].x", 51)
+        self.check(struct + "let ps = columnar([P { x : 1, a : [1] }]); let p = ps[0]; p.a[0] = 2; ps + ps",
+                "[P { a : [2], x : 1 }, P { a : [2], x : 1 }]")
+        self.check(struct + "let ps : []P = []; ps = columnar(ps); ps = append(ps, P { x : 1, a : [] }); ps[0]",
+                "P { a : [], x : 1 }")
+        # Rows and their fields that are kept in variables are not shared
+        # with copies of the array (see test_escaped_values)
+        append = "let outer : [][]P = []; outer = append(outer, ps); "
+        self.check(struct + "let ps = columnar([P { x : 1, a : [1] }]); let a = ps[0].a; " + append +
+                "a[0] = 9; outer[0][0].a[0] * 10 + ps[0].a[0]", 19)
+        self.check(struct + "let ps = columnar([P { x : 1, a : [1] }]); let p = ps[0]; " + append +
+                "p.x = 9; p.a[0] = 9; outer[0][0].x * 1000 + outer[0][0].a[0] * 100 + ps[0].x * 10 + ps[0].a[0]", 1199)
+
+    def test_string_building(self):
+        # Long strings built by concatenation are appended to in place,
+        # other values of the same string must not change
+        build = "let s = \"\"; let i = 0; while i < 50 { s = s + \"ab\"; i = i + 1 } "
+        self.check(build + "len(s)", 100)
+        self.check(build + "let a = s + \"x\"; let b = s + \"y\"; a[100] + b[100] + s[99]", "xyb")
+        self.check(build + "let a = s + \"x\"; a == s + \"x\"", True)
+        self.check(build + "let a = s + \"x\"; s == a", False)
+        self.check(build + "let a = s + \"x\"; len(s) + len(a)", 201)
+        self.check(build + "func f(s : str) : str { return s + \"!\" } let a = f(s); len(f(s) + a)", 202)
+
+    def test_slice_access(self):
+        self.check("let a = [1, 2, 3, 4]; a[1:3] + a[:1] + a[3:] + a[-2:-1] + a[4:] + a[2:2]", [2, 3, 1, 4, 3])
+        self.check("let a = [1, 2, 3]; len(a[:]) + len(a[3:])", 3)
+        self.check("\"hello\"[1:-1]", "ell")
+        # Bounds are not clamped
+        for code in ("let a = [1, 2, 3]; a[2:1]", "let a = [1, 2, 3]; a[1:4]", "let a = [1]; a[-2:]",
+                "\"abc\"[:4]", "slice([1, 2, 3], -1, 10)"):
+            with self.assertRaises((IndexError, BongRuntimeError)):
+                evaluate(code, self.printer, self.engine)
+        # Slices share the storage until either of them is changed
+        self.check("let a = [1, 2, 3]; let b = a[1:]; b[0] = 5; a[2] = 6; a + b", [1, 2, 6, 5, 3])
+        self.check("let a = [1, 2, 3]; let b = a[:2]; b = append(b, 4); a + b", [1, 2, 3, 1, 2, 4])
+        self.check("let m = [[1], [2]]; let r = m[1:]; r[0][0] = 3; m + r", [[1], [2], [3]])
+        self.check("func f(a : []int) : []int { return a[1:] } let a = [1, 2]; let b = f(a); b[0] = 3; a + b", [1, 2, 3])
+        # Slices of long strings are views of the same buffer
+        long = "let s = \"\"; let i = 0; while i < 50 { s = s + \"ab\"; i = i + 1 } "
+        self.check(long + "let t = s[1:99]; len(t) * 10 + len(t[2:])", 1076)
+        self.check(long + "let t = s[1:99]; t[0] + t[97] + t[1:3]", "baab")
+        self.check(long + "let t = s[1:99] + \"!\"; t[96:] == \"ba!\"", True)
+
+    def test_maps(self):
+        self.check("let m = {\"a\" : 1, \"b\" : 2}; m[\"b\"] = m[\"a\"] + 5; m[\"c\"] = 0; m",
+                "{'a': 1, 'b': 6, 'c': 0}")
+        self.check("let m : map[int]bool = {}; m[3] = true; len(m) * 10 + len({1.5 : [1]})", 11)
+        self.check("let m = {1 : \"x\", 2 : \"y\"}; has(m, 2) && !has(m, 3)", True)
+        self.check("let m = {2 : \"y\", 1 : \"x\"}; keys(m) + keys({3 : 1})", [2, 1, 3])
+        self.check("let m = {2 : \"y\", 1 : \"x\"}; values(m)", ["y", "x"])
+        self.check("let m = {1 : 1, 2 : 2}; delete(m, 1); delete(m, 3); m", "{2: 2}")
+        self.check("let s = \"\"; let i = 0; while i < 50 { s = s + \"ab\"; i = i + 1 } let m = {s : 1}; m[s + \"\"]", 1)
+        # Maps are passed by value like arrays, values are copied on write
+        self.check("func f(m : map[int][]int) { m[1][0] = 2; m[2] = [3]; delete(m, 1) } let m = {1 : [1]}; f(m); m",
+                "{1: [1]}")
+        self.check("func f(m : map[int][]int) : []int { return m[1] } let m = {1 : [1]}; let a = f(m); a[0] = 2; m",
+                "{1: [1]}")
+        self.check("func f(m : map[int]int) : map[int]int { m[1] = 2; return m } let m = {1 : 1}; f(m)[1] * 10 + m[1]", 21)
+        self.check("let m = {1 : [1]}; let v = values(m); v[0][0] = 2; m", "{1: [1]}")
+        self.check("struct S { m : map[str]int } let s = S { m : {} }; s.m[\"a\"] = 1; let ms = [s.m]; ms[0][\"b\"] = 2; ms",
+                "[{'a': 1, 'b': 2}]")
+        # A variable and a map's value can be the same array (see test_escaped_values)
+        append = "let outer : []map[str][]int = []; outer = append(outer, m); row[0] = 9; "
+        self.check("let m = {\"a\" : [1, 2]}; let row = m[\"a\"]; " + append + "outer[0][\"a\"][0] * 10 + m[\"a\"][0]", 19)
+        self.check("let row = [1]; let m = {\"a\" : row}; " + append + "outer[0][\"a\"][0] * 10 + m[\"a\"][0]", 19)
+        self.check("let row = [1]; let m : map[str][]int = {}; m[\"a\"] = row; " + append + "outer[0][\"a\"][0] * 10 + m[\"a\"][0]", 19)
+
+    def test_readonly_parameters(self):
+        # Arguments of read-only parameters are not copied, values that
+        # escape from a parameter must still be copies
+        self.check("func f(a : []int) : []int { return a } let a = [1]; let b = f(a); b[0] = 2; a", [1])
+        self.check("func f(m : [][]int) : []int { return m[0] } let m = [[1]]; let r = f(m); r[0] = 2; m", [[1]])
+        self.check("func f(a : []int) : int { let b = a; b[0] = 2; return a[0] } let a = [1]; f(a) + a[0]", 3)
+        self.check("func f(a : []int) { let x = [0]; x = a; x[0] = 2 } let a = [1]; f(a); a", [1])
+        self.check("func f(a : []int) : [][]int { return [a] } let a = [1]; let m = f(a); m[0][0] = 2; a", [1])
+        self.check("struct S { a : []int } func f(a : []int) : S { return S { a : a } }"
+                " let a = [1]; let s = f(a); s.a[0] = 2; a", [1])
+        self.check("func g(a : []int) : int { a[0] = 2; return a[0] } func f(a : []int) : int { return g(a) + a[0] }"
+                " let a = [1]; f(a) + a[0]", 4)
+        code = """struct S { x : int, a : []int }
+            func f(a : []int, b : []int, n : int, m : [][]int, s : S, t : S) : int {
+                b[0] = n
+                let row = m[0]
+                t.x = 1
+                return a[0] + len(b) + s.a[0] + g(s)
+            }
+            func g(s : S) : int { return s.x }"""
+        program = TypeChecker().checkprogram(Parser(Lexer(code, "test")).compile())
+        functions = program.main_unit.function_definitions
+        self.assertEqual(functions["f"].readonly_parameters, [True, False, True, False, True, False])
+        self.assertEqual(functions["g"].readonly_parameters, [True])
+
+    def test_tail_calls(self):
+        # A tail call replaces the current call, so tail recursion is not
+        # limited by the python stack
+        self.check("func count(n : int, acc : int) : int { if n == 0 { return acc } return count(n - 1, acc + 1) }"
+                " count(100000, 0)", 100000)
+        self.check("func f(a : []int, n : int) : []int { if n == 0 { return a } a[0] = n; return f(a, n - 1) }"
+                " let a = [5]; let b = f(a, 3); a[0] * 10 + b[0]", 51)
+        self.check("func f(n : int) : int, int { if n == 0 { return 1, 2 } return f(n - 1) } f(3)", "1, 2")
+        self.check("func f(n : int) : int { while n > 0 { return f(n - 1) } return 7 } f(3)", 7)
+
+    def test_mutual_tail_calls(self):
+        code = """func even(n : int) : bool { if n == 0 { return true } return odd(n - 1) }
+            func odd(n : int) : bool { if n == 0 { return false } return even(n - 1) }"""
+        self.check(code + " even(10)", True)
+        self.check(code + " even(100001)", False)
+
+    def test_deep_recursion(self):
+        # Non-tail recursion is limited by the python stack, except in the vm
+        with self.assertRaises(RecursionDepthError) as context:
+            evaluate("func f(n : int) : int { if n == 0 { return 0 } return f(n-1) + 1 } f(100000)",
+                    self.printer, self.engine)
+        self.assertIn("--engine=vm", str(context.exception))
+
+    def test_purity(self):
+        code = """func fib(n : int) : int { if n <= 1 { return n } return fib(n - 1) + fib(n - 2) }
+            func loud(n : int) : int { print(n); if n <= 1 { return n } return loud(n - 1) + 1 }
+            func calls_loud(n : int) : int { if n == 0 { return loud(1) } return calls_loud(n - 1) * 2 }
+            func writes(a : []int, n : int) : int { a[0] = n; if n == 0 { return 0 } return writes(a, n - 1) }
+            func even(n : int) : bool { if n == 0 { return true } return !odd(n - 1) }
+            func odd(n : int) : bool { if n == 0 { return false } return !even(n - 1) }
+            func count(n : int) : int { if n == 0 { return 0 } return count(n - 1) }
+            func add(a : int, b : int) : int { return a + b }
+            func ls_count() : int { return ls }"""
+        program = TypeChecker().checkprogram(Parser(Lexer(code, "test")).compile())
+        functions = program.main_unit.function_definitions
+        self.assertEqual({name: f.pure for name, f in functions.items()}, {"fib": True, "loud": False,
+            "calls_loud": False, "writes": False, "even": True, "odd": True, "count": True, "add": True,
+            "ls_count": False})
+        # Only pure functions with non-tail recursion are memoized
+        self.assertEqual([name for name, f in functions.items() if f.memoize], ["fib", "even", "odd"])
+
+    def test_memoization(self):
+        # Exponential without memoization
+        self.check("func fib(n : int) : int { if n <= 1 { return n } return fib(n - 1) + fib(n - 2) } fib(80)", 23416728348467685)
+        self.check("func f(n : int) : int, int { if n == 0 { return 1, 2 } let a, b = f(n - 1); return b, a } f(3) ", "2, 1")
+        # Cached arrays are values
+        self.check("func f(n : int) : []int { if n == 0 { return [0] } let a = f(n - 1); a[0] = n; return a }"
+                " let a = f(2); a[0] = 7; f(2)[0] + f(1)[0] + a[0]", 10)
+        code = "func fib(n : int) : int { if n <= 1 { return n } return fib(n - 1) + fib(n - 2) } fib(20) + fib(20)"
+        program = TypeChecker().checkprogram(Parser(Lexer(code, "test")).compile())
+        machine = self.engine(self.printer)
+        self.assertEqual(str(machine.evaluate(program)), "13530")
+        cache = machine.memo.caches[program.main_unit.function_definitions["fib"]]
+        self.assertEqual((cache.hits, cache.misses), (19, 21))
+        # Bounded, least recently used calls are evicted
+        machine = self.engine(self.printer)
+        machine.memo.capacity = 4
+        self.assertEqual(str(machine.evaluate(program)), "13530")
+        cache = machine.memo.caches[program.main_unit.function_definitions["fib"]]
+        self.assertEqual(list(cache.entries), [(17,), (19,), (18,), (20,)])
+        machine = self.engine(self.printer)
+        machine.memo.capacity = 0
+        self.assertEqual(str(machine.evaluate(program)), "13530")
+        self.assertEqual(machine.memo.caches, {})
+
     # Helper method to typecheck the given code chunk
     def typecheck(self, code):
         checked = typecheck(code)
@@ -168,7 +484,7 @@ class TestEvaluator(unittest.TestCase):
         # For testing that the typechecker catches invalid code, we have
         # an additional test_typechecker.py
         self.typecheck(code)
-        evaluated = evaluate(code, self.printer)
+        evaluated = evaluate(code, self.printer, self.engine)
         evaluated = str(evaluated)
         expected = str(expected) if expected!=None else ""
         self.assertEqual(evaluated, expected, f"Expected {expected} but"
@@ -177,16 +493,53 @@ class TestEvaluator(unittest.TestCase):
     def printer(self, string):
         self.result = str(string) # type(string) == ValueList
 
+# Run all evaluator tests with the closure engine, too
+class TestClosureEval(TestEvaluator):
+    engine = ClosureEval
+
+# And with the bytecode vm
+class TestVM(TestEvaluator):
+    engine = VM
+
+    def test_disassemble(self):
+        program = TypeChecker().checkprogram(Parser(Lexer("func f(n : int) : int { return n * 2 } let a = f(21); a", "test")).compile())
+        machine = VM()
+        listing = bytecode.disassemble(machine.compile(program.main_unit)).split("\n")
+        self.assertEqual(listing[0], "<main> (frame size 1, parameter slots []):")
+        self.assertEqual(listing[2].split(), ["2", "CALL", "1", "(f)"])
+        self.assertIn("f (frame size 1, parameter slots [0]):", listing)
+        self.assertEqual(str(machine.evaluate(program)), "42")
+
+    def test_deep_recursion(self):
+        # Bong calls do not recurse in python, 10^5 nested non-tail calls
+        self.check("func f(n : int) : int { if n == 0 { return 0 } return f(n-1) + 1 } f(100000)", 100000)
+
+class TestCompiled(TestEvaluator):
+    engine = CompiledEval
+
+    def test_mutual_tail_calls(self):
+        # Only tail calls of a function to itself become loops, other calls
+        # use the python stack
+        self.check("func even(n : int) : bool { if n == 0 { return true } return odd(n - 1) }"
+                " func odd(n : int) : bool { if n == 0 { return false } return even(n - 1) } even(101)", False)
+
+    def test_runtime_error_location(self):
+        code = "func get(a : []int, i : int) : int {\n    return a[i]\n}\nlet a = [1, 2]\nget(a, 5)"
+        with self.assertRaises(BongRuntimeError) as context:
+            evaluate(code, self.printer, self.engine)
+        self.assertEqual(context.exception.location, ("test_evaluator.py input", 2, 5))
+        self.assertIn("IndexError", str(context.exception))
+
 # Just for backwards compatibility
 def test_eval(code, expected, test_class):
     test_class.check(code, expected)
     
 # Evaluate the given code chunk, assert that typechecking works
-def evaluate(code, printer):
+def evaluate(code, printer, engine=Eval):
     l = Lexer(code, "test_evaluator.py input")
     p = Parser(l)
     tc= TypeChecker()
-    e = Eval(printer)
+    e = engine(printer)
     unit = p.compile()
     program = tc.checkprogram(unit)
     if not program:
@@ -1,4 +1,5 @@
 import unittest
+import random
 import lexer
 from token_def import *
 
@@ -137,7 +138,81 @@ class TestLexer(unittest.TestCase):
         expectedTypes = [COMMA, SEMICOLON, DOT, COLON]
         test_token_types(self, sourcecode, expectedTypes)
 
-
+    def test_positions(self):
+        # (line, col, length) of all tokens, '\r' and '\n' both start a new line
+        sourcecode = "let a = 1\n  a == \"x\"\r\n/* \n */ b"
+        expectedPositions = [(1,1,3), (1,5,1), (1,7,1), (1,9,1), (1,10,1),
+                (2,3,1), (2,5,2), (2,8,3), (2,11,1), (5,5,1), (5,6,1)]
+        l = createLexer(sourcecode)
+        for pos in expectedPositions:
+            tok = l.get_token()
+            self.assertEqual(pos, (tok.line, tok.col, tok.length), "wrong position for token " + str(tok))
+        with self.assertRaises(lexer.TokenizeException) as cm:
+            l = createLexer("a\n \"\\x4g\"")
+            while l.get_token().type != EOF:
+                pass
+        self.assertEqual((cm.exception.line, cm.exception.col), (2, 3))
+
+
+    def test_differential(self):
+        # The scanning engine must produce exactly the same tokens (and
+        # errors) as the character-wise reference lexer
+        fragments = list("ab_ 019.\n\r\t\"\\/*+-=!<>&|;,:(){}[]^%xu#\u00e4") + [
+                "let ", "while ", "return", "true", "1.5", "// c\r\n\n ",
+                "/*/", "**/", "\"\\u{41}\"", "\"\\x4", "\"\\u{zz}\"",
+                "\\u{1234567}", "\"\\q\""]
+        sources = []
+        for path in ["examples/program.bon", "examples/stdlib.bon"]:
+            with open(path) as f:
+                sources.append(f.read())
+        rand = random.Random(1337)
+        for i in range(2000):
+            sources.append("".join(rand.choice(fragments) for _ in range(rand.randint(0, 30))))
+        for sourcecode in sources:
+            self.assertEqual(token_stream(lexer.CharLexer, sourcecode),
+                    token_stream(lexer.Lexer, sourcecode),
+                    "token streams differ for " + repr(sourcecode))
+            # Streams that are read in tiny chunks must give the same result
+            for chunk_size in [1, 2, 5]:
+                self.assertEqual(token_stream(lexer.Lexer, sourcecode),
+                        token_stream(lexer.Lexer, ChoppedStream(sourcecode, chunk_size)),
+                        f"token streams differ for {sourcecode!r} read in chunks of {chunk_size}")
+
+    def test_mapped_file(self):
+        path = "examples/stdlib.bon"
+        with open(path) as f:
+            expected = token_stream(lexer.Lexer, f.read())
+        with lexer.MappedFile(path) as f:
+            self.assertEqual(expected, token_stream(lexer.Lexer, f))
+
+
+# Text stream that returns at most chunk_size characters per read
+class ChoppedStream:
+    def __init__(self, text, chunk_size):
+        self.text = text
+        self.chunk_size = chunk_size
+    def read(self, size):
+        size = min(size, self.chunk_size)
+        result, self.text = self.text[:size], self.text[size:]
+        return result
+
+
+# Lexes the whole sourcecode, errors are part of the result
+def token_stream(lexer_class, sourcecode):
+    l = lexer_class(sourcecode, "test_lexer input")
+    result = []
+    while True:
+        try:
+            tok = l.get_token()
+        except lexer.TokenizeException as e:
+            result.append(("TokenizeException", e.msg, e.line, e.col, e.length))
+            return result
+        except lexer.eof_exception.UnexpectedEof as e:
+            result.append(("UnexpectedEof",))
+            return result
+        result.append((tok.type, tok.lexeme, tok.line, tok.col, tok.length, tok.prec_by_space))
+        if tok.type == EOF:
+            return result
 
 def test_token_types(test_class, sourcecode, expectedTypes):
     l = createLexer(sourcecode)
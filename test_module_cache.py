@@ -0,0 +1,140 @@
+#!/usr/bin/python
+
+import unittest
+import os
+import tempfile
+import io
+import contextlib
+import module_cache
+import ast
+from typechecker import TypeChecker, ModuleLoader
+from evaluator import Eval
+from translator import CompiledEval
+
+class TestModuleCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+        self.write("main.bon", f"import \"{self.path('a.bon')}\" as a\nprint a.f()\n")
+        self.write("a.bon", f"import \"{self.path('b.bon')}\" as b\nfunc f() : int {{ return b.g() + 1 }}\n")
+        self.write("b.bon", "func g() : int { return 41 }\n")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_unit(self):
+        unit = module_cache.parse_module(self.path("b.bon"))
+        self.assertIsInstance(unit, ast.TranslationUnit)
+        self.assertTrue(os.path.exists(module_cache.cache_path(self.path("b.bon"), "unit")))
+        cached = module_cache.parse_module(self.path("b.bon"))
+        self.assertIsInstance(cached, ast.TranslationUnit)
+        self.assertIsNot(cached, unit)
+        self.assertEqual(str(cached), str(unit))
+        self.write("b.bon", "func g() : int { return 42 }\n")
+        self.assertIn("42", str(module_cache.parse_module(self.path("b.bon"))))
+
+    def test_program(self):
+        main = self.path("main.bon")
+        self.assertEqual(module_cache.load_program(main), None)
+        self.assertEqual(self.run_main(), 42)
+        self.assertIsInstance(module_cache.load_program(main), ast.Program)
+        # Changing a transitive import invalidates the cached program
+        self.write("b.bon", "func g() : int { return 1 }\n")
+        self.assertEqual(module_cache.load_program(main), None)
+        self.assertEqual(self.run_main(), 2)
+        self.assertEqual(self.run_main(), 2)
+        # A broken cache file is ignored
+        with open(module_cache.cache_path(main, "program"), "wb") as f:
+            f.write(b"garbage")
+        self.assertEqual(module_cache.load_program(main), None)
+        self.assertEqual(self.run_main(), 2)
+
+    def test_loader(self):
+        paths = [self.path(name) for name in ["main.bon", "a.bon", "missing.bon", "b.bon"]]
+        with ModuleLoader(2) as loader:
+            units = loader.load(paths)
+        self.assertEqual([type(unit) for unit in units], [ast.TranslationUnit,
+            ast.TranslationUnit, FileNotFoundError, ast.TranslationUnit])
+        self.assertEqual(str(units[3]), str(module_cache.parse_module(paths[3])))
+
+    def test_loader_deep_module(self):
+        # The operators are parsed in a loop but the ast is nested too deeply
+        # to be pickled back from a worker
+        self.write("deep.bon", "func f() : int { return 1" + " + 1" * 1000 + " }\n")
+        with ModuleLoader(2) as loader:
+            units = loader.load([self.path("deep.bon"), self.path("b.bon")])
+        self.assertEqual([type(unit) for unit in units], [ast.TranslationUnit, ast.TranslationUnit])
+
+    def test_loader_parse_errors(self):
+        self.write("c.bon", "func f() : int { return ] }\n")
+        self.write("d.bon", "func g() : int { return ] }\n")
+        errors = io.StringIO()
+        with ModuleLoader(2) as loader, contextlib.redirect_stderr(errors):
+            units = loader.load([self.path("c.bon"), self.path("b.bon"), self.path("d.bon")])
+        self.assertEqual([type(unit) for unit in units], [type(None), ast.TranslationUnit, type(None)])
+        # Only the first parse error is reported
+        self.assertEqual(errors.getvalue().count("ParseError"), 1)
+        self.assertIn("c.bon", errors.getvalue())
+        # Modules too deep to be parsed are reported like parse errors
+        self.write("deeper.bon", "func f() : int { return " + "(" * 2000 + "1" + ")" * 2000 + " }\n")
+        errors = io.StringIO()
+        with ModuleLoader(2) as loader, contextlib.redirect_stderr(errors):
+            units = loader.load([self.path("deeper.bon"), self.path("b.bon")])
+        self.assertEqual([type(unit) for unit in units], [type(None), ast.TranslationUnit])
+        self.assertIn("nested too deeply", errors.getvalue())
+
+    def test_import_graph(self):
+        b = self.path("b.bon")
+        self.write("dup.bon", f"import \"{b}\" as x\nimport \"{self.dir}/./b.bon\" as y\n"
+                f"import \"{self.path('a.bon')}\" as a\n")
+        program = TypeChecker().checkprogram(module_cache.parse_module(self.path("dup.bon")))
+        # Modules are identified by their real path, the order is depth-first
+        self.assertEqual(list(program.modules), [os.path.realpath(b), os.path.realpath(self.path("a.bon"))])
+
+    def test_translation(self):
+        main = self.path("main.bon")
+        self.assertEqual(self.run_compiled(3), 42)
+        for path in [main, self.path("a.bon"), self.path("b.bon")]:
+            self.assertTrue(os.path.exists(module_cache.cache_path(path, "py")))
+            self.assertTrue(os.path.exists(module_cache.cache_path(path, "pyc")))
+        # Cached translations are run from the cache
+        self.assertEqual(self.run_compiled(0), 42)
+        # Changing a transitive import invalidates the translations depending on it
+        self.write("b.bon", "func g() : int { return 1 }\n")
+        self.assertEqual(self.run_compiled(3), 2)
+
+    def run_compiled(self, translations):
+        main = self.path("main.bon")
+        program = TypeChecker().checkprogram(module_cache.parse_module(main))
+        printed = []
+        engine = CompiledEval(printed.append, main)
+        engine.evaluate(program)
+        self.assertEqual(engine.translations, translations)
+        return printed[0][0]
+
+    def test_disabled(self):
+        os.environ[module_cache.DISABLE_VARIABLE] = "1"
+        try:
+            self.assertEqual(self.run_main(), 42)
+            self.assertFalse(os.path.exists(os.path.join(self.dir, module_cache.CACHE_DIR)))
+        finally:
+            del os.environ[module_cache.DISABLE_VARIABLE]
+
+    # Does the same as main.py
+    def run_main(self):
+        main = self.path("main.bon")
+        program = module_cache.load_program(main)
+        if program == None:
+            program = TypeChecker().checkprogram(module_cache.parse_module(main))
+            self.assertIsInstance(program, ast.Program)
+            module_cache.store_program(main, program)
+        printed = []
+        Eval(printed.append).evaluate(program)
+        return printed[0][0]
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def write(self, name, code):
+        with open(self.path(name), "w") as f:
+            f.write(code)
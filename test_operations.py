@@ -0,0 +1,50 @@
+#!/usr/bin/python
+
+import unittest
+import bongtypes
+import operations
+
+class TestOperations(unittest.TestCase):
+    def test_binary_operation(self):
+        Int, Float, Str, Bool = bongtypes.Integer(), bongtypes.Float(), bongtypes.String(), bongtypes.Boolean()
+        self.assertEqual(operations.binary_operation("+", Int, Int), "int-add")
+        self.assertEqual(operations.binary_operation("+", Str, Str), "str-concat")
+        self.assertEqual(operations.binary_operation("<", Int, Float), "num-lt")
+        self.assertEqual(operations.binary_operation("<", Str, Str), "str-lt")
+        self.assertEqual(operations.binary_operation(">=", Str, Str), "str-ge")
+        self.assertEqual(operations.binary_operation(">", Bool, Bool), "bool-gt")
+        self.assertEqual(operations.binary_operation("<=", Bool, Bool), "bool-le")
+        array = bongtypes.Array(Int)
+        with self.assertRaises(bongtypes.BongtypeException):
+            operations.binary_operation("<", array, array)
+        with self.assertRaises(bongtypes.BongtypeException):
+            operations.binary_operation("-", Str, Str)
+        with self.assertRaises(bongtypes.BongtypeException):
+            operations.unary_operation("-", Str)
+
+    # Every comparison the typechecker accepts has an operation
+    def test_comparisons(self):
+        values = [
+                (bongtypes.Integer(), 1), (bongtypes.Float(), 1.5),
+                (bongtypes.String(), "b"), (bongtypes.Boolean(), True),
+                ]
+        checks = {
+                "==": lambda t: t.eq(t), "!=": lambda t: t.ne(t),
+                "<": lambda t: t < t, ">": lambda t: t > t,
+                "<=": lambda t: t <= t, ">=": lambda t: t >= t,
+                }
+        for typ, value in values:
+            for op, check in checks.items():
+                self.assertIsInstance(check(typ), bongtypes.Boolean)
+                function, python_op = operations.BINARY_OPERATIONS[operations.binary_operation(op, typ, typ)]
+                self.assertEqual(function(value, value), eval(f"value {python_op} value"))
+
+    def test_string_comparisons(self):
+        lt = operations.BINARY_OPERATIONS["str-lt"][0]
+        self.assertTrue(lt("a", "b"))
+        self.assertTrue(lt("Z", "a"))
+        self.assertFalse(lt("b", "a"))
+        self.assertTrue(operations.BINARY_OPERATIONS["bool-lt"][0](False, True))
+
+if __name__ == '__main__':
+    unittest.main()
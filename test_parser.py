@@ -1,6 +1,11 @@
 import unittest
+import tracemalloc
+import itertools
 import lexer
 import parser
+import ast
+import eof_exception
+from test_lexer import ChoppedStream
 
 class TestData():
     def __init__(self, sourcecode, expectedStr):
@@ -43,14 +48,46 @@ class TestParser(unittest.TestCase):
                 "grep foo", "{\n(call grep foo)\n}",
                 "cd /home/bong/unittest", "{\n(call cd /home/bong/unittest)\n}",
                 "grep foo\nls -la", "{\n(call grep foo)\n(call ls -la)\n}",
+                # Names of builtin functions are programs unless they are called
+                "sort file", "{\n(call sort file)\n}",
+                "find . -name x.txt", "{\n(call find . -name x.txt)\n}",
+                "split --version", "{\n(call split --version)\n}",
+                "sort([2, 1])", "{\nsort([2, 1])\n}",
                 ]
         test_strings_list(self, data)
 
+    def test_syscall_words(self):
+        data = [
+                "ls -la // list\nls", [["ls", "-la"], ["ls"]],
+                "ls /* a\ncomment */ -la", [["ls", "-la"]],
+                "echo foo//bar /tmp/*.txt", [["echo", "foo//bar", "/tmp/*.txt"]],
+                "echo \"a b | c;\\t{\" x", [["echo", "a b | c;\t{", "x"]],
+                "echo 'a \"b\\t' \"\"", [["echo", "a \"b\\t", ""]],
+                "expac --timefmt=\"%Y %T\" '%n'", [["expac", "--timefmt=%Y %T", "%n"]],
+                "python3 ../x.py", [["python3", "../x.py"]],
+                "./run a=b == 0", [["./run", "a=b"]],
+                "if true { ls -la }", [["ls", "-la"]],
+                "ls -la; ls\nls\t-l", [["ls", "-la"], ["ls"], ["ls", "-l"]],
+                ]
+        for i in range(0, len(data), 2):
+            self.assertEqual(syscall_args(data[i]), data[i+1])
+            # Rewinding the lexer also works when streaming
+            self.assertEqual(syscall_args(ChoppedStream(data[i], 3)), data[i+1])
+        # Shell words and tokens of the look ahead can span chunks that the
+        # streaming lexer drops
+        code = "let a = \"" + "x"*(lexer.CHUNK_SIZE+10) + "\"\nls -la\n"
+        self.assertEqual(syscall_args(ChoppedStream(code*3, 1000)), [["ls", "-la"]]*3)
+        # Lexer errors in the look ahead do not matter for shell words
+        with self.assertRaises(eof_exception.UnexpectedEof):
+            syscall_args("echo don't \"stop")
+        self.assertEqual(syscall_args("echo 'don\"t' stop"), [["echo", "don\"t", "stop"]])
+
     def test_pipe(self):
         data = [
                 "ls -la | grep foo", "{\n(call ls -la) | (call grep foo)\n}",
                 "cd | grep", "{\n(call cd) | (call grep)\n}", # parses, but does not run
                 "ls | grep foo | grep bar", "{\n(call ls) | (call grep foo) | (call grep bar)\n}",
+                "ls | sort", "{\n(call ls) | (call sort)\n}",
                 "let a = 0; let b = 0; a + 1 | grep foo | b", "{\nlet a = 0\nlet b = 0\n(a+1) | (call grep foo) | b\n}",
                 ]
         test_strings_list(self, data)
@@ -111,6 +148,54 @@ let c = 31415
 (a=(b=(c=15)))
 }""")
 
+    def test_operator_precedence(self):
+        test_string(self, "!true == false", "{\n(!(true==false))\n}")
+        test_string(self, "!true && !false || true", "{\n(((!true)&&(!false))||true)\n}")
+        test_string(self, "-2 ^ 2 * 3", "{\n((-(2^2))*3)\n}")
+        test_string(self, "2 - -3 * +4", "{\n(2-((-3)*4))\n}")
+        test_string(self, "1 < 2 == true", "{\n((1<2)==true)\n}")
+        test_string(self, "1 + 2 | grep 3 == 0", "{\n((1+2) | (call grep 3)==0)\n}")
+        self.fail("1 ^ -2") # no sign in exponents
+        self.fail("1 == !true") # logical not binds looser than comparisons
+        self.fail("--2") # only one sign
+
+    def test_nesting(self):
+        # Each level of parentheses only needs a few nested calls
+        depth = 150
+        test_string(self, "("*depth + "1" + ")"*depth, "{\n1\n}")
+        test_string(self, "-"+"(-"*depth + "1" + ")"*depth, "{\n"+"(-"*(depth+1) + "1" + ")"*(depth+1)+"\n}")
+
+    def test_memory(self):
+        code = "".join(f"""
+func f{name}(a : int, b : []int) : int {{
+    let x{name} = a * 2 + b[0] - (3 / a) ^ 2
+    if x{name} > 10 && !(a == b[1]) {{
+        x{name} = x{name} - 1
+    }}
+    print [x{name}, 2, 3]
+    return x{name}
+}}""" for name in map("".join, itertools.product("abcdefghijklmnop", repeat=2)))
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            tokens = list(itertools.takewhile(lambda t: t.type != "EOF", lexer.Lexer(code, "x").tokens()))
+            token_memory = tracemalloc.get_traced_memory()[0] - before
+            before = tracemalloc.get_traced_memory()[0]
+            program = translate(code)
+            ast_memory = tracemalloc.get_traced_memory()[0] - before
+        finally:
+            tracemalloc.stop()
+        # The ast does not keep any tokens. When it did (and nodes had
+        # dicts), it needed more than twice the memory of the tokens.
+        self.assertLess(ast_memory, 1.5 * token_memory)
+        self.assertEqual(str(program).count("return"), 16*16)
+        nodes = [program]
+        while len(nodes) > 0:
+            node = nodes.pop()
+            self.assertFalse(hasattr(node, "__dict__"), type(node))
+            self.assertFalse(hasattr(node, "tokens"))
+            nodes.extend(node.inner_nodes)
+
     def test_import(self):
         # Little bit hacky: Determine how the module path will probably be resolved
         import os 
@@ -146,6 +231,22 @@ let c = 31415
         self.fail("let a = 0; a.0") # missing identifier for dot access
         #self.fail("a.b") # missing identifier for dot access
 
+    def test_map_value(self):
+        test_string(self, "let m = {}", "{\nlet m = {}\n}")
+        test_string(self, "let m : map[str][]int = {\"a\" : [1], \"b\" : []}", "{\nlet m : map[str][]int = {a : [1], b : []}\n}")
+        self.fail("let m = {1 : 2")
+        self.fail("let m = {1, 2}")
+        self.fail("let m : map[int = {}")
+
+    def test_slice_access(self):
+        test_string(self, "a[1:2]", "{\na[1:2]\n}")
+        test_string(self, "a[:2]", "{\na[:2]\n}")
+        test_string(self, "a[1:]", "{\na[1:]\n}")
+        test_string(self, "a[:]", "{\na[:]\n}")
+        test_string(self, "x[0][1:2+1].a", "{\nx[0][1:(2+1)].a\n}")
+        self.fail("a[1:2:3]")
+        self.fail("a[1:2")
+
     def check(self, code, expected):
         test_string(self, code, expected)
         
@@ -176,6 +277,18 @@ def test_string(test_class, sourcecode, expectedStr):
     # work anymore.
     test_class.assertTrue(program_string == expectedStr, "Expected \"" + expectedStr + "\", but got \" " + program_string + "\"")
 
+# Arguments of all syscalls in the program, None if parsing fails
+def syscall_args(sourcecode):
+    program = parser.Parser(lexer.Lexer(sourcecode, "test_parser.py input")).compile()
+    if program == None:
+        return None
+    return [stmt.args for stmt in syscalls(program)]
+
+def syscalls(node):
+    if isinstance(node, ast.SysCall):
+        return [node]
+    return [call for child in node.inner_nodes for call in syscalls(child)]
+
 def createParser(sourcecode):
     return parser.Parser(lexer.Lexer(sourcecode, "test_parser.py input"))
 
@@ -55,6 +55,26 @@ class TestTypechecker(unittest.TestCase):
     def test_builtin_functions(self):
         self.check('len(1337)')
         self.check('let a = 1337.5; len(a)')
+        self.check('sum(["a"])')
+        self.check('dot([1], [1.0])')
+        self.check('fill(1.5, 0)')
+        self.check('range(1, 2.0)')
+        self.check('columnar([1, 2])')
+        self.check('sort([[1]])')
+        self.check('contains([1], "1")')
+        self.check('index_of("abc", "b")')
+        self.check('join([1, 2], ",")')
+        self.check('slice([1], 0, 1.0)')
+        self.check('concat_all(["a"])')
+        self.check('unique([[1]])')
+        self.check('split("a b", 1)')
+        self.check('trim(1)')
+        self.check('substr("abc", "1", 2)')
+        self.check('to_int(true)')
+        self.check('to_float(1.0)')
+        self.check('str(1, 2)')
+        # A struct named like a builtin is no function
+        self.check('struct values { x : int } values({1 : 2})')
 
     def test_let(self):
         self.check("let a : float = 1337")
@@ -123,6 +143,11 @@ class TestTypechecker(unittest.TestCase):
         self.check("let a = 5; let b : float = a")
         self.check("if 5 == \"asdf\" { }")
         self.check("let a = 5; while a {}")
+        # Operators without an operation for the operand types
+        self.check("[1] < [2]")
+        self.check("\"a\" < 1")
+        self.check("true >= \"a\"")
+        self.check("\"a\" - \"b\"")
 
     def test_struct_definition(self):
         self.check("struct T { x : unknown, y : float }") # inner type unknown
@@ -146,6 +171,27 @@ class TestTypechecker(unittest.TestCase):
         self.check("struct T { x : int } struct U { y : int } let a = T { x : 5 }; a = U { y : 7 }") # type does not match
         self.check("struct T { x : int } struct U { y : float } let a = T { x : 5 }; let b = U { y : 7.0 }; a.x = b.y") # type does not match
 
+    def test_maps(self):
+        self.check("let m = {}") # type hint required
+        self.check("let m : map[[]int]int = {}") # no valid key type
+        self.check("let m = {[1] : 1}") # no valid key type
+        self.check("let m = {1 : 1, \"a\" : 2}") # key types do not match
+        self.check("let m = {1 : 1, 2 : \"b\"}") # value types do not match
+        self.check("let m = {1 : 1}; m[\"a\"]") # wrong key type
+        self.check("let m = {1 : 1}; m[1] = 1.0") # wrong value type
+        self.check("let m : map[str]int = {\"a\" : true}") # type does not match
+        self.check("let m = {1 : 1}; has(m, \"1\")")
+        self.check("let m = {1 : 1}; let k : []str = keys(m)")
+        self.check("len({1 : 1}, 1)")
+        self.check("func f() : map[int]int { return {1 : 1} } delete(f(), 1)") # not writable
+
+    def test_slice_access(self):
+        self.check("let a = 1; a[0:1]") # no array or string
+        self.check("let a = [1]; a[0:1.0]") # no integer bound
+        self.check("let a = [1]; a[\"0\":]") # no integer bound
+        self.check("let a = [1]; let b : int = a[:1]") # slices are arrays
+        self.check("let a = [1, 2]; a[0:1] = [3]") # slices are not assignable
+
     def test_import(self):
         self.check("import \"nonexistentfile.bon\" as mod")
         self.check("import \"tests/module_buggy.bon\" as mod")
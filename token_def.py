@@ -1,12 +1,26 @@
 class Token:
-    def __init__(self, typ, filepath, line, col, length, prec_by_space = False, lexeme = None):
+    # Tokens only store their offset in the source file. Line and column are
+    # looked up in the file's line_index.LineIndex when they are requested.
+    __slots__ = ("type", "prec_by_space", "lexeme", "filepath", "line_index", "offset", "length")
+    def __init__(self, typ, filepath, line_index, offset, length, prec_by_space = False, lexeme = None):
         self.type = typ
         self.prec_by_space = prec_by_space
         self.lexeme = lexeme
         self.filepath = filepath
-        self.line = line
-        self.col = col
+        self.line_index = line_index
+        self.offset = offset
         self.length = length
+    # Pickled (by the module cache) as constructor arguments which is much
+    # more compact than the default state of slotted objects
+    def __reduce__(self):
+        return (Token, (self.type, self.filepath, self.line_index, self.offset,
+            self.length, self.prec_by_space, self.lexeme))
+    @property
+    def line(self):
+        return self.line_index.position(self.offset)[0]
+    @property
+    def col(self):
+        return self.line_index.position(self.offset)[1]
     def __str__(self):
         if self.lexeme != None:
             return self.type + "(" + str(self.lexeme) + ")"
@@ -57,3 +71,8 @@ IMPORT = "import"
 AS = "as"
 STRUCT = "struct"
 STRING = "STRING_VALUE"
+# The arguments of a syscall, lexeme is the list of words
+SHELL_WORDS = "SHELL_WORDS"
+# A lexer error, lexeme is the exception which the parser raises when the
+# token is reached
+ERROR = "ERROR"
@@ -0,0 +1,651 @@
+from __future__ import annotations
+import ast
+import bong_builtins
+import bongtypes
+import module_cache
+from bongvalues import ValueList, StructValue, ArrayValue, MapValue, copy_value, copy_values, struct_class, slice_value, escape
+from evaluator import Eval, RecursionDepthError, resolve_module, pipeline_syscalls, struct_value_class
+from operations import BINARY_OPERATIONS, UNARY_OPERATIONS
+import marshal
+import memo
+import math
+import os
+import sys
+import types
+import typing
+
+# Ahead-of-time translation of typechecked bong modules to python. Each
+# ast.TranslationUnit becomes one python module which is compiled to a code
+# object and run by CPython directly:
+# - Each bong function becomes a python function, the frame slots of its
+#   variables become python locals (v0, v1, ...).
+# - The top-level statements of the main unit become the function __main__()
+#   which loads the top-level frame (Eval.locals) into locals and stores them
+#   back afterwards so that variables are retained in shell mode.
+# - while/if become python while/if, operators become python operators
+#   as chosen by the typechecker (see operations.py).
+# - Functions with one return value return it directly, all others return a
+#   tuple. Tail calls of a function to itself (outside of while loops) assign
+#   the parameters and jump back to the start of the function body, which is
+#   wrapped in a loop for this. Other calls use the python stack. Arguments are copied (call by value, see bongvalues.ArrayValue)
+#   unless the parameter is read-only.
+# - Struct values, program calls and pipelines use the same runtime as the
+#   evaluator (bongvalues.StructValue, Eval.callprogram(), Eval.run_pipeline()).
+# - Memoized functions are wrapped when the module is loaded, so the
+#   generated code does not depend on the engine's memo settings.
+#
+# Unlike the evaluator, a function without return values does not leak the
+# value of its last statement to the caller.
+#
+# With a source file, the generated python code (foo.bon.py) and its code
+# object (foo.bon.pyc) are cached in the module cache directory, see
+# module_cache.py. Exceptions raised by the generated code are mapped back to
+# the bong source location of the statement that raised them.
+
+class BongRuntimeError(Exception):
+    def __init__(self, msg : str, location : typing.Tuple[str, int, int]):
+        super().__init__(msg)
+        self.msg = msg
+        self.location = location
+    def __str__(self):
+        return f"RuntimeError in {self.location[0]}, line {self.location[1]} col {self.location[2]}: {self.msg}"
+
+# Generates the python source of one translation unit
+class Translator:
+    def __init__(self, unit : ast.TranslationUnit, modules : typing.Dict[str, ast.TranslationUnit]):
+        # Global names are resolved in unit's symbol table
+        self.unit = unit
+        self.modules = modules
+        self.lines : typing.List[str] = []
+        # Python line number -> bong source location
+        self.locations : typing.Dict[int, typing.Tuple[str, int, int]] = {}
+        # Module level definitions (program calls) appended after the functions
+        self.constants : typing.List[str] = []
+        # Constant names of the struct classes by struct name and fields
+        self.struct_classes : typing.Dict[typing.Tuple[str, typing.Tuple[str, ...]], str] = {}
+        # Names of functions in other modules, bound when linking
+        self.links : typing.Dict[str, typing.Tuple[str, str]] = {}
+        self.indentation = 0
+        self.temporaries = 0
+        # Statements which have to be emitted before the current statement
+        # because they compute parts of an expression (assignments and
+        # pipelines are statements in python)
+        self.pending : typing.List[typing.Tuple[str, ast.BaseNode]] = []
+        # Number of return values of the function translated currently, None
+        # for top-level statements
+        self.return_count : typing.Optional[int] = None
+        # The function translated currently if its body is wrapped in a loop
+        # for its self tail calls, and the depth of while loops in it
+        self.tail_loop : typing.Optional[ast.FunctionDefinition] = None
+        self.loops = 0
+
+    def translate(self, node : ast.TranslationUnit, main : bool) -> str:
+        self.emit("# Translated from bong, do not edit.")
+        for definition in node.function_definitions.values():
+            self.function(definition)
+        if main:
+            self.main(node)
+        self.emit("")
+        self.emit(f"_LINKS = {self.links!r}")
+        for constant in self.constants:
+            self.emit(constant)
+        self.emit(f"_LOCATIONS = {self.locations!r}")
+        return "\n".join(self.lines) + "\n"
+
+    def emit(self, line : str, node : typing.Optional[ast.BaseNode] = None):
+        # Flush the statements computing parts of this line first
+        pending, self.pending = self.pending, []
+        for statement, statement_node in pending:
+            self.emit(statement, statement_node)
+        self.lines.append("    " * self.indentation + line)
+        if node != None:
+            location = node.get_location()
+            self.locations[len(self.lines)] = (location[0], location[1], location[2])
+
+    def temporary(self) -> str:
+        self.temporaries += 1
+        return f"_t{self.temporaries}"
+
+    def function(self, definition : ast.FunctionDefinition):
+        parameters = ", ".join(f"v{slot}" for slot in definition.parameter_slots)
+        self.emit("")
+        self.emit(f"def f_{definition.name}({parameters}):", definition)
+        self.return_count = len(definition.return_types)
+        self.indentation += 1
+        if self.self_tail_call(definition.body, definition):
+            self.tail_loop = definition
+            self.emit("while True:")
+            self.indentation += 1
+        start = len(self.lines)
+        self.statement(definition.body, False)
+        body = definition.body.stmts
+        ends_with_return = len(body) > 0 and isinstance(body[-1], ast.Return)
+        if (self.return_count != 1 or self.tail_loop != None) and not ends_with_return:
+            # Also leave the loop of the self tail calls at the end
+            self.emit("return ()")
+        elif len(self.lines) == start:
+            self.emit("pass")
+        if self.tail_loop != None:
+            self.indentation -= 1
+            self.tail_loop = None
+        self.indentation -= 1
+        self.return_count = None
+
+    # Whether the statement contains a return statement with a tail call of
+    # the given function outside of while loops
+    def self_tail_call(self, node : ast.BaseNode, definition : ast.FunctionDefinition) -> bool:
+        if isinstance(node, ast.Block):
+            return any(self.self_tail_call(stmt, definition) for stmt in node.stmts)
+        elif isinstance(node, ast.IfElseStatement):
+            return self.self_tail_call(node.thn, definition) or (
+                    isinstance(node.els, ast.BaseNode) and self.self_tail_call(node.els, definition))
+        elif isinstance(node, ast.Return) and node.tail_call != None:
+            unit, funcname = self.resolve_call(node.tail_call)
+            return unit is self.unit and funcname == definition.name
+        return False
+
+    def main(self, node : ast.TranslationUnit):
+        variables = [f"v{slot}" for slot in range(node.frame_size)]
+        self.emit("")
+        self.emit("def __main__(_frame):")
+        self.indentation += 1
+        if len(variables) > 0:
+            self.emit(f"{', '.join(variables)}, = _frame")
+        self.emit("_result = _ValueList([])")
+        self.emit("try:")
+        self.indentation += 1
+        for i, stmt in enumerate(node.statements):
+            # Only the last statement's result is the program's result
+            self.statement(stmt, i == len(node.statements) - 1)
+        self.emit("return _result")
+        self.indentation -= 1
+        self.emit("finally:")
+        self.indentation += 1
+        if len(variables) > 0:
+            self.emit(f"_frame[:] = {', '.join(variables)},")
+        else:
+            self.emit("pass")
+        self.indentation -= 2
+
+    # Translate a statement. If keep_result is set, the statement's result
+    # (see Eval.evaluate()) is stored to _result.
+    def statement(self, node : ast.BaseNode, keep_result : bool):
+        if isinstance(node, ast.Block):
+            for i, stmt in enumerate(node.stmts):
+                self.statement(stmt, keep_result and i == len(node.stmts) - 1)
+            if keep_result and len(node.stmts) == 0:
+                self.emit("_result = _ValueList([])")
+        elif isinstance(node, ast.Return):
+            if self.return_count == None:
+                # A top-level return means exit, see Eval.evaluate()
+                values = self.sequence(node.result) if node.result != None else "()"
+                self.emit(f"_exit({values})", node)
+            elif node.result == None:
+                self.emit("return ()", node)
+            elif (self.tail_loop != None and self.loops == 0 and node.tail_call != None
+                    and self.self_tail_call(node, self.tail_loop)):
+                # Start over with the new arguments
+                parameters = [f"v{slot}" for slot in self.tail_loop.parameter_slots]
+                if len(parameters) > 0:
+                    self.emit(f"{', '.join(parameters)}, = {', '.join(self.arguments(node.tail_call))},", node)
+                self.emit("continue", node)
+            elif self.return_count == 1:
+                self.emit(f"return {self.value(node.result)}", node)
+            else:
+                self.emit(f"return {self.sequence(node.result)}", node)
+        elif isinstance(node, ast.IfElseStatement):
+            self.emit(f"if {self.value(node.cond)}:", node.cond)
+            self.block(node.thn, keep_result)
+            if isinstance(node.els, ast.BaseNode) or keep_result:
+                self.emit("else:")
+                if isinstance(node.els, ast.BaseNode):
+                    self.block(node.els, keep_result)
+                else:
+                    self.indentation += 1
+                    self.emit("_result = _ValueList([])")
+                    self.indentation -= 1
+        elif isinstance(node, ast.WhileStatement):
+            # Without any iteration, the result is empty
+            if keep_result:
+                self.emit("_result = _ValueList([])")
+            self.loops += 1
+            condition = self.value(node.cond)
+            if len(self.pending) == 0:
+                self.emit(f"while {condition}:", node.cond)
+                self.block(node.t, keep_result)
+            else:
+                # The condition requires statements which are evaluated in
+                # each iteration
+                pending, self.pending = self.pending, []
+                self.emit("while True:")
+                self.indentation += 1
+                self.pending = pending
+                self.emit(f"if not {condition}:", node.cond)
+                self.indentation += 1
+                self.emit("break")
+                self.indentation -= 1
+                self.statement(node.t, keep_result)
+                self.indentation -= 1
+            self.loops -= 1
+        elif isinstance(node, ast.Let):
+            targets = [f"v{slot}" for slot in node.slots]
+            if len(targets) == 1 and self.is_single_value(node.expr):
+                self.emit(f"{targets[0]} = {self.value(node.expr)}", node)
+            else:
+                self.emit(f"{', '.join(targets)}, = {self.sequence(node.expr)}", node)
+            if keep_result:
+                self.emit("_result = _ValueList([])")
+        elif isinstance(node, ast.Print):
+            self.emit(f"_print({self.value_list(node.expr)})", node)
+            if keep_result:
+                self.emit("_result = _ValueList([])")
+        elif isinstance(node, ast.AssignOp):
+            values = self.assignment(node, keep_result)
+            if keep_result:
+                self.emit(f"_result = _ValueList(list({values}))")
+        elif keep_result:
+            self.emit(f"_result = {self.value_list(node)}", node)
+        else:
+            self.emit(self.value(node) if self.is_value_node(node) else self.sequence(node), node)
+
+    # Indented block of statements, python requires at least one
+    def block(self, node : ast.BaseNode, keep_result : bool):
+        self.indentation += 1
+        start = len(self.lines)
+        self.statement(node, keep_result)
+        if len(self.lines) == start:
+            self.emit("pass")
+        self.indentation -= 1
+
+    # Emits an assignment. If the assigned values are required, the name of a
+    # variable holding the tuple of values is returned.
+    def assignment(self, node : ast.AssignOp, need_values : bool) -> str:
+        targets = [self.target(t) for t in node.lhs]
+        if isinstance(node.rhs, ast.AssignOp):
+            values = self.assignment(node.rhs, True)
+        elif not need_values and len(targets) == 1 and self.is_single_value(node.rhs):
+            self.emit(f"{targets[0]} = {self.value(node.rhs)}", node)
+            return ""
+        else:
+            values = self.temporary()
+            self.emit(f"{values} = {self.sequence(node.rhs)}", node)
+        self.emit(f"{', '.join(targets)}, = {values}", node)
+        return values
+
+    def target(self, node : ast.BaseNode) -> str:
+        if isinstance(node, ast.Identifier):
+            return f"v{node.slot}"
+        elif isinstance(node, ast.IndexAccess):
+            return f"{self.container(node)}[{self.value(node.rhs)}]"
+        elif isinstance(node, ast.DotAccess):
+            return f"{self.value(node.lhs)}[{node.field}]"
+        raise Exception("Can only assign to variable or indexed variable")
+
+    # The indexed array or map of an IndexAccess, marked if the element is
+    # kept elsewhere (see bongvalues.escape())
+    def container(self, node : ast.IndexAccess) -> str:
+        if node.escapes:
+            return f"_escape({self.value(node.lhs)})"
+        return self.value(node.lhs)
+
+    # An ExpressionList that consists of a single expression with a single value
+    def is_single_value(self, node : ast.BaseNode) -> bool:
+        return (isinstance(node, ast.ExpressionList) and len(node.elements) == 1
+                and self.is_value_node(node.elements[0]))
+
+    # Nodes which are translated to exactly one value natively
+    def is_value_node(self, node : ast.BaseNode) -> bool:
+        return (isinstance(node, ast.Identifier) or isinstance(node, ast.BinOp)
+                or isinstance(node, ast.UnaryOp) or isinstance(node, ast.Integer)
+                or isinstance(node, ast.Float) or isinstance(node, ast.String)
+                or isinstance(node, ast.Bool) or isinstance(node, ast.IndexAccess)
+                or isinstance(node, ast.SliceAccess)
+                or isinstance(node, ast.DotAccess) or isinstance(node, ast.Array)
+                or isinstance(node, ast.Map)
+                or isinstance(node, ast.StructValue) or isinstance(node, ast.SysCall)
+                or isinstance(node, ast.Pipeline)
+                or (isinstance(node, ast.FunctionCall) and self.call_count(node) == 1))
+
+    # Python expression for a ValueList of the node's values
+    def value_list(self, node : ast.BaseNode) -> str:
+        if self.is_value_node(node) or self.is_single_value(node):
+            return f"_ValueList([{self.value(node)}])"
+        return f"_ValueList(list({self.sequence(node)}))"
+
+    # Python expression for a tuple (or another sequence) of the node's values
+    def sequence(self, node : ast.BaseNode) -> str:
+        if isinstance(node, ast.ExpressionList):
+            if len(node.elements) == 1:
+                return self.sequence(node.elements[0])
+            items = []
+            for e in node.elements:
+                if self.is_value_node(e):
+                    items.append(self.value(e))
+                else:
+                    items.append("*" + self.sequence(e))
+            return "(" + ", ".join(items) + ",)"
+        elif isinstance(node, ast.FunctionCall) and not self.is_value_node(node):
+            return self.call(node)
+        elif isinstance(node, ast.AssignOp):
+            # Python assignments are statements
+            return self.assignment_values(node)
+        return f"({self.value(node)},)"
+
+    # Assignments within expressions (e.g. as rhs of a let statement) are
+    # computed before the statement, the emitted assignment statements are
+    # collected as pending statements, too.
+    def assignment_values(self, node : ast.AssignOp) -> str:
+        lines, self.lines = self.lines, []
+        locations, self.locations = self.locations, {}
+        indentation, self.indentation = self.indentation, 0
+        pending, self.pending = self.pending, []
+        try:
+            values = self.assignment(node, True)
+            statements = self.lines
+        finally:
+            self.lines, self.locations, self.indentation = lines, locations, indentation
+            self.pending = pending
+        self.pending.extend((statement, node) for statement in statements)
+        return values
+
+    # Python expression for the single value of the node
+    def value(self, node : ast.BaseNode) -> str:
+        if isinstance(node, ast.Identifier):
+            if node.slot != None:
+                return f"v{node.slot}"
+            return f"_unknown({node.name!r})"
+        elif isinstance(node, ast.BinOp):
+            # The typechecker has chosen the operation for the operand types
+            operator = BINARY_OPERATIONS[node.operation][1]
+            if operator == None:
+                return f"_binary[{node.operation!r}]({self.value(node.lhs)}, {self.value(node.rhs)})"
+            return f"({self.value(node.lhs)} {operator} {self.value(node.rhs)})"
+        elif isinstance(node, ast.UnaryOp):
+            return f"({UNARY_OPERATIONS[node.operation][1]}{self.value(node.rhs)})"
+        elif isinstance(node, ast.Float):
+            if math.isinf(node.value) or math.isnan(node.value):
+                return f"float({str(node.value)!r})"
+            return repr(node.value)
+        elif (isinstance(node, ast.Integer) or isinstance(node, ast.String)
+                or isinstance(node, ast.Bool)):
+            return repr(node.value)
+        elif isinstance(node, ast.IndexAccess):
+            return f"{self.container(node)}[{self.value(node.rhs)}]"
+        elif isinstance(node, ast.SliceAccess):
+            low = self.value(node.low) if node.low != None else "None"
+            high = self.value(node.high) if node.high != None else "None"
+            return f"_slice({self.value(node.lhs)}, {low}, {high})"
+        elif isinstance(node, ast.DotAccess):
+            return f"{self.value(node.lhs)}[{node.field}]"
+        elif isinstance(node, ast.Array):
+            array = "_array([" + ", ".join(self.value(e) for e in node.elements) + "])"
+            return f"_escape({array})" if node.escapes else array
+        elif isinstance(node, ast.Map):
+            entries = (f"({self.value(key)}, {self.value(value)})" for key, value in zip(node.keys, node.values))
+            literal = "_map([" + ", ".join(entries) + "])"
+            return f"_escape({literal})" if node.escapes else literal
+        elif isinstance(node, ast.StructValue):
+            cls = self.struct_class(node)
+            values = ", ".join(self.value(expr) for expr in node.fields.values())
+            if list(node.fields) == node.field_names:
+                return f"{cls}([{values}])"
+            offsets = tuple(node.field_names.index(name) for name in node.fields)
+            return f"_struct({cls}, {offsets!r}, [{values}])"
+        elif isinstance(node, ast.SysCall):
+            return f"_eval.callprogram({self.syscall(node)})"
+        elif isinstance(node, ast.Pipeline):
+            return self.pipeline(node)
+        elif isinstance(node, ast.FunctionCall) and self.call_count(node) == 1:
+            return self.call(node)
+        elif self.is_single_value(node):
+            assert(isinstance(node, ast.ExpressionList))
+            return self.value(node.elements[0])
+        return f"{self.sequence(node)}[0]"
+
+    def syscall(self, node : ast.SysCall) -> str:
+        name = f"_c{len(self.constants)}"
+        self.constants.append(f"{name} = _SysCall({node.args!r})")
+        return name
+
+    # Name of the module level constant holding the struct value's class
+    def struct_class(self, node : ast.StructValue) -> str:
+        cls = struct_value_class(node)
+        key = (cls.name, cls.field_names)
+        if key not in self.struct_classes:
+            self.struct_classes[key] = f"_c{len(self.constants)}"
+            self.constants.append(f"{self.struct_classes[key]} = _struct_class({cls.name!r}, {cls.field_names!r})")
+        return self.struct_classes[key]
+
+    # The pipeline is run by pending statements, the value is its exit code
+    def pipeline(self, node : ast.Pipeline) -> str:
+        syscalls, numOutputPipes = pipeline_syscalls(node)
+        names = [self.syscall(syscall) for syscall in syscalls]
+        if isinstance(node.elements[0], ast.SysCall):
+            stdin = "None"
+        else:
+            stdin = self.value_list(node.elements[0])
+        outputs = self.temporary()
+        returncode = self.temporary()
+        self.pending.append((f"{outputs}, {returncode} = _eval.run_pipeline([{', '.join(names)}], {stdin}, {numOutputPipes})", node))
+        assignto = node.elements[-1]
+        if isinstance(assignto, ast.PipelineLet):
+            targets = [f"v{slot}" for slot in assignto.slots]
+        elif isinstance(assignto, ast.ExpressionList):
+            targets = [self.target(t) for t in assignto]
+        elif not isinstance(assignto, ast.SysCall):
+            targets = [self.target(assignto)]
+        else:
+            targets = []
+        if len(targets) > 0:
+            self.pending.append((f"{', '.join(targets)}, = {outputs}.elements", node))
+        return returncode
+
+    # Resolve the called function at compile time, either in the current
+    # unit or in the module described by the DotAccess.
+    def resolve_call(self, node : ast.FunctionCall) -> typing.Tuple[ast.TranslationUnit, str]:
+        if isinstance(node.name, ast.Identifier):
+            return self.unit, node.name.name
+        elif isinstance(node.name, ast.DotAccess):
+            return resolve_module(self.modules, self.unit, node.name.lhs), node.name.rhs
+        raise Exception("Identifier or DotAccess for function name expected.")
+
+    # Number of values returned by the call, None for builtins
+    def call_count(self, node : ast.FunctionCall) -> typing.Optional[int]:
+        unit, funcname = self.resolve_call(node)
+        function = unit.symbols_global[funcname]
+        if isinstance(function, bongtypes.Function):
+            return len(function.return_types)
+        return None
+
+    # Arguments of a call of a bong function. Call by value! Arrays and
+    # structs are copied on write, arguments of read-only parameters not at
+    # all.
+    def arguments(self, node : ast.FunctionCall) -> typing.List[str]:
+        unit, funcname = self.resolve_call(node)
+        definition = unit.function_definitions[funcname]
+        args = [self.value(a) for a in node.args]
+        return [arg if readonly else f"_copy({arg})"
+                for arg, readonly in zip(args, definition.readonly_parameters)]
+
+    # A call of a bong function evaluates to its return value (one return
+    # value) or tuple of return values, a builtin call to a ValueList's
+    # elements.
+    def call(self, node : ast.FunctionCall) -> str:
+        unit, funcname = self.resolve_call(node)
+        function = unit.symbols_global[funcname]
+        if isinstance(function, bongtypes.Function):
+            if unit is self.unit:
+                name = f"f_{funcname}"
+            else:
+                path = next(path for path, module in self.modules.items() if module is unit)
+                name = f"_m{list(self.modules).index(path)}_f_{funcname}"
+                self.links[name] = (path, f"f_{funcname}")
+            return f"{name}({', '.join(self.arguments(node))})"
+        # Builtin function
+        args = f"[{', '.join(self.value(a) for a in node.args)}]"
+        if bong_builtins.functions[funcname][2]:
+            args = f"_copy_values({args})"
+        return f"_builtins[{funcname!r}]({args}).elements"
+
+class CompiledEval(Eval):
+    def __init__(self, printfunc=print, path : typing.Optional[str] = None):
+        super().__init__(printfunc)
+        # Path of the main script (if any) so that its translation is cached
+        self.path = path
+        # Namespaces of the translated modules, the main unit's namespace is
+        # reused across evaluations in shell mode
+        self.namespaces : typing.Dict[str, typing.Dict[str, typing.Any]] = {}
+        self.main_namespace = self.new_namespace()
+        # Bong source locations per generated python file
+        self.locations : typing.Dict[str, typing.Dict[int, typing.Tuple[str, int, int]]] = {}
+        # Number of translated (not cached) units
+        self.translations = 0
+
+    def evaluate(self, node : ast.BaseNode) -> ValueList:
+        if not isinstance(node, ast.Program):
+            raise Exception("Only ast.Programs can be compiled.")
+        for k, m in node.modules.items():
+            self.modules[k] = m
+        # The main unit's function definitions and symbols are retained
+        # across evaluations in shell mode, just like in Eval.evaluate().
+        unit = self.current_unit.unit
+        for k, f in node.main_unit.function_definitions.items():
+            unit.function_definitions[k] = f
+        unit.symbols_global = node.main_unit.symbols_global
+        if len(self.locals) < node.main_unit.frame_size:
+            self.locals.extend([None] * (node.main_unit.frame_size - len(self.locals)))
+        try:
+            for path, module in node.modules.items():
+                if path not in self.namespaces:
+                    self.namespaces[path] = self.new_namespace()
+                    self.load(module, path, False, self.namespaces[path])
+            self.load(node.main_unit, self.path, True, self.main_namespace)
+            for namespace in list(self.namespaces.values()) + [self.main_namespace]:
+                for name, (path, function) in namespace["_LINKS"].items():
+                    namespace[name] = self.namespaces[path][function]
+            return self.main_namespace["__main__"](self.locals)
+        except (BongRuntimeError, SystemExit):
+            raise
+        except RecursionError:
+            raise RecursionDepthError() from None
+        except Exception as e:
+            location = self.locate(e.__traceback__)
+            if location == None:
+                raise
+            raise BongRuntimeError(f"{type(e).__name__}: {e}", location) from e
+
+    def new_namespace(self) -> typing.Dict[str, typing.Any]:
+        return {
+                "__builtins__": __builtins__,
+                "_eval": self,
+                "_print": self.printfunc,
+                "_ValueList": ValueList,
+                "_struct": make_struct,
+                "_struct_class": struct_class,
+                "_SysCall": make_syscall,
+                "_copy": copy_value,
+                "_copy_values": copy_values,
+                "_array": ArrayValue,
+                "_map": MapValue,
+                "_slice": slice_value,
+                "_escape": escape,
+                "_exit": exit_program,
+                "_unknown": unknown_identifier,
+                "_builtins": {name: function[0] for name, function in bong_builtins.functions.items()},
+                "_binary": {name: operation[0] for name, operation in BINARY_OPERATIONS.items()},
+                }
+
+    # Translate (or load from the cache) and run the module
+    def load(self, unit : ast.TranslationUnit, path : typing.Optional[str], main : bool, namespace : typing.Dict[str, typing.Any]):
+        code = None
+        if path != None and module_cache.enabled():
+            header = module_cache.make_header(path, self.sources(unit, path))
+            header["kind"] = "main" if main else "module"
+            data = module_cache.read_entry(path, "pyc", header)
+            if isinstance(data, bytes):
+                code, locations = marshal.loads(data)
+        if code == None:
+            translator = Translator(self.current_unit.unit if main else unit, self.modules)
+            source = translator.translate(unit, main)
+            self.translations += 1
+            if path != None and module_cache.enabled():
+                filename = module_cache.cache_path(path, "py")
+                try:
+                    os.makedirs(os.path.dirname(filename), exist_ok=True)
+                    with open(filename, "w") as f:
+                        f.write(source)
+                except OSError:
+                    pass
+            else:
+                filename = f"<bong translation {self.translations}>"
+            code = compile(source, filename, "exec")
+            locations = translator.locations
+            if path != None and module_cache.enabled():
+                module_cache.write_entry(path, "pyc", header, marshal.dumps((code, locations)))
+        self.locations[code.co_filename] = locations
+        exec(code, namespace)
+        # Calls of memoized functions (including recursive calls) go through
+        # the cache, see memo.py
+        for definition in unit.function_definitions.values():
+            cache = self.memo.cache(definition)
+            if cache != None:
+                name = f"f_{definition.name}"
+                namespace[name] = make_memoized(namespace[name], cache, len(definition.return_types) == 1)
+
+    # The translation depends on the unit's source and on the interfaces of
+    # all (transitively) imported modules
+    def sources(self, unit : ast.TranslationUnit, path : str) -> typing.Dict[str, str]:
+        sources = {path: module_cache.source_hash(path)}
+        pending = [unit]
+        while len(pending) > 0:
+            for symbol in pending.pop().symbols_global.values():
+                if isinstance(symbol, bongtypes.Module) and symbol.path not in sources:
+                    sources[symbol.path] = module_cache.source_hash(symbol.path)
+                    pending.append(self.modules[symbol.path])
+        return sources
+
+    # Bong source location of the innermost generated code in the traceback
+    def locate(self, traceback : typing.Optional[types.TracebackType]) -> typing.Optional[typing.Tuple[str, int, int]]:
+        location = None
+        while traceback != None:
+            locations = self.locations.get(traceback.tb_frame.f_code.co_filename, {})
+            lineno = traceback.tb_lineno
+            # Continuation lines (e.g. pending statements) belong to the
+            # closest preceding statement with a location
+            while lineno > 0 and lineno not in locations:
+                lineno -= 1
+            if lineno > 0:
+                location = locations[lineno]
+            traceback = traceback.tb_next
+        return location
+
+# Runtime helpers for the generated code
+# Struct value from field values given in another order than the struct
+# type's
+def make_struct(cls : typing.Type[StructValue], offsets : typing.Tuple[int, ...], values : typing.List[typing.Any]) -> StructValue:
+    ordered : typing.List[typing.Any] = [None] * len(offsets)
+    for offset, value in zip(offsets, values):
+        ordered[offset] = value
+    return cls(ordered)
+
+# Generated functions return a single value or a tuple of values
+def make_memoized(function : typing.Callable[..., typing.Any], cache : memo.MemoCache, single : bool) -> typing.Callable[..., typing.Any]:
+    def memoized(*args):
+        cached = cache.get(args)
+        if cached != None:
+            return cached[0] if single else tuple(cached)
+        result = function(*args)
+        cache.put(args, [result] if single else result)
+        return result
+    return memoized
+
+def make_syscall(args : typing.List[str]) -> ast.SysCall:
+    return ast.SysCall([], args)
+
+def exit_program(values : typing.Sequence[typing.Any]):
+    # https://docs.python.org/3/library/sys.html#sys.exit says:
+    # int -> int, Null -> 0, other -> 1
+    sys.exit(values[0] if len(values) > 0 else None)
+
+def unknown_identifier(name : str):
+    raise Exception(f"Unknown identifier '{name}' specified. TODO: global environment.")
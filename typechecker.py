@@ -1,12 +1,20 @@
 import ast
 from symbol_tree import SymbolTree
 import bongtypes
+import bong_builtins
 from bongtypes import TypeList, BongtypeException
-import lexer, parser
+import operations
+import module_cache
 
 import typing
 from enum import Enum
 import sys # stderr
+import os
+import gc
+import io
+import contextlib
+import pickle
+import concurrent.futures
 
 # For each checked node, indicates if that node is/contains ...
 class Return(Enum):
@@ -18,6 +26,25 @@ class TypeChecker:
     def __init__(self, symbol_table_snapshot = None, modules : typing.Optional[typing.Dict[str, ast.TranslationUnit]] = None):
         self.symbol_tree = SymbolTree(symbol_table_snapshot)
         self.modules : typing.Dict[str, ast.TranslationUnit] = modules if isinstance(modules, dict) else {}
+        # Number of frame slots required by the function (or top-level
+        # statements) that is checked currently, see assign_slot()
+        self.frame_size = 0
+        # Parameters of the function that is checked currently (slot ->
+        # index) and their types, see mark_parameters()
+        self.parameters : typing.Dict[int, int] = {}
+        self.parameter_types : TypeList = TypeList([])
+        self.readonly_parameters : typing.List[bool] = []
+        # The function definition that is checked currently
+        self.function : typing.Optional[ast.FunctionDefinition] = None
+        # Side effects of the current function: whether it prints, calls
+        # programs or writes to its parameters, and the bong functions it
+        # calls (with the call nodes). Collected per function definition
+        # for infer_purity().
+        self.impure = False
+        self.calls : typing.List[typing.Tuple[bongtypes.Function, ast.FunctionCall]] = []
+        self.effects : typing.Dict[ast.FunctionDefinition, typing.Tuple[bongtypes.Function, bool, typing.List[typing.Tuple[bongtypes.Function, ast.FunctionCall]]]] = {}
+        # Calls in tail position (see ast.Return.tail_call)
+        self.tail_calls : typing.Set[ast.FunctionCall] = set()
 
     def checkprogram(self, main_unit : ast.TranslationUnit) -> typing.Optional[ast.Program]:
         try:
@@ -91,7 +118,9 @@ class TypeChecker:
         self.symbols_global = main_unit.symbols_global
         for func in main_unit.function_definitions.values():
             res, turn = self.check(func)
+        self.infer_purity()
         # Statements in main_module / main_unit
+        self.frame_size = 0
         for stmt in main_unit.statements:
             res, turn = self.check(stmt)
             # If there is a possible return value,
@@ -100,32 +129,48 @@ class TypeChecker:
                 expect = bongtypes.TypeList([bongtypes.Integer()])
                 if not res.sametype(expect):
                     raise TypecheckException("Return type of program does not evaluate to int.", stmt)
+        main_unit.frame_size = self.frame_size
         return program
 
+    # Imports are loaded in two steps. First, the whole import graph is
+    # resolved breadth-first where all new modules of one level are read and
+    # parsed concurrently (see ModuleLoader). Modules are identified by
+    # their real path so that a file that is reached via different paths is
+    # only loaded once. Then, the modules are registered depth-first, i.e.
+    # in the same deterministic order as if they were loaded one by one.
     def parse_imports(self, parent_unit : ast.TranslationUnit):
+        loaded : typing.Dict[str, typing.Any] = {}
+        with ModuleLoader() as loader:
+            units = [parent_unit]
+            while len(units) > 0:
+                paths : typing.Dict[str, str] = {} # real path -> import path
+                for unit in units:
+                    for imp_stmt in unit.import_statements:
+                        key = module_key(imp_stmt.path)
+                        if key not in self.modules and key not in loaded:
+                            paths.setdefault(key, imp_stmt.path)
+                results = loader.load(list(paths.values()))
+                loaded.update(zip(paths.keys(), results))
+                units = [unit for unit in results if isinstance(unit, ast.TranslationUnit)]
+        self.register_imports(parent_unit, loaded)
+
+    def register_imports(self, parent_unit : ast.TranslationUnit, loaded : typing.Dict[str, typing.Any]):
         for imp_stmt in parent_unit.import_statements:
-            if imp_stmt.path not in self.modules:
-                # Parse
-                # TODO this should be encapsulated more nicely. Currently, same code
-                # as in main.py
-                try:
-                    with open(imp_stmt.path) as f:
-                        code = f.read()
-                except Exception as e:
+            key = module_key(imp_stmt.path)
+            if key not in self.modules:
+                child_unit = loaded[key]
+                if isinstance(child_unit, OSError):
                     raise TypecheckException(f"Importing {imp_stmt.path} impossible:"
-                            f" '{e}'", imp_stmt)
-                l = lexer.Lexer(code, imp_stmt.path)
-                p = parser.Parser(l)
-                child_unit = p.compile()
+                            f" '{child_unit}'", imp_stmt)
                 # add2modmap
                 if not isinstance(child_unit, ast.TranslationUnit):
                     raise TypecheckException(f"Importing {imp_stmt.path}"
                             " failed.", imp_stmt)
-                self.modules[imp_stmt.path] = child_unit
+                self.modules[key] = child_unit
                 # Recurse
-                self.parse_imports(child_unit)
+                self.register_imports(child_unit, loaded)
             # Add to symbol table
-            parent_unit.symbols_global[imp_stmt.name] = bongtypes.Module(imp_stmt.path)
+            parent_unit.symbols_global[imp_stmt.name] = bongtypes.Module(key)
 
     def resolve_types(self, unit : ast.TranslationUnit):
         for typename, struct_def in unit.struct_definitions.items():
@@ -146,7 +191,14 @@ class TypeChecker:
     def resolve_type(self, identifier : ast.BongtypeIdentifier, unit : ast.TranslationUnit, node : ast.BaseNode) -> bongtypes.ValueType:
         # Arrays are resolved recursively
         if identifier.num_array_levels > 0:
-            return bongtypes.Array(self.resolve_type(ast.BongtypeIdentifier(identifier.typename, identifier.num_array_levels-1), unit, node))
+            return bongtypes.Array(self.resolve_type(ast.BongtypeIdentifier(identifier.typename, identifier.num_array_levels-1, identifier.map_types), unit, node))
+        # Maps as well
+        if identifier.map_types != None:
+            key_type = self.resolve_type(identifier.map_types[0], unit, node)
+            if not isinstance(key_type, bongtypes.key_types):
+                raise TypecheckException(f"Type {key_type} can not be used"
+                        " as a map key.", node)
+            return bongtypes.Map(key_type, self.resolve_type(identifier.map_types[1], unit, node))
         # If a module name is given, propagate to the module
         if len(identifier.typename) > 1:
             modulename = identifier.typename[0]
@@ -241,6 +293,185 @@ class TypeChecker:
         else:
             return False
 
+    # Local variables are stored in frames, one per function call (the
+    # top-level statements have their own frame). The stack index of each
+    # variable in the symbol tree is its final slot in that frame, so the
+    # evaluator can access variables without resolving names at runtime.
+    # This method returns the slot of a variable declared in the current
+    # scope and keeps track of the required frame size.
+    def assign_slot(self, name : str) -> int:
+        slot = self.symbol_tree.get_index(name)
+        self.frame_size = max(self.frame_size, slot + 1)
+        return slot
+
+    # Read-only parameter analysis: The engines do not copy an argument if the
+    # parameter is read-only, i.e. if the function body never writes through
+    # the parameter (p[i] = x, p.x = y, delete(p, k)) and the parameter's
+    # array, map or struct value (or one contained in it) never escapes to a
+    # place where it could be written later (let, assignment, return, array,
+    # map and struct values). Passing the parameter to another function does not
+    # matter because the call copies the argument unless the other function's
+    # parameter is read-only itself. This makes the analysis local to each
+    # function. Scalar parameters are always read-only.
+    def parameter_root(self, node : ast.BaseNode) -> typing.Optional[int]:
+        while isinstance(node, ast.IndexAccess) or isinstance(node, ast.DotAccess):
+            node = node.lhs
+        if isinstance(node, ast.Identifier) and node.slot in self.parameters:
+            return self.parameters[node.slot]
+        return None
+
+    # Type of an IndexAccess/DotAccess chain starting at a parameter
+    def parameter_access_type(self, node : ast.BaseNode) -> bongtypes.BaseType:
+        if isinstance(node, ast.IndexAccess):
+            typ = self.parameter_access_type(node.lhs)
+            if isinstance(typ, bongtypes.Map):
+                return typ.value_type
+            return typ.contained_type if isinstance(typ, bongtypes.Array) else typ
+        elif isinstance(node, ast.DotAccess):
+            typ = self.parameter_access_type(node.lhs)
+            assert(isinstance(typ, bongtypes.Struct))
+            return typ.fields[node.rhs]
+        assert(isinstance(node, ast.Identifier) and node.slot in self.parameters)
+        return self.parameter_types[self.parameters[node.slot]]
+
+    # The values of expr are stored somewhere
+    def mark_escaping_parameters(self, expr : ast.BaseNode):
+        elements = expr.elements if isinstance(expr, ast.ExpressionList) else [expr]
+        for element in elements:
+            index = self.parameter_root(element)
+            if index != None:
+                typ = self.parameter_access_type(element)
+                if (isinstance(typ, bongtypes.Array) or isinstance(typ, bongtypes.Struct)
+                        or isinstance(typ, bongtypes.Map)):
+                    self.readonly_parameters[index] = False
+
+    # The targets of an assignment are written
+    def mark_written_parameters(self, targets : ast.ExpressionList):
+        for target in targets:
+            index = self.parameter_root(target)
+            # Assigning to the parameter itself only changes the local variable
+            if index != None and not isinstance(target, ast.Identifier):
+                self.readonly_parameters[index] = False
+                self.impure = True
+
+    # A builtin writes to its first argument in place (delete(m, k)), like
+    # an assignment to an element of it. Unlike assigning to a parameter
+    # itself, this writes through the parameter.
+    def mark_written_argument(self, target : ast.BaseNode):
+        if not self.is_writable(target):
+            raise TypecheckException("The argument is written to, it has to"
+                    " be a variable.", target)
+        index = self.parameter_root(target)
+        if index != None:
+            self.readonly_parameters[index] = False
+            self.impure = True
+
+    # Aliasing: Lets and assignments do not copy, after 'let row = m[0]' row
+    # is the array contained in m and 'outer[0] = row' stores row itself.
+    # Arrays and maps share their storage with their copies (copy on write),
+    # so the arrays and maps along the access chain of such a value and the
+    # ones it is stored in are marked and their copies get storages of their
+    # own (see bongvalues.escape()). Returned values need no mark, the arrays
+    # and maps they are read from are copies of the arguments or locals of
+    # the callee.
+    #
+    # Type of a local variable or of an IndexAccess/DotAccess chain starting
+    # at one, None for other values
+    def kept_type(self, node : ast.BaseNode) -> typing.Optional[bongtypes.BaseType]:
+        if isinstance(node, ast.IndexAccess):
+            typ = self.kept_type(node.lhs)
+            if isinstance(typ, bongtypes.Map):
+                return typ.value_type
+            return typ.contained_type if isinstance(typ, bongtypes.Array) else None
+        elif isinstance(node, ast.DotAccess):
+            typ = self.kept_type(node.lhs)
+            return typ.fields[node.rhs] if isinstance(typ, bongtypes.Struct) else None
+        elif isinstance(node, ast.Identifier) and node.name in self.symbol_tree:
+            return self.symbol_tree[node.name]
+        return None
+
+    # Mark the arrays and maps along an IndexAccess/DotAccess chain
+    def mark_access_chain(self, node : ast.BaseNode):
+        while isinstance(node, ast.IndexAccess) or isinstance(node, ast.DotAccess):
+            if isinstance(node, ast.IndexAccess):
+                node.escapes = True
+            node = node.lhs
+
+    # The values of expr are stored somewhere, returns whether one of them is
+    # (or contains) an array, map or struct that is referenced elsewhere
+    def mark_kept_values(self, expr : ast.BaseNode) -> bool:
+        elements = expr.elements if isinstance(expr, ast.ExpressionList) else [expr]
+        kept = False
+        for element in elements:
+            if isinstance(element, ast.Array) or isinstance(element, ast.Map):
+                kept = kept or element.escapes
+            elif isinstance(element, ast.StructValue):
+                for value in element.fields.values():
+                    kept = self.mark_kept_values(value) or kept
+            else:
+                typ = self.kept_type(element)
+                if (isinstance(typ, bongtypes.Array) or isinstance(typ, bongtypes.Struct)
+                        or isinstance(typ, bongtypes.Map)):
+                    self.mark_access_chain(element)
+                    kept = True
+        return kept
+
+    # Tail calls: A return statement in a function which returns the result of
+    # a bong function call can replace the current call with that call.
+    # Top-level return statements exit the program, builtins are no calls of
+    # their own.
+    def tail_call(self, result : ast.BaseNode) -> typing.Optional[ast.FunctionCall]:
+        if self.function == None:
+            return None
+        if isinstance(result, ast.ExpressionList) and len(result.elements) == 1:
+            result = result.elements[0]
+        if not isinstance(result, ast.FunctionCall):
+            return None
+        funcs, turn = self.check(result.name)
+        if isinstance(funcs[0], bongtypes.Function):
+            return result
+        return None
+
+    # Purity: A function is pure if it has no side effects itself (see
+    # self.impure) and only calls pure functions. Functions of recursive
+    # calls are assumed to be pure until a function in the cycle turns out to
+    # be impure.
+    # Pure functions which call themselves (directly or via other functions)
+    # in a non-tail position are memoized, see memo.py. Tail recursion runs
+    # in constant space and hardly ever repeats its arguments.
+    def infer_purity(self):
+        for definition, (func, impure, calls) in self.effects.items():
+            func.pure = not impure
+        changed = True
+        while changed:
+            changed = False
+            for definition, (func, impure, calls) in self.effects.items():
+                if func.pure and any(not callee.pure for callee, call in calls):
+                    func.pure = False
+                    changed = True
+        # Types are no dictionary keys (they overload ==)
+        callees = {id(func): [callee for callee, call in calls] for func, impure, calls in self.effects.values()}
+        for definition, (func, impure, calls) in self.effects.items():
+            definition.pure = func.pure
+            definition.memoize = func.pure and any(
+                    call not in self.tail_calls and self.reaches(callee, func, callees)
+                    for callee, call in calls)
+        self.effects = {}
+        self.tail_calls = set()
+
+    # Whether a call of start can lead to a call of target
+    def reaches(self, start : bongtypes.Function, target : bongtypes.Function, callees : typing.Dict[int, typing.List[bongtypes.Function]]) -> bool:
+        visited = set()
+        pending = [start]
+        while len(pending) > 0:
+            func = pending.pop()
+            if func is target:
+                return True
+            if id(func) not in visited:
+                visited.add(id(func))
+                pending.extend(callees.get(id(func), []))
+        return False
+
     # Determine the type of the ast node.
     # This method returns the TypeList (0, 1 or N elements) that the node will
     # evaluate to and a return hint that tells us if the node contains a
@@ -281,6 +512,10 @@ class TypeChecker:
             if node.result == None:
                 return bongtypes.TypeList([]), Return.YES
             res, turn = self.check(node.result) # turn should be false here
+            self.mark_escaping_parameters(node.result)
+            node.tail_call = self.tail_call(node.result)
+            if node.tail_call != None:
+                self.tail_calls.add(node.tail_call)
             return res, Return.YES
         if isinstance(node, ast.IfElseStatement):
             cond, turn = self.check(node.cond)
@@ -328,6 +563,12 @@ class TypeChecker:
                     f" to '{rhs}'"))
             if not self.is_writable(node.lhs):
                 raise TypecheckException("Lhs of assignment is no writable variable!", node.lhs)
+            self.mark_written_parameters(node.lhs)
+            if not isinstance(node.rhs, ast.AssignOp):
+                self.mark_escaping_parameters(node.rhs)
+                if self.mark_kept_values(node.rhs):
+                    for target in node.lhs:
+                        self.mark_access_chain(target)
             return lhs, Return.NO
         if isinstance(node, ast.BinOp):
             op = node.op
@@ -343,43 +584,46 @@ class TypeChecker:
                     # TODO "+" is a valid operator for arrays but we do not do
                     # the proper empty-array check with match_types() here. Should
                     # we do that?
-                    return TypeList([lhstyp + rhstyp]), Return.NO
-                if op == "-":
-                    return TypeList([lhstyp - rhstyp]), Return.NO
-                if op == "*":
-                    return TypeList([lhstyp * rhstyp]), Return.NO
-                if op == "/":
-                    return TypeList([lhstyp / rhstyp]), Return.NO
-                if op == "%":
-                    return TypeList([lhstyp % rhstyp]), Return.NO
-                if op == "^":
-                    return TypeList([lhstyp ** rhstyp]), Return.NO
-                if op == "&&":
+                    result = lhstyp + rhstyp
+                elif op == "-":
+                    result = lhstyp - rhstyp
+                elif op == "*":
+                    result = lhstyp * rhstyp
+                elif op == "/":
+                    result = lhstyp / rhstyp
+                elif op == "%":
+                    result = lhstyp % rhstyp
+                elif op == "^":
+                    result = lhstyp ** rhstyp
+                elif op == "&&":
                     if type(lhstyp)!=bongtypes.Boolean:
                         raise TypecheckException("Logical 'and' expects boolean operands. Left operand is not boolean.", node.lhs)
                     if type(rhstyp)!=bongtypes.Boolean:
                         raise TypecheckException("Logical 'and' expects boolean operands. Right operand is not boolean.", node.rhs)
-                    return TypeList([bongtypes.Boolean()]), Return.NO
-                if op == "||":
+                    result = bongtypes.Boolean()
+                elif op == "||":
                     if type(lhstyp)!=bongtypes.Boolean:
                         raise TypecheckException("Logical 'or' expects boolean operands. Left operand not boolean.", node.lhs)
                     if type(rhstyp)!=bongtypes.Boolean:
                         raise TypecheckException("Logical 'or' expects boolean operands. Right operand is not boolean.", node.rhs)
-                    return TypeList([bongtypes.Boolean()]), Return.NO
-                if op == "==":
-                    return TypeList([lhstyp.eq(rhstyp)]), Return.NO
-                if op == "!=":
-                    return TypeList([lhstyp.ne(rhstyp)]), Return.NO
-                if op == "<":
-                    return TypeList([lhstyp < rhstyp]), Return.NO
-                if op == ">":
-                    return TypeList([lhstyp > rhstyp]), Return.NO
-                if op == "<=":
-                    return TypeList([lhstyp <= rhstyp]), Return.NO
-                if op == ">=":
-                    return TypeList([lhstyp >= rhstyp]), Return.NO
+                    result = bongtypes.Boolean()
+                elif op == "==":
+                    result = lhstyp.eq(rhstyp)
+                elif op == "!=":
+                    result = lhstyp.ne(rhstyp)
+                elif op == "<":
+                    result = lhstyp < rhstyp
+                elif op == ">":
+                    result = lhstyp > rhstyp
+                elif op == "<=":
+                    result = lhstyp <= rhstyp
+                elif op == ">=":
+                    result = lhstyp >= rhstyp
                 else:
                     raise Exception("unrecognised binary operator: " + str(node.op))
+                # The engines use the operation specialised to the types
+                node.operation = operations.binary_operation(op, lhstyp, rhstyp)
+                return TypeList([result]), Return.NO
             except BongtypeException as e: # ... and transform to TypecheckExc
                 raise TypecheckException(e.msg, node)
         elif isinstance(node, ast.UnaryOp):
@@ -389,11 +633,13 @@ class TypeChecker:
                     rhs, turn = self.check(node.rhs)
                     if len(rhs)!=1 or type(rhs[0])!=bongtypes.Boolean:
                         raise TypecheckException("Logical 'not' expects boolean operand.", node)
+                    node.operation = operations.unary_operation(op, rhs[0])
                     return TypeList([bongtypes.Boolean()]), Return.NO
                 if op == "-":
                     rhstype, turn = self.check(node.rhs)
                     if len(rhstype)!=1 or not (type(rhstype[0])==bongtypes.Integer or type(rhstype[0])==bongtypes.Float):
                         raise TypecheckException("Negate expects number.", node)
+                    node.operation = operations.unary_operation(op, rhstype[0])
                     return rhstype, Return.NO
                 raise Exception("unrecognised unary operator: " + str(node.op))
             except BongtypeException as e: # ... and transform to TypecheckExc
@@ -407,8 +653,10 @@ class TypeChecker:
         elif isinstance(node, ast.Bool):
             return TypeList([bongtypes.Boolean()]), Return.NO
         elif isinstance(node, ast.SysCall):
+            self.impure = True
             return TypeList([bongtypes.Integer()]), Return.NO
         elif isinstance(node, ast.Pipeline):
+            self.impure = True
             # Also see evaluator -> ast.Pipeline, it is very similar
             if len(node.elements) < 2:
                 raise TypecheckException("Pipelines should have more than one element. This seems to be a parser bug.", node)
@@ -450,6 +698,7 @@ class TypeChecker:
                             pass
                         self.symbol_tree.restore_snapshot(assignto.symbol_tree_snapshot)
                         self.symbol_tree[name] = bongtypes.String()
+                    assignto.slots = [self.assign_slot(name) for name in names]
                 else:
                     output, turn = self.check(assignto)
                     writable = self.is_writable(assignto)
@@ -468,22 +717,43 @@ class TypeChecker:
             return TypeList([bongtypes.Integer()]), Return.NO
         elif isinstance(node, ast.Identifier):
             if node.name in self.symbol_tree:
+                node.slot = self.symbol_tree.get_index(node.name)
                 return TypeList([self.symbol_tree[node.name]]), Return.NO
             elif node.name in self.symbols_global:
+                node.slot = None
                 return TypeList([self.symbols_global[node.name]]), Return.NO
             raise TypecheckException(f"{node.name} is undefined.", node)
         elif isinstance(node, ast.IndexAccess):
             index, turn = self.check(node.rhs)
-            if len(index)!=1 or type(index[0])!=bongtypes.Integer:
-                raise TypecheckException("Indexing requires Integer.", node.rhs)
             lhs, turn = self.check(node.lhs)
             if len(lhs)!=1:
                 raise TypecheckException("Indexing requires a single variable.", node.lhs)
+            if isinstance(lhs[0], bongtypes.Map): # bong map
+                if len(index)!=1 or not lhs[0].key_type.sametype(index[0]):
+                    raise TypecheckException(f"Indexing requires {lhs[0].key_type}.", node.rhs)
+                return TypeList([lhs[0].value_type]), Return.NO
+            if len(index)!=1 or type(index[0])!=bongtypes.Integer:
+                raise TypecheckException("Indexing requires Integer.", node.rhs)
             if isinstance(lhs[0], bongtypes.String): # bong string
                 return lhs, Return.NO
             if isinstance(lhs[0], bongtypes.Array): # bong array
                 return TypeList([lhs[0].contained_type]), Return.NO
             raise TypecheckException("IndexAccess with unsupported type.", node.lhs)
+        elif isinstance(node, ast.SliceAccess):
+            for bound in (node.low, node.high):
+                if bound != None:
+                    index, turn = self.check(bound)
+                    if len(index)!=1 or type(index[0])!=bongtypes.Integer:
+                        raise TypecheckException("Slicing requires Integer bounds.", bound)
+            lhs, turn = self.check(node.lhs)
+            if len(lhs)!=1:
+                raise TypecheckException("Slicing requires a single variable.", node.lhs)
+            # Slices are not writable (see is_writable()). A slice of an array
+            # is a copy (on write) of the array's part, so it may escape from
+            # read-only parameters.
+            if isinstance(lhs[0], bongtypes.String) or isinstance(lhs[0], bongtypes.Array):
+                return lhs, Return.NO
+            raise TypecheckException("Slicing with unsupported type.", node.lhs)
         elif isinstance(node, ast.DotAccess):
             lhs, turn = self.check(node.lhs)
             if len(lhs)!=1:
@@ -493,6 +763,7 @@ class TypeChecker:
                     raise TypecheckException(f"Name '{node.rhs}' not found in"
                             f" struct '{node.lhs}'.", node)
                 value_type = lhs[0].fields[node.rhs]
+                node.field = lhs[0].field_names().index(node.rhs)
                 return TypeList([value_type]), Return.NO
             elif isinstance(lhs[0], bongtypes.Module): # module
                 modulepath = lhs[0].path
@@ -517,9 +788,29 @@ class TypeChecker:
             # checked. But anyways, logically, this is the right approach!
             symbol_tree_snapshot = self.symbol_tree.take_snapshot()
             self.symbol_tree.restore_snapshot(node.symbol_tree_snapshot)
+            # Each function call gets a new frame, starting with the parameters
+            frame_size = self.frame_size
+            parameters = self.parameters, self.parameter_types, self.readonly_parameters
+            function = self.function
+            self.function = node
+            effects = self.impure, self.calls
+            self.impure = False
+            self.calls = []
+            self.frame_size = 0
+            node.parameter_slots = [self.assign_slot(name) for name in node.parameter_names]
+            self.parameters = {slot: index for index, slot in enumerate(node.parameter_slots)}
+            self.parameter_types = func.parameter_types
+            self.readonly_parameters = [True] * len(node.parameter_slots)
             # Compare expected with actual result/return
             expect = func.return_types
             actual, turn = self.check(node.body)
+            node.frame_size = self.frame_size
+            node.readonly_parameters = self.readonly_parameters
+            self.frame_size = frame_size
+            self.parameters, self.parameter_types, self.readonly_parameters = parameters
+            self.function = function
+            self.effects[node] = func, self.impure, self.calls
+            self.impure, self.calls = effects
             match_types(expect, actual, node, "Function return type does not"
                 f" match function declaration. Declared '{expect}' but"
                 f" returned '{actual}'.")
@@ -539,24 +830,35 @@ class TypeChecker:
             if len(funcs)!=1:
                 raise TypecheckException(f"'{node.name}' does not resolve to a function.", node.name)
             func = funcs[0]
+            # A basic type called like a function is the conversion builtin
+            # of the same name, e.g. str(5)
+            if (type(func)==bongtypes.Typedef and isinstance(node.name, ast.Identifier)
+                    and node.name.name in bongtypes.basic_types
+                    and node.name.name in bong_builtins.functions):
+                func = bongtypes.BuiltinFunction(bong_builtins.functions[node.name.name][1])
             if type(func)!=bongtypes.Function and type(func)!=bongtypes.BuiltinFunction:
                 raise TypecheckException(f"'{node.name}' is not a function.", node)
             argtypes, turn = self.check(node.args)
             # Check builtin functions
             if isinstance(func, bongtypes.BuiltinFunction):
                 try:
-                    return func.check(argtypes), Return.NO
+                    results = func.check(argtypes)
                 except BongtypeException as e: # Convert to TypecheckException
                     raise TypecheckException(e.msg, node)
+                if isinstance(node.name, ast.Identifier) and node.name.name in bong_builtins.writing_builtins:
+                    self.mark_written_argument(node.args.elements[0])
+                return results, Return.NO
             # Otherwise, it is a bong function that has well-defined parameter types
             assert(isinstance(func, bongtypes.Function))
             match_types(func.parameter_types, argtypes, node,
                     (f"Function '{node.name}' expects parameters of type "
                     f"'{func.parameter_types}' but '{argtypes}' were given."))
+            self.calls.append((func, node))
             # If everything goes fine (function can be called), it returns
             # whatever the function declaration says \o/
             return func.return_types, Return.NO
         elif isinstance(node, ast.Print):
+            self.impure = True
             self.check(node.expr) # We can print anything but don't care
             return TypeList([]), Return.NO
         elif isinstance(node, ast.Let):
@@ -564,11 +866,13 @@ class TypeChecker:
             results, turn = self.check(node.expr)
             if len(node.names) != len(results):
                 raise TypecheckException("Number of expressions on rhs of let statement does not match the number of variables.", node)
+            self.mark_kept_values(node.expr)
             # Before handling the lhs of the let statement, set the correct
             # scope symbol table. This is necessary so that all symbol table
             # interaction affects the variables that are declared by the
             # let statement
             self.symbol_tree.restore_snapshot(node.symbol_tree_snapshot)
+            self.mark_escaping_parameters(node.expr)
             # Then, check the type information and store to symbol table
             for name, type_identifier, result in zip(node.names, node.types, results):
                 if isinstance(type_identifier, ast.BongtypeIdentifier):
@@ -578,6 +882,7 @@ class TypeChecker:
                     if not is_specific_type(result):
                         raise TypecheckException("Automatic type for variable '{}' but rhs is no definitive type either, '{}' found instead.".format(name, result), node)
                 self.symbol_tree[name] = result
+            node.slots = [self.assign_slot(name) for name in node.names]
             return TypeList([]), Return.NO
         elif isinstance(node, ast.Array):
             # Super complicated things can happen here:
@@ -591,11 +896,36 @@ class TypeChecker:
             # just have to check that all those types are equal.
             # I'm fascinated how everything magically works automatically. Isn't that beautiful?
             types, turn = self.check(node.elements)
+            self.mark_escaping_parameters(node.elements)
+            node.escapes = self.mark_kept_values(node.elements)
             inner_type : bongtypes.ValueType = bongtypes.AutoType()
             # Otherwise, all contained types should match
             for i, typ in enumerate(types):
                 inner_type = merge_types(inner_type, typ, node)
             return TypeList([bongtypes.Array(inner_type)]), Return.NO
+        elif isinstance(node, ast.Map):
+            # Like arrays, all keys and all values should match
+            key_type : bongtypes.ValueType = bongtypes.AutoType()
+            value_type = bongtypes.AutoType()
+            for key, value in zip(node.keys, node.values):
+                keytypes, turn = self.check(key)
+                if len(keytypes) != 1:
+                    raise TypecheckException("Expression does not evaluate"
+                            " to a single value.", key)
+                if not isinstance(keytypes[0], bongtypes.key_types):
+                    raise TypecheckException(f"Type {keytypes[0]} can not be"
+                            " used as a map key.", key)
+                key_type = merge_types(key_type, keytypes[0], key)
+                valuetypes, turn = self.check(value)
+                self.mark_escaping_parameters(value)
+                node.escapes = self.mark_kept_values(value) or node.escapes
+                if len(valuetypes) != 1:
+                    raise TypecheckException("Expression does not evaluate"
+                            " to a single value.", value)
+                if not isinstance(valuetypes[0], bongtypes.ValueType):
+                    raise TypecheckException("ValueType expected", value)
+                value_type = merge_types(value_type, valuetypes[0], value)
+            return TypeList([bongtypes.Map(key_type, value_type)]), Return.NO
         elif isinstance(node, ast.StructValue):
             struct_types, turn = self.check(node.name)
             if len(struct_types)!=1:
@@ -607,6 +937,8 @@ class TypeChecker:
             fields : typing.Dict[str, bongtypes.ValueType] = {}
             for name, value in node.fields.items():
                 argtypes, turn = self.check(value)
+                self.mark_escaping_parameters(value)
+                self.mark_kept_values(value)
                 if len(argtypes) != 1:
                     raise TypecheckException("Expression does not evaluate"
                             " to a single value.", value)
@@ -618,6 +950,7 @@ class TypeChecker:
             # type's name into the struct value here.
             struct_val = bongtypes.Struct(struct_type.value_type.name, fields)
             typ = merge_types(struct_type.value_type, struct_val, node)
+            node.field_names = struct_type.value_type.field_names()
             return TypeList([typ]), Return.NO
         elif isinstance(node, ast.ExpressionList):
             types = bongtypes.TypeList([])
@@ -654,6 +987,9 @@ def merge_types(x : bongtypes.ValueType, y : bongtypes.ValueType, node : ast.Bas
         return x
     if isinstance(x, bongtypes.Array) and isinstance(y, bongtypes.Array):
         return bongtypes.Array(merge_types(x.contained_type, y.contained_type, node, msg))
+    if isinstance(x, bongtypes.Map) and isinstance(y, bongtypes.Map):
+        return bongtypes.Map(merge_types(x.key_type, y.key_type, node, msg),
+                merge_types(x.value_type, y.value_type, node, msg))
     if isinstance(x, bongtypes.Struct) and isinstance(y, bongtypes.Struct):
         if x.name != y.name:
             raise TypecheckException(mergemsg(f"Structs {x.name} and {y.name}"
@@ -693,6 +1029,8 @@ def is_specific_type(x : bongtypes.BaseType) -> bool:
         return False
     if isinstance(x, bongtypes.Array):
         return is_specific_type(x.contained_type)
+    if isinstance(x, bongtypes.Map):
+        return is_specific_type(x.key_type) and is_specific_type(x.value_type)
     if isinstance(x, bongtypes.Struct):
         for contained_type in x.fields.values():
             if not is_specific_type(contained_type):
@@ -704,6 +1042,74 @@ def is_specific_types(x : bongtypes.TypeList) -> bool:
             return False
     return True
 
+# Modules are identified by the real path of their file
+def module_key(path : str) -> str:
+    return os.path.realpath(path)
+
+# Reads and parses modules (or loads them from the module cache). If more
+# than one module is requested at once, they are loaded concurrently by a
+# process pool with one worker per CPU. The pool is started on first use and
+# reused until the loader is closed.
+class ModuleLoader:
+    def __init__(self, workers : typing.Optional[int] = None):
+        self.workers = workers if workers != None else (os.cpu_count() or 1)
+        self.executor : typing.Optional[concurrent.futures.ProcessPoolExecutor] = None
+
+    # Returns the list of loaded modules in the order of the given paths.
+    # Instead of a module, an item is None if parsing failed or the OSError
+    # if the file could not be read. Only the first parse error is reported,
+    # the typechecker stops at the first failed import anyway.
+    def load(self, paths : typing.List[str]) -> typing.List[typing.Any]:
+        if len(paths) < 2 or self.workers < 2:
+            results = [load_module(path) for path in paths]
+        else:
+            if self.executor == None:
+                # The workers are short-lived, collecting garbage while
+                # parsing would only slow them down
+                self.executor = concurrent.futures.ProcessPoolExecutor(
+                        self.workers, initializer=gc.disable)
+            # The results are pickled by the workers and unpickled here
+            with module_cache.paused_gc():
+                futures = [self.executor.submit(load_module, path) for path in paths]
+                results = [self.result(future, path) for future, path in zip(futures, paths)]
+        errors = [result for result in results if isinstance(result, str)]
+        if len(errors) > 0:
+            print(errors[0], end="", file=sys.stderr)
+        return [None if isinstance(result, str) else result for result in results]
+
+    # Deeply nested asts can exceed the recursion limit of pickle on their
+    # way back from the worker, those modules are loaded here instead.
+    def result(self, future : concurrent.futures.Future, path : str) -> typing.Any:
+        try:
+            return future.result()
+        except (RecursionError, pickle.PicklingError):
+            return load_module(path)
+
+    def close(self):
+        if self.executor != None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def __enter__(self):
+        return self
+    def __exit__(self, *args):
+        self.close()
+
+# Returns the module, the OSError if the file could not be read or the
+# error message if parsing failed.
+def load_module(path : str) -> typing.Any:
+    errors = io.StringIO()
+    try:
+        with contextlib.redirect_stderr(errors):
+            unit = module_cache.parse_module(path)
+    except OSError as e:
+        return e
+    except RecursionError:
+        return f"ParseError in {path}: Expressions are nested too deeply.\n"
+    if unit == None:
+        return errors.getvalue()
+    return unit
+
 class TypecheckException(Exception):
     def __init__(self, msg : str, node : ast.BaseNode):
         super().__init__(self, msg)
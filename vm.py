@@ -0,0 +1,225 @@
+from __future__ import annotations
+import ast
+import bytecode
+from bytecode import Code
+from bongvalues import ValueList, ArrayValue, MapValue, copy_value, copy_values, slice_value, escape
+from evaluator import Eval
+import operations
+import sys
+import typing
+
+# The vm executes the bytecode generated by bytecode.Compiler in a single
+# dispatch loop. Bong function calls do not recurse in python: The caller's
+# state (code, program counter, frame, operand stack, result register) is
+# pushed to an explicit call stack and restored on return.
+#
+# Program calls, pipelines and cd are inherited from Eval, just like the
+# top-level frame (Eval.locals) which is retained across evaluations in shell
+# mode.
+class VM(Eval):
+    def __init__(self, printfunc=print):
+        super().__init__(printfunc)
+        self.compiler = bytecode.Compiler(self.modules, self.memo)
+
+    def evaluate(self, node : ast.BaseNode) -> ValueList:
+        if isinstance(node, ast.Program):
+            # Register all imported modules
+            for k, m in node.modules.items():
+                self.modules[k] = m
+            return self.run(self.compile(node.main_unit))
+        elif isinstance(node, ast.TranslationUnit):
+            return self.run(self.compile(node))
+        raise Exception("The vm can only evaluate ast.Programs and ast.TranslationUnits.")
+
+    # The main unit's function definitions and symbols are retained across
+    # evaluations in shell mode, just like in Eval.evaluate().
+    def compile(self, node : ast.TranslationUnit) -> Code:
+        unit = self.current_unit.unit
+        for k, f in node.function_definitions.items():
+            unit.function_definitions[k] = f
+        unit.symbols_global = node.symbols_global
+        if len(self.locals) < node.frame_size:
+            self.locals.extend([None] * (node.frame_size - len(self.locals)))
+        return self.compiler.compile_unit(node, unit)
+
+    # Run the top-level code object with the top-level frame
+    def run(self, code : Code) -> ValueList:
+        # Opcodes and frequently used functions as locals for fast access
+        LOAD, CONST, STORE, BINARY, JUMP_IF_FALSE, JUMP, CALL, CALL_MEMO, \
+                TAIL_CALL, CALL_BUILTIN, COPY, ESCAPE, RETURN, RETURN_RESULT, FIRST, BUILD_LIST, \
+                NEW_LIST, APPEND, UNPACK, DUP, POP, SET_RESULT, NOT, NEG, INDEX, SLICE, \
+                STORE_INDEX, GET_FIELD, STORE_FIELD, BUILD_ARRAY, BUILD_MAP, \
+                BUILD_STRUCT, PRINT, SYSCALL, PIPELINE, UNKNOWN = range(len(bytecode.OPCODES))
+        binary = [operations.BINARY_OPERATIONS[name][0] for name in bytecode.BINARY_OPERATIONS]
+        callstack : typing.List[typing.Tuple[typing.Any, ...]] = []
+        # State of the current call
+        instructions = code.instructions
+        constants = code.constants
+        pc = 0
+        frame = self.locals
+        stack : typing.List[typing.Any] = []
+        result : typing.Optional[ValueList] = None
+        while True:
+            op = instructions[pc]
+            arg = instructions[pc+1]
+            pc += 2
+            if op == LOAD:
+                stack.append(frame[arg])
+            elif op == CONST:
+                stack.append(constants[arg])
+            elif op == STORE:
+                frame[arg] = stack.pop()
+            elif op == BINARY:
+                rhs = stack.pop()
+                stack[-1] = binary[arg](stack[-1], rhs)
+            elif op == JUMP_IF_FALSE:
+                if stack.pop() != True:
+                    pc = arg
+            elif op == JUMP:
+                pc = arg
+            elif op == CALL or op == CALL_MEMO:
+                callee = constants[arg]
+                count = len(callee.parameter_slots)
+                memoized = None
+                if op == CALL_MEMO:
+                    key = tuple(stack[len(stack)-count:])
+                    cached = callee.cache.get(key)
+                    if cached != None:
+                        del stack[len(stack)-count:]
+                        stack.append(ValueList(cached))
+                        continue
+                    # The result is cached on return
+                    memoized = (callee.cache, key)
+                callee_frame = [None] * callee.frame_size
+                if count > 0:
+                    # The arguments are copied already (COPY) if required
+                    arguments = stack[-count:]
+                    del stack[-count:]
+                    for slot, value in zip(callee.parameter_slots, arguments):
+                        callee_frame[slot] = value
+                callstack.append((instructions, constants, pc, frame, stack, result, memoized))
+                instructions = callee.instructions
+                constants = callee.constants
+                pc = 0
+                frame = callee_frame
+                stack = []
+                result = None
+            elif op == TAIL_CALL:
+                # Like CALL, but the callee takes over the current call
+                # instead of pushing it to the call stack. Tail recursive
+                # functions run in constant space.
+                callee = constants[arg]
+                callee_frame = [None] * callee.frame_size
+                count = len(callee.parameter_slots)
+                if count > 0:
+                    arguments = stack[-count:]
+                    del stack[-count:]
+                    for slot, value in zip(callee.parameter_slots, arguments):
+                        callee_frame[slot] = value
+                instructions = callee.instructions
+                constants = callee.constants
+                pc = 0
+                frame = callee_frame
+                stack = []
+                result = None
+            elif op == RETURN or op == RETURN_RESULT:
+                if op == RETURN:
+                    returned = stack.pop()
+                    if len(callstack) == 0:
+                        # A top-level return means exit, see Eval.evaluate()
+                        sys.exit(returned[0] if len(returned) > 0 else None)
+                else:
+                    returned = result if result != None else ValueList([])
+                    if len(callstack) == 0:
+                        return returned
+                instructions, constants, pc, frame, stack, result, memoized = callstack.pop()
+                if memoized != None:
+                    memoized[0].put(memoized[1], returned.elements)
+                stack.append(returned)
+            elif op == FIRST:
+                stack[-1] = stack[-1][0]
+            elif op == BUILD_LIST:
+                values = ValueList(stack[len(stack)-arg:])
+                del stack[len(stack)-arg:]
+                stack.append(values)
+            elif op == SET_RESULT:
+                result = stack.pop()
+            elif op == POP:
+                stack.pop()
+            elif op == INDEX:
+                container = stack.pop()
+                stack[-1] = container[stack[-1]]
+            elif op == SLICE:
+                container = stack.pop()
+                high = stack.pop()
+                stack[-1] = slice_value(container, stack[-1], high)
+            elif op == STORE_INDEX:
+                container = stack.pop()
+                index = stack.pop()
+                container[index] = stack.pop()
+            elif op == GET_FIELD:
+                stack[-1] = stack[-1][arg]
+            elif op == STORE_FIELD:
+                struct = stack.pop()
+                struct[arg] = stack.pop()
+            elif op == CALL_BUILTIN:
+                builtin, count, copies = constants[arg]
+                arguments = stack[len(stack)-count:]
+                del stack[len(stack)-count:]
+                if copies:
+                    # No reference to the originals is kept so that they do
+                    # not share their storage with the copies any longer
+                    arguments = copy_values(arguments)
+                stack.append(builtin(arguments))
+            elif op == COPY:
+                stack[-1] = copy_value(stack[-1])
+            elif op == ESCAPE:
+                escape(stack[-1])
+            elif op == NOT:
+                stack[-1] = not stack[-1]
+            elif op == NEG:
+                stack[-1] = -stack[-1]
+            elif op == NEW_LIST:
+                stack.append(ValueList([]))
+            elif op == APPEND:
+                value = stack.pop()
+                stack[-1].append(value)
+            elif op == UNPACK:
+                values = stack.pop()
+                if len(values) != arg:
+                    raise Exception("number of expressions between rhs and lhs do not match")
+                stack.extend(reversed(values.elements))
+            elif op == DUP:
+                stack.append(stack[-1])
+            elif op == BUILD_ARRAY:
+                elements = ArrayValue(stack[len(stack)-arg:])
+                del stack[len(stack)-arg:]
+                stack.append(elements)
+            elif op == BUILD_MAP:
+                items = stack[len(stack)-2*arg:]
+                del stack[len(stack)-2*arg:]
+                stack.append(MapValue(zip(items[::2], items[1::2])))
+            elif op == BUILD_STRUCT:
+                cls, offsets = constants[arg]
+                count = len(cls.field_names)
+                fields = stack[len(stack)-count:]
+                del stack[len(stack)-count:]
+                if offsets != None:
+                    ordered : typing.List[typing.Any] = [None] * count
+                    for offset, value in zip(offsets, fields):
+                        ordered[offset] = value
+                    fields = ordered
+                stack.append(cls(fields))
+            elif op == PRINT:
+                self.printfunc(stack.pop())
+            elif op == SYSCALL:
+                stack.append(self.callprogram(constants[arg]))
+            elif op == PIPELINE:
+                syscalls, numOutputPipes = constants[arg]
+                outputs, returncode = self.run_pipeline(syscalls, stack.pop(), numOutputPipes)
+                stack.append(returncode)
+                stack.append(outputs)
+            elif op == UNKNOWN:
+                raise Exception(f"Unknown identifier '{constants[arg]}' specified. TODO: global environment.")
+            else:
+                raise Exception(f"unknown opcode {op}")